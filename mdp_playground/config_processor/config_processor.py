@@ -1,15 +1,21 @@
 from functools import reduce
 from ray.rllib.models import ModelCatalog
-from ray.rllib.models.preprocessors import OneHotPreprocessor
+from ray.rllib.models.preprocessors import OneHotPreprocessor, Preprocessor
 import warnings
 import numpy as np
 from mdp_playground.envs import RLToyEnv
+from mdp_playground.envs.rl_toy_env import clear_shared_mdp_cache
+from mdp_playground.spaces.image_multi_discrete import unpack_image
 import mdp_playground
 from ray.tune.registry import register_env
 import copy
 import sys
 import os
 
+# The MDP caches in shared memory created by prebuild_shared_mdp(), which are
+# removed in post_processing()
+shared_mdp_cache_paths = []
+
 mujoco_envs = [
     "HalfCheetahWrapper-v3",
     "HopperWrapper-v3",
@@ -18,7 +24,23 @@ mujoco_envs = [
 ]
 
 
+class UnpackBitsPreprocessor(Preprocessor):
+    """Unpacks the bit-packed image observations of an ImageMultiDiscrete space with bit_packed=True, i.e., of RLToyEnv with image_bit_packed=True, into uint8 images with pixels that are 0 or 255.
+
+    Note that RLlib stores preprocessed observations in sample batches. To keep bit-packed observations in a replay buffer, they need to be unpacked with unpack_image() in a custom model instead.
+    """
+
+    def _init_shape(self, obs_space, options):
+        self.height = obs_space.height
+        return obs_space.unpacked_shape
+
+    def transform(self, observation):
+        self.check_shape(observation)
+        return unpack_image(observation, self.height)
+
+
 ModelCatalog.register_custom_preprocessor("ohe", OneHotPreprocessor)
+ModelCatalog.register_custom_preprocessor("unpack_bits", UnpackBitsPreprocessor)
 
 
 # def init_ray(log_level=None, tmp_dir=None, include_webui=None,
@@ -867,6 +889,9 @@ def combined_processing(*static_configs, varying_configs, framework="ray", algor
 
         final_configs[i]["timesteps_total"] = timesteps_total
 
+        if final_configs[i]["env"] in ["RLToy-v0", "RLToyFiniteHorizon-v0"]:
+            prebuild_shared_mdp(final_configs[i]["env_config"])
+
     # Post-processing for Ray:
     if framework.lower() == "ray":
         for i in range(len(final_configs)):
@@ -926,6 +951,23 @@ def combined_processing(*static_configs, varying_configs, framework="ray", algor
     return final_configs
 
 
+def prebuild_shared_mdp(env_config):
+    """Generates the MDP for an RLToyEnv config with shared_mdp set once in the
+    driver, so that it's cached in shared memory before the workers start.
+    The workers then load the cached MDP and share one copy of its tables
+    instead of each generating their own. The MDPs are generated one after the
+    other and only in the shared memory of the driver's node; workers on other
+    nodes generate and cache the MDP themselves. The cache entries are recorded
+    in shared_mdp_cache_paths and removed by post_processing()."""
+    if "shared_mdp" in env_config and env_config["shared_mdp"]:
+        env_config_copy = copy.deepcopy(env_config)
+        env_config_copy["verbose"] = False
+        env = RLToyEnv(**env_config_copy)
+        env.close()
+        if env.mdp_cache_path is not None:
+            shared_mdp_cache_paths.append(env.mdp_cache_path)
+
+
 def create_gym_env_wrapper_mujoco_wrapper(config, wrapped_mujoco_env):
     """Creates a GymEnvWrapper around a MujocoEnvWrapper"""
     from mdp_playground.envs.gym_env_wrapper import GymEnvWrapper
@@ -988,6 +1030,9 @@ def deepmerge(a, b, path=None, overwrite=True):
 
 
 def post_processing(framework="ray"):
+    """Cleans up at the end of a run of experiments: removes the MDP caches that prebuild_shared_mdp() created in shared memory and shuts down Ray."""
+    clear_shared_mdp_cache(shared_mdp_cache_paths)
+    del shared_mdp_cache_paths[:]
     if framework == "ray":
         import ray
 
@@ -1,8 +1,10 @@
 from mdp_playground.envs.rl_toy_env import RLToyEnv
+from mdp_playground.envs.rl_toy_vec_env import RLToyVecEnv
 from gym import error
 
 try:
     from mdp_playground.envs.gym_env_wrapper import GymEnvWrapper
+    from mdp_playground.envs.gym_vec_env_wrapper import GymVecEnvWrapper
     from mdp_playground.envs.mujoco_env_wrapper import get_mujoco_wrapper
 except error.DependencyNotInstalled as e:
     print("Exception:", type(e), e, "caught. You may need to install Ray or mujoco-py.")
@@ -1,14 +1,97 @@
 import gym
 import copy
 import numpy as np
+from collections import deque
 import sys
 from gym.spaces import Box, Tuple
 from gym.wrappers import AtariPreprocessing
-from mdp_playground.envs.rl_toy_env import RLToyEnv
+from mdp_playground.envs.rl_toy_env import RLToyEnv, sample_noisy_discrete_state
 import warnings
-import PIL.ImageDraw as ImageDraw
-import PIL.Image as Image
-from PIL.Image import FLIP_LEFT_RIGHT, FLIP_TOP_BOTTOM
+
+
+def get_inverse_map(size, scaled_size, rotation, flip):
+    """Computes the inverse mapping for an image transform: for every pixel of the transformed image, the pixel of the square source image of side size that it's sampled from (nearest neighbour). The source image is scaled to side scaled_size, then rotated counter-clockwise by rotation degrees and then flipped, all around its centre.
+
+    Parameters
+    ----------
+    size : int
+        The side of the square source image
+    scaled_size : int
+        The side of the scaled image
+    rotation : int
+        The rotation in degrees
+    flip : int
+        0 for no flip, 1 to flip left-right and 2 to flip top-bottom
+
+    Returns
+    -------
+    tuple of 4 np.ndarrays
+        The offsets dx and dy of the transformed pixels from the centre of the transformed image along the x (column) and y (row) axes and the rows and columns of the source pixels they are sampled from
+    """
+    # The rotated image needs a larger window
+    window = int(np.ceil(scaled_size * np.sqrt(2))) + 2 if rotation else scaled_size
+    offsets = np.arange(-(window // 2), window - window // 2)
+    dx, dy = np.meshgrid(offsets, offsets, indexing="ij")
+    dx, dy = dx.ravel(), dy.ravel()
+    # Centres of the transformed pixels
+    ux, uy = dx + 0.5, dy + 0.5
+    if flip == 1:
+        ux = -ux
+    elif flip == 2:
+        uy = -uy
+    # Undo the rotation; y points downwards in images, so a counter-clockwise
+    # rotation on screen is clockwise in (x, y).
+    theta = np.deg2rad(rotation)
+    cos_, sin_ = np.cos(theta), np.sin(theta)
+    ux, uy = ux * cos_ - uy * sin_, ux * sin_ + uy * cos_
+    # Undo the scaling
+    src_cols = np.floor(ux * size / scaled_size + size / 2).astype(int)
+    src_rows = np.floor(uy * size / scaled_size + size / 2).astype(int)
+    valid = (
+        (src_cols >= 0) & (src_cols < size) & (src_rows >= 0) & (src_rows < size)
+    )
+
+    return dx[valid], dy[valid], src_rows[valid], src_cols[valid]
+
+
+class LazyFrames(object):
+    """A stack of frames that is only concatenated along the last axis (or stacked along a new last axis for 2-D frames, e.g., grayscale images without a channel axis) when it is converted to a NumPy array, e.g., with np.asarray(). It holds references to the frames, which are shared with the stacks of the neighbouring time steps, so that a replay buffer storing these objects stores each frame only once. The frames must therefore not be modified after they are stacked.
+
+    Parameters
+    ----------
+    frames : list of np.ndarray
+        The frames to stack, oldest first
+    """
+
+    def __init__(self, frames):
+        self.frames = frames
+
+    def __array__(self, dtype=None):
+        if self.frames[0].ndim == 2:
+            stacked = np.stack(self.frames, axis=-1)
+        else:
+            stacked = np.concatenate(self.frames, axis=-1)
+        if dtype is not None:
+            stacked = stacked.astype(dtype)
+        return stacked
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, i):
+        return np.asarray(self)[i]
+
+    @property
+    def shape(self):
+        frame_shape = self.frames[0].shape
+        if len(frame_shape) == 2:
+            return frame_shape + (len(self.frames),)
+        return frame_shape[:-1] + (frame_shape[-1] * len(self.frames),)
+
+    @property
+    def dtype(self):
+        return self.frames[0].dtype
+
 
 # def get_gym_wrapper(base_class):
 
@@ -20,12 +103,14 @@ class GymEnvWrapper(gym.Env):
         transition noise (for discrete environments)
         reward delay
         reward noise
-        image_transforms
+        image_transforms (shift, scale, rotate and flip)
 
     The wrapper is pretty general and can be applied to any Gym Environment. The environment should be instantiated and passed as the 1st argument to the __init__ method of this class. If using this wrapper with Atari, additional keys may be added specifying either atari_preprocessing = True or wrap_deepmind_ray = True. These would use the AtariPreprocessing wrapper from OpenAI Gym or wrap_deepmind() wrapper from Ray Rllib.
 
     For AtariPreprocessing, additional key-value pairs specifying grayscale_obs and frame_skip may be provided. These have the same meaning as in AtariPreprocessing.
 
+    Observations may be stacked natively by providing frame_stack, the number of most recent observations to stack along their last axis (along a new last axis for 2-D observations, e.g., grayscale Atari frames). It can't be used together with wrap_deepmind_ray, which already stacks frames. The stacked observations are returned as LazyFrames, which are only concatenated when they are converted to a NumPy array.
+
     """
 
     # Should not be a gym.Wrapper because 1) gym.Wrapper has member variables observation_space and action_space while here with irrelevant_features we would have multiple observation_spaces and this could cause conflict with code that assumes any subclass of gym.Wrapper should have these member variables.
@@ -61,9 +146,9 @@ class GymEnvWrapper(gym.Env):
         if "delay" in config:
             self.delay = config["delay"]
             assert config["delay"] >= 0
-            self.reward_buffer = [0.0] * (self.delay)
         else:
             self.delay = 0
+        self.reset_reward_buffer()
 
         if "transition_noise" in config:
             self.transition_noise = config["transition_noise"]
@@ -109,6 +194,12 @@ class GymEnvWrapper(gym.Env):
                 self.image_padding = config["image_padding"]
             else:
                 self.image_padding = 20
+            # Canvas for the image transforms, see get_transformed_image()
+            self.image_canvas = None
+            self.image_canvas_region = None
+            # Inverse maps for the scale, rotate and flip transforms, keyed
+            # by (scaled size, rotation, flip)
+            self.image_inverse_maps = {}
 
             if "image_sh_quant" not in config:
                 if "shift" in self.image_transforms:
@@ -150,6 +241,10 @@ class GymEnvWrapper(gym.Env):
         if (
             "wrap_deepmind_ray" in config and config["wrap_deepmind_ray"]
         ):  # hack ##TODO remove?
+            assert "frame_stack" not in config or config["frame_stack"] == 1, (
+                "frame_stack is not supported together with wrap_deepmind_ray,"
+                " which already stacks frames."
+            )
             from ray.rllib.env.atari_wrappers import wrap_deepmind, is_atari
             self.env = wrap_deepmind(self.env, dim=42, framestack=True)
         elif "atari_preprocessing" in config and config["atari_preprocessing"]:
@@ -237,6 +332,23 @@ class GymEnvWrapper(gym.Env):
                     low=ext_low, high=ext_high, dtype=env_act_dtype
                 )  # TODO Use BoxExtended here and above?
 
+                # The base and irrelevant observations are written into slices of
+                # a persistent buffer instead of being concatenated. If
+                # reuse_observation_buffer is True, the buffer itself is returned
+                # by step() and reset() and is overwritten by the next call, so
+                # callers that hold on to observations need to copy them.
+                assert (
+                    len(env_obs_shape) == 1
+                ), "Length of shape of observation space should be 1."
+                self.env_obs_dim = env_obs_shape[0]
+                self.observation_buffer = np.empty(
+                    self.observation_space.shape, dtype=self.observation_space.dtype
+                )
+                if "reuse_observation_buffer" not in config:
+                    self.reuse_observation_buffer = False
+                else:
+                    self.reuse_observation_buffer = config["reuse_observation_buffer"]
+
             self.observation_space.seed(obs_space_seed)  # #seed
             self.action_space.seed(act_space_seed)  # #seed
         else:  # no irrelevant features
@@ -262,6 +374,38 @@ class GymEnvWrapper(gym.Env):
             else:  # no image transforms
                 self.observation_space = self.env.observation_space
 
+        # The frame_stack most recent observations are stacked along their last
+        # axis, or along a new last axis for 2-D observations. The frames are held
+        # in a circular buffer and returned as LazyFrames, so that each frame is
+        # stored only once.
+        if "frame_stack" not in config:
+            self.frame_stack = 1
+        else:
+            self.frame_stack = config["frame_stack"]
+            assert self.frame_stack >= 1
+        if self.frame_stack > 1:
+            assert "irrelevant_features" not in config, (
+                "frame_stack is currently not supported together with irrelevant"
+                " features."
+            )
+            assert isinstance(self.observation_space, Box)
+            self.frames = deque(maxlen=self.frame_stack)
+            low = self.observation_space.low
+            high = self.observation_space.high
+            if len(self.observation_space.shape) == 2:
+                low = np.stack([low] * self.frame_stack, axis=-1)
+                high = np.stack([high] * self.frame_stack, axis=-1)
+            else:
+                reps = (1,) * (len(self.observation_space.shape) - 1) + (
+                    self.frame_stack,
+                )
+                low = np.tile(low, reps)
+                high = np.tile(high, reps)
+            self.observation_space = Box(
+                low=low, high=high, dtype=self.observation_space.dtype,
+            )
+            self.observation_space.seed(obs_space_seed)  # #seed
+
         self.total_episodes = 0
 
         # if "action_loss_weight" in config: #hack
@@ -302,15 +446,12 @@ class GymEnvWrapper(gym.Env):
             self.config["state_space_type"] == "discrete"
             and self.transition_noise > 0.0
         ):
-            probs = (
-                np.ones(shape=(self.env.action_space.n,))
-                * self.transition_noise
-                / (self.env.action_space.n - 1)
-            )
-            probs[action] = 1 - self.transition_noise
             old_action = action
-            action = int(
-                self.np_random.choice(self.env.action_space.n, size=1, p=probs)
+            action = sample_noisy_discrete_state(
+                self.np_random,
+                action,
+                self.env.action_space.n,
+                self.transition_noise,
             )  # random
             if old_action != action:
                 # print("NOISE inserted", old_action, action)
@@ -325,32 +466,40 @@ class GymEnvWrapper(gym.Env):
                 next_state_irr, _, done_irr, _ = self.irr_toy_env.step(action[1])
                 next_state = tuple([next_state, next_state_irr])
             else:
-                # env_act_shape is the shape of the underlying env's action space and we
-                # sub-select those dimensions from the total action space next and apply
-                # to the underlying env:
-                next_state, reward, done, info = self.env.step(
-                    action[: self.env_act_shape[0]]
+                action, action_irr = self.split_action(action)
+                next_state, reward, done, info = self.env.step(action)
+                next_state_irr, _, done_irr, _ = self.irr_toy_env.step(action_irr)
+                next_state = self.get_irrelevant_features_observation(
+                    next_state, next_state_irr
                 )
-                next_state_irr, _, done_irr, _ = self.irr_toy_env.step(
-                    action[self.env_act_shape[0]:]
-                )
-                next_state = np.concatenate((next_state, next_state_irr))
         else:
             next_state, reward, done, info = self.env.step(action)
 
         if self.image_transforms:
             next_state = self.get_transformed_image(next_state)
 
+        if self.frame_stack > 1:
+            self.frames.append(next_state)
+            next_state = LazyFrames(list(self.frames))
+
         if done:
             # if episode is finished return the rewards that were delayed and not
             # handed out before ##TODO add test case for this
-            reward = np.sum(self.reward_buffer)
-        else:
-            self.reward_buffer.append(reward)
+            # The sum is computed from the buffer, oldest reward first, instead of
+            # being kept as a running sum so that it doesn't drift from the sum
+            # of the delayed rewards over long episodes.
+            reward = np.sum(
+                self.reward_buffer[self.reward_buffer_index:]
+                + self.reward_buffer[: self.reward_buffer_index]
+            )
+        elif self.delay > 0:
+            # The oldest reward in the circular buffer is handed out and
+            # replaced by the current one
             old_reward = reward
-            reward = self.reward_buffer[0]
+            reward = self.reward_buffer[self.reward_buffer_index]
+            self.reward_buffer[self.reward_buffer_index] = old_reward
+            self.reward_buffer_index = (self.reward_buffer_index + 1) % self.delay
             # print("rewards:", self.reward_buffer, old_reward, reward)
-            del self.reward_buffer[0]
 
         # random ###TODO Would be better to parameterise this in terms of state,
         # action and time_step as well. Would need to change implementation to
@@ -363,6 +512,24 @@ class GymEnvWrapper(gym.Env):
 
         return next_state, reward, done, info
 
+    def split_action(self, action):
+        """Splits an action for continuous envs with irrelevant features into the actions for the base env and the irrelevant toy env. env_act_shape is the shape of the underlying env's action space and the actions are views of the first env_act_shape[0] and the remaining dimensions of action, so no copies are made."""
+        action = np.asarray(action)
+        return action[: self.env_act_shape[0]], action[self.env_act_shape[0]:]
+
+    def get_irrelevant_features_observation(self, state, state_irr):
+        """Writes the observations of the base env and the irrelevant toy env for continuous envs with irrelevant features into observation_buffer and returns it, or a copy of it if reuse_observation_buffer is False."""
+        self.observation_buffer[: self.env_obs_dim] = state
+        self.observation_buffer[self.env_obs_dim:] = state_irr
+        if self.reuse_observation_buffer:
+            return self.observation_buffer
+        return self.observation_buffer.copy()
+
+    def reset_reward_buffer(self):
+        """Resets the circular buffer of the delayed rewards. reward_buffer_index points to the oldest reward in the buffer."""
+        self.reward_buffer = [0.0] * (self.delay)
+        self.reward_buffer_index = 0
+
     def reset(self):
         # on episode "end" stuff (to not be invoked when reset() called when
         # self.total_episodes = 0; end is in quotes because it may not be a true
@@ -383,7 +550,7 @@ class GymEnvWrapper(gym.Env):
                   str(self.total_transitions_episode))
 
         # on episode start stuff:
-        self.reward_buffer = [0.0] * (self.delay)
+        self.reset_reward_buffer()
 
         self.total_episodes += 1
 
@@ -403,13 +570,20 @@ class GymEnvWrapper(gym.Env):
             else:
                 reset_state = self.env.reset()
                 reset_state_irr = self.irr_toy_env.reset()
-                reset_state = np.concatenate((reset_state, reset_state_irr))
+                reset_state = self.get_irrelevant_features_observation(
+                    reset_state, reset_state_irr
+                )
         else:
             reset_state = self.env.reset()
 
         if self.image_transforms:
             reset_state = self.get_transformed_image(reset_state)
 
+        if self.frame_stack > 1:
+            # The stack is filled with the start state
+            self.frames.extend([reset_state] * self.frame_stack)
+            reset_state = LazyFrames(list(self.frames))
+
         return reset_state
         # return super(GymEnvWrapper, self).reset()
 
@@ -437,14 +611,10 @@ class GymEnvWrapper(gym.Env):
 
         return self.seed_
 
-    def get_transformed_image(self, env_img):
-        # ###TODO write tests
-
+    def get_image_geometry(self):
+        """Returns the height, width and number of channels of the base env's images and the width and height of the padded canvas they're placed on."""
         height = self.env.observation_space.shape[0]
         width = self.env.observation_space.shape[1]
-        image_padding = self.image_padding
-        tot_width = width + image_padding * 2
-        tot_height = height + image_padding * 2
         assert height == width, "Currently only square images are supported."
         if len(self.env.observation_space.shape) == 3:
             channels = self.env.observation_space.shape[2]
@@ -452,55 +622,48 @@ class GymEnvWrapper(gym.Env):
             channels = 1
         else:
             raise ValueError()
+        tot_width = width + self.image_padding * 2
+        tot_height = height + self.image_padding * 2
+
+        return height, width, channels, tot_width, tot_height
 
+    def sample_image_transform(self):
+        """Samples the image transforms for the next frame from np_random, in the same order as for RLToyEnv: scale, shift, rotate and flip.
 
+        Returns
+        -------
+        tuple
+            The scaled size of the image, the x and y coordinates on the canvas of the image's centre, the rotation in degrees and the flip (0 for no flip, 1 for left-right and 2 for top-bottom)
+        """
+        _, width, _, tot_width, tot_height = self.get_image_geometry()
         sh_quant = self.image_sh_quant
         ro_quant = self.image_ro_quant
         scale_range = self.image_scale_range
 
-        # Assumes that if 3rd tensor dim is 3 that image is RGB
-        if channels == 3:  # #hardcoded
-            image_ = Image.new(
-                "RGB", (tot_width, tot_height)
-            )  # Use RGB for textures / custom images
-        else:
-            image_ = Image.new(
-                "L", (tot_width, tot_height)
-            )  # Use L for black and white 8-bit pixels instead of RGB in case not using custom images
-        draw = ImageDraw.Draw(image_)
-
         # Currently assumes image width = height ###TODO rename R variable
         R = width
         # Assume COM of env_img is in centre of whole image
         shift_w = int(tot_width / 2)
         shift_h = int(tot_height / 2)
-        #
-        # if "scale" in self.transforms:
-        #     # max_R = 0.6 * min(self.width, self.height) / 2 # Not sure whether to make this depend on provided R as well
-        #     # min_R = 0.1 * min(self.width, self.height) / 2 # /2 because it's R, 0.6
-        #     # and 0.1 to allow some wiggle for shift below and not make too small
-        #     max_R = scale_range[1] * R
-        #     if int(max_R) > min(self.width, self.height) / 2:
-        #         warnings.warn(
-        #             "Maximum possible size of polygon might be too big for the given resolution. It's set to: "
-        #             + str(max_R)
-        #         )
-        #     max_R = np.log(max_R)
-        #     min_R = scale_range[0] * R
-        #     if int(min_R) < 3:
-        #         warnings.warn(
-        #             "Minimum possible size of polygon might be too small and lead too much noise in image. It's set to: "
-        #             + str(min_R)
-        #         )
-        #     min_R = np.log(min_R)
-        #     log_sample = min_R + self.np_random.random() * (max_R - min_R)
-        #     sample_ = np.exp(log_sample)
-        #     R = int(sample_)
-        #     # print("R", min_R, max_R)
-        #
+        rotation = 0
+        flip = 0
+
+        if "scale" in self.image_transforms:
+            max_R = scale_range[1] * R
+            if int(max_R) > min(tot_width, tot_height):
+                warnings.warn(
+                    "Maximum possible size of the scaled image might be too big for the padded image. It's set to: "
+                    + str(max_R)
+                )
+            max_R = np.log(max_R)
+            min_R = np.log(scale_range[0] * R)
+            log_sample = min_R + self.np_random.random() * (max_R - min_R)
+            R = int(np.exp(log_sample))
+
         if "shift" in self.image_transforms:
-            max_shift_w = (tot_width - R) // 2
-            max_shift_h = (tot_height - R) // 2
+            # Scaled images bigger than the padded image are not shifted
+            max_shift_w = max((tot_width - R) // 2, 1)
+            max_shift_h = max((tot_height - R) // 2, 1)
             add_shift_w = self.np_random.randint(-max_shift_w + 1, max_shift_w)
             add_shift_h = self.np_random.randint(-max_shift_h + 1, max_shift_h)
             # print("add_shift_w, add_shift_h", add_shift_w, add_shift_h)
@@ -510,34 +673,77 @@ class GymEnvWrapper(gym.Env):
             shift_w += add_shift_w
             shift_h += add_shift_h
 
+        if "rotate" in self.image_transforms:
+            rotation = self.np_random.randint(360)
+            rotation = (rotation // ro_quant) * ro_quant
 
-        img_arr_ = np.array(image_)
-        sq_width = R
-        if (
-            sq_width % 2 == 1
-        ):  # If sq_width is not even, it causes errors with the //2 below.
-            sq_width += 1
-        # tex_img = tex_img.resize((sq_width, sq_width))
-        # tex_arr = np.array(tex_img)
-        top_left = (
-            shift_h - height // 2,
-            shift_w - width // 2,
-        )
-        bottom_right = (
-            shift_h + height // 2,
-            shift_w + width // 2,
-        )
-        img_arr_[
-            top_left[0]: bottom_right[0], top_left[1]: bottom_right[1]
-        ] = env_img
+        if "flip" in self.image_transforms:
+            if self.np_random.randint(2) == 0:  # Only flip half the times
+                flip = 1 if self.np_random.randint(2) == 0 else 2
 
-        image_ = Image.fromarray(img_arr_, "RGB")
+        return R, shift_w, shift_h, rotation, flip
 
+    def write_transformed_image(self, canvas, env_img, transform, region=None):
+        """Writes env_img transformed by transform, as sampled by sample_image_transform(), into canvas. region is the part of canvas written by the previous call for the same canvas and is zeroed first.
+
+        Returns
+        -------
+        tuple of 2 slices
+            The region of canvas that was written
+        """
+        height, width, channels, tot_width, tot_height = self.get_image_geometry()
+        R, shift_w, shift_h, rotation, flip = transform
+
+        if region is not None:
+            canvas[region] = 0
+        env_img = np.reshape(env_img, (height, width, channels))
+
+        if R == width and rotation == 0 and flip == 0:
+            # Because numpy is row-major and the canvas is indexed as (x, y),
+            # the image is transposed when it's written into the canvas
+            region = (
+                slice(shift_w - width // 2, shift_w + width // 2),
+                slice(shift_h - height // 2, shift_h + height // 2),
+            )
+            canvas[region] = env_img.transpose(1, 0, 2)
+        else:
+            key = (R, rotation, flip)
+            if key not in self.image_inverse_maps:
+                self.image_inverse_maps[key] = get_inverse_map(
+                    width, R, rotation, flip
+                )
+            dx, dy, src_rows, src_cols = self.image_inverse_maps[key]
+            xs, ys = shift_w + dx, shift_h + dy
+            # Parts of rotated images may lie outside the canvas
+            inside = (xs >= 0) & (xs < tot_width) & (ys >= 0) & (ys < tot_height)
+            if not inside.all():
+                xs, ys = xs[inside], ys[inside]
+                src_rows, src_cols = src_rows[inside], src_cols[inside]
+            canvas[xs, ys] = env_img[src_rows, src_cols]
+            region = (
+                slice(xs.min(), xs.max() + 1),
+                slice(ys.min(), ys.max() + 1),
+            )
+
+        return region
+
+    def get_transformed_image(self, env_img):
+        """Applies the image transforms to env_img, an image observation of the base env. The image is placed on a canvas padded with image_padding pixels on each side. The canvas is a NumPy array that's allocated once and reused across frames: only the region written in the previous frame is zeroed again before the new frame is written. A copy of the canvas is returned, since callers may hold on to returned observations. Like the images of RLToyEnv, the returned image is indexed as (x, y, channel), i.e., it's transposed with respect to the base env's image, which is indexed as (row, column, channel).
+
+        The scale, rotate and flip transforms are applied around the centre of env_img with nearest neighbour sampling. Since the scaled sizes are ints and the rotations are quantised, there are finitely many of these transforms and the inverse mapping from the transformed to the source pixels for each of them is computed once with get_inverse_map() and cached.
+        """
+        if self.image_canvas is None:
+            _, _, channels, tot_width, tot_height = self.get_image_geometry()
+            self.image_canvas = np.zeros(
+                (tot_width, tot_height, channels), dtype=np.asarray(env_img).dtype
+            )
+
+        transform = self.sample_image_transform()
+        self.image_canvas_region = self.write_transformed_image(
+            self.image_canvas, env_img, transform, self.image_canvas_region
+        )
 
-        # Because numpy is row-major and Image is column major, need to transpose
-        ret_arr = np.transpose(np.array(image_), axes=(1, 0, 2))
-        # ret_arr = np.array(image_)
-        return ret_arr
+        return self.image_canvas.copy()
 
     # return GymEnvWrapper
 
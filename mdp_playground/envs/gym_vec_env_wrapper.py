@@ -0,0 +1,454 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import copy
+import numpy as np
+from gym.vector import VectorEnv, SyncVectorEnv
+from gym.vector.utils import concatenate, create_empty_array
+from mdp_playground.envs.gym_env_wrapper import GymEnvWrapper
+
+
+class GymVecEnvWrapper(VectorEnv):
+    """A batched version of GymEnvWrapper that applies the MDP Playground dimensions to B base environments with one call to step().
+
+    The B base environments are first wrapped in regular GymEnvWrappers, so that the preprocessing (e.g. AtariPreprocessing), the irrelevant features toy environments, the observation and action spaces and the RNG streams are exactly the same as for B scalar GymEnvWrappers with the same configs. The base environments are then stepped directly and the dimensions are applied to the whole batch with NumPy calls: noisy actions are sampled by inverting the CDF of the transition noise distribution for all environments at once, the delayed rewards are held in a 2-D circular buffer of shape (B, delay) with a running sum per environment and shifted images are written into a single canvas of shape (B, width, height, channels). Only the random draws themselves (1 uniform sample per environment for transition noise, the image transforms and the reward noise) are made from the RNGs of the individual wrappers, so that seeded runs are bit-for-bit equivalent to the scalar case.
+
+    GymVecEnvWrapper is a gym.vector.VectorEnv. For RLlib, which only steps instances of its own ray.rllib.env.VectorEnv in batches, use get_rllib_vec_env().
+
+    Environments whose episode ended are reset automatically. The observation returned for them is then the start state of the new episode and the terminal observation of the episode that ended is available in the info dict under the key "terminal_observation". The info dicts returned by the base environments are available under the key "infos".
+
+    Attributes
+    ----------
+    wrappers : list of GymEnvWrapper
+        The scalar wrappers of the base environments. These hold the (preprocessed) base environments, the RNGs and the irrelevant features toy environments.
+    num_envs : int
+        The number of environments, B, in the batch.
+    single_observation_space : Gym.Space
+        The observation space of a single environment.
+    single_action_space : Gym.Space
+        The action space of a single environment.
+
+    Methods
+    -------
+    reset()
+        Resets all environments and returns the batch of start states.
+    step(actions)
+        Performs 1 transition for all environments in the batch.
+    """
+
+    def __init__(self, envs, configs=None, seeds=None, **config):
+        """Initialises the batch of environments.
+
+        Parameters
+        ----------
+        envs : list of gym.Env or gym.vector.SyncVectorEnv
+            The B base environments. For a SyncVectorEnv, its sub-environments are wrapped and stepped directly.
+        configs : list of dict
+            A list of B config dicts, one per environment, as they would be passed to GymEnvWrapper. If this is not provided, the config passed as keyword arguments is used for all environments, with the seed set to one of the values in seeds if these are provided.
+        seeds : list of int
+            A list of B seeds.
+        config : dict
+            The config shared by all environments if configs is not provided.
+        """
+        if isinstance(envs, SyncVectorEnv):
+            envs = envs.envs
+        elif isinstance(envs, VectorEnv):
+            raise NotImplementedError(
+                "GymVecEnvWrapper needs access to the individual base environments"
+                " and only supports lists of environments and SyncVectorEnvs."
+            )
+
+        if configs is None:
+            configs = []
+            for i in range(len(envs)):
+                config_ = copy.deepcopy(config)
+                if seeds is not None:
+                    config_["seed"] = seeds[i]
+                configs.append(config_)
+        assert len(configs) == len(envs), (
+            "GymVecEnvWrapper needs 1 config per base environment."
+        )
+
+        # Configs are copied because GymEnvWrapper writes to the nested
+        # irrelevant_features config it receives and the configs may be shared.
+        self.wrappers = [
+            GymEnvWrapper(env, **copy.deepcopy(config_))
+            for env, config_ in zip(envs, configs)
+        ]
+        wrapper = self.wrappers[0]
+        self.config = wrapper.config
+        self.state_space_type = wrapper.config["state_space_type"]
+        self.irrelevant_features = "irrelevant_features" in self.config
+
+        for wrapper_ in self.wrappers:
+            if wrapper_.frame_stack > 1:
+                raise NotImplementedError(
+                    "GymVecEnvWrapper does not support frame_stack yet."
+                )
+            assert wrapper_.config["state_space_type"] == self.state_space_type
+            assert wrapper_.delay == wrapper.delay
+            assert ("irrelevant_features" in wrapper_.config) == self.irrelevant_features
+            assert wrapper_.image_transforms == wrapper.image_transforms
+            if self.state_space_type == "discrete":
+                assert wrapper_.transition_noise == wrapper.transition_noise, (
+                    "All environments need to have the same transition_noise."
+                )
+
+        self.delay = wrapper.delay
+        self.transition_noise = wrapper.transition_noise
+        self.image_transforms = wrapper.image_transforms
+        self.env_indices = np.arange(len(self.wrappers))
+
+        super(GymVecEnvWrapper, self).__init__(
+            len(self.wrappers), wrapper.observation_space, wrapper.action_space
+        )
+
+        # Circular buffers of the delayed rewards, see GymEnvWrapper.step()
+        self.reward_buffers = np.zeros((self.num_envs, self.delay), dtype=np.float64)
+        self.reward_buffer_indices = np.zeros(self.num_envs, dtype=np.int64)
+
+        if self.image_transforms:
+            assert not self.irrelevant_features, (
+                "Image transforms are currently not supported together with"
+                " irrelevant features."
+            )
+            (
+                self.image_height,
+                self.image_width,
+                self.image_channels,
+                tot_width,
+                tot_height,
+            ) = wrapper.get_image_geometry()
+            self.image_canvas = np.zeros(
+                (self.num_envs, tot_width, tot_height, self.image_channels),
+                dtype=self.single_observation_space.dtype,
+            )
+            # Only shifted images have the same shape for all environments and
+            # are written into the canvas with a single NumPy call.
+            self.image_shift_only = not any(
+                transform in self.image_transforms
+                for transform in ["scale", "rotate", "flip"]
+            )
+            # The corners of the images written in the previous frame for
+            # shifted images and the regions written otherwise
+            self.image_corners = None
+            self.image_canvas_regions = [None] * self.num_envs
+
+        self.total_transitions_episode = np.zeros(self.num_envs, dtype=np.int64)
+        self.total_noisy_transitions_episode = np.zeros(self.num_envs, dtype=np.int64)
+        self.total_reward_episode = np.zeros(self.num_envs, dtype=np.float64)
+        self.total_abs_noise_in_reward_episode = np.zeros(
+            self.num_envs, dtype=np.float64
+        )
+
+    def reset_async(self):
+        pass
+
+    def reset_wait(self, **kwargs):
+        """Resets all environments in the batch.
+
+        Returns
+        -------
+        np.array or tuple of np.array
+            The batch of start states for the new episodes.
+        """
+        return self.reset_envs(self.env_indices)
+
+    def reset_envs(self, indices):
+        """Resets the environments with the given indices and returns their start states."""
+        self.reward_buffers[indices] = 0.0
+        self.reward_buffer_indices[indices] = 0
+        self.total_transitions_episode[indices] = 0
+        self.total_noisy_transitions_episode[indices] = 0
+        self.total_reward_episode[indices] = 0.0
+        self.total_abs_noise_in_reward_episode[indices] = 0.0
+
+        reset_states = []
+        for i in indices:
+            wrapper = self.wrappers[i]
+            wrapper.total_episodes += 1
+            reset_state = wrapper.env.reset()
+            if self.irrelevant_features:
+                reset_state_irr = wrapper.irr_toy_env.reset()
+                reset_state = self.concatenate_irrelevant_state(
+                    reset_state, reset_state_irr
+                )
+            reset_states.append(reset_state)
+
+        return self.get_observations(reset_states, indices)
+
+    def step_async(self, actions):
+        self.actions = actions
+
+    def step_wait(self, **kwargs):
+        """Performs 1 transition for all environments in the batch with the actions passed to step().
+
+        Returns
+        -------
+        np.array or tuple of np.array, np.array, np.array, dict
+            The batch of next states, rewards, dones and an info dict at the end of the current transition.
+        """
+        actions = self.actions
+        self.total_transitions_episode += 1
+
+        if self.state_space_type == "discrete" and self.transition_noise > 0.0:
+            actions = np.asarray(actions)
+            # 1 draw per environment from its own RNG, as in GymEnvWrapper.step()
+            uniform_samples = np.array(
+                [wrapper.np_random.random_sample() for wrapper in self.wrappers]
+            )  # #random
+            noisy_actions = sample_noisy_discrete_states(
+                uniform_samples,
+                actions,
+                self.wrappers[0].env.action_space.n,
+                self.transition_noise,
+            )
+            self.total_noisy_transitions_episode += noisy_actions != actions
+            actions = noisy_actions
+
+        next_states = []
+        rewards = np.zeros(self.num_envs, dtype=np.float64)
+        dones = np.zeros(self.num_envs, dtype=bool)
+        infos = []
+        for i, wrapper in enumerate(self.wrappers):
+            action = actions[i]
+            if self.irrelevant_features:
+                if self.state_space_type == "discrete":
+                    next_state, reward, done, info = wrapper.env.step(action[0])
+                    next_state_irr, _, _, _ = wrapper.irr_toy_env.step(action[1])
+                else:
+                    action, action_irr = wrapper.split_action(action)
+                    next_state, reward, done, info = wrapper.env.step(action)
+                    next_state_irr, _, _, _ = wrapper.irr_toy_env.step(action_irr)
+                next_state = self.concatenate_irrelevant_state(
+                    next_state, next_state_irr
+                )
+            else:
+                next_state, reward, done, info = wrapper.env.step(action)
+            next_states.append(next_state)
+            rewards[i] = reward
+            dones[i] = done
+            infos.append(info)
+
+        obs = self.get_observations(next_states, self.env_indices)
+
+        # If an episode is finished, the rewards that were delayed and not
+        # handed out before are returned. They are summed oldest first, as in
+        # GymEnvWrapper.step().
+        delayed_rewards = rewards.copy()
+        for i in np.flatnonzero(dones):
+            delayed_rewards[i] = np.sum(
+                np.roll(self.reward_buffers[i], -self.reward_buffer_indices[i])
+            )
+        if self.delay > 0:
+            not_dones = np.flatnonzero(~dones)
+            buffer_indices = self.reward_buffer_indices[not_dones]
+            delayed_rewards[not_dones] = self.reward_buffers[
+                not_dones, buffer_indices
+            ]
+            self.reward_buffers[not_dones, buffer_indices] = rewards[not_dones]
+            self.reward_buffer_indices[not_dones] = (buffer_indices + 1) % self.delay
+        elif dones.any():
+            # As for GymEnvWrapper, nothing is handed out at the end of an
+            # episode without delay
+            delayed_rewards[dones] = 0.0
+        rewards = delayed_rewards
+
+        if any(wrapper.reward_noise for wrapper in self.wrappers):
+            noise_in_rewards = np.array(
+                [
+                    wrapper.reward_noise(wrapper.np_random)
+                    if wrapper.reward_noise
+                    else 0
+                    for wrapper in self.wrappers
+                ],
+                dtype=np.float64,
+            )  # #random
+            self.total_abs_noise_in_reward_episode += np.abs(noise_in_rewards)
+            self.total_reward_episode += rewards
+            rewards += noise_in_rewards
+        else:
+            self.total_reward_episode += rewards
+
+        info = {"infos": infos}
+
+        # Auto-reset the environments that reached the end of an episode
+        if dones.any():
+            info["terminal_observation"] = copy.deepcopy(obs)
+            done_indices = np.flatnonzero(dones)
+            reset_obs = self.reset_envs(done_indices)
+            if isinstance(obs, tuple):
+                for obs_, reset_obs_ in zip(obs, reset_obs):
+                    obs_[done_indices] = reset_obs_
+            else:
+                obs[done_indices] = reset_obs
+
+        return obs, rewards, dones, info
+
+    def concatenate_irrelevant_state(self, state, state_irr):
+        """Combines the state of a base environment with that of its irrelevant features toy environment. For continuous environments, the pair is only written into the batch of observations by get_observations()."""
+        return tuple([state, state_irr])
+
+    def get_observations(self, states, indices):
+        """Returns the batch of (external) observations for the states of the environments with the given indices."""
+        if self.image_transforms:
+            return self.get_transformed_images(states, indices)
+        if self.irrelevant_features and self.state_space_type != "discrete":
+            # The base and irrelevant observations are written straight into
+            # slices of the batch, as in GymEnvWrapper
+            env_obs_dim = self.wrappers[0].env_obs_dim
+            obs = np.empty(
+                (len(indices),) + self.single_observation_space.shape,
+                dtype=self.single_observation_space.dtype,
+            )
+            obs[:, :env_obs_dim] = [state for state, _ in states]
+            obs[:, env_obs_dim:] = [state_irr for _, state_irr in states]
+            return obs
+        obs = create_empty_array(
+            self.single_observation_space, n=len(indices), fn=np.empty
+        )
+        return concatenate(states, obs, self.single_observation_space)
+
+    def get_transformed_images(self, env_imgs, indices):
+        """Applies the image transforms to the images of the environments with the given indices. The transforms are sampled from the RNGs of the individual wrappers and the images are written into a single canvas, which, as in GymEnvWrapper, is reused across frames.
+
+        Returns
+        -------
+        np.array
+            A copy of the canvas for the given environments
+        """
+        transforms = [self.wrappers[i].sample_image_transform() for i in indices]
+        if self.image_shift_only:
+            height, width = self.image_height, self.image_width
+            env_imgs = np.reshape(
+                np.stack(env_imgs), (len(indices), height, width, self.image_channels)
+            )
+            transforms = np.array(transforms)
+            if self.image_corners is None:
+                self.image_corners = np.zeros((self.num_envs, 2), dtype=np.int64)
+            else:
+                self.set_image_canvas_regions(indices, self.image_corners[indices], 0)
+            self.image_corners[indices, 0] = transforms[:, 1] - width // 2
+            self.image_corners[indices, 1] = transforms[:, 2] - height // 2
+            # Transposed images as in GymEnvWrapper.write_transformed_image()
+            self.set_image_canvas_regions(
+                indices, self.image_corners[indices], env_imgs.transpose(0, 2, 1, 3)
+            )
+        else:
+            for i, env_img, transform in zip(indices, env_imgs, transforms):
+                self.image_canvas_regions[i] = self.wrappers[
+                    0
+                ].write_transformed_image(
+                    self.image_canvas[i],
+                    env_img,
+                    transform,
+                    self.image_canvas_regions[i],
+                )
+
+        return self.image_canvas[indices]
+
+    def set_image_canvas_regions(self, indices, corners, values):
+        """Sets the image sized regions of the canvas at the given corners for the environments with the given indices to values."""
+        xs = corners[:, 0, None, None] + np.arange(self.image_width)[None, :, None]
+        ys = corners[:, 1, None, None] + np.arange(self.image_height)[None, None, :]
+        self.image_canvas[np.asarray(indices)[:, None, None], xs, ys] = values
+
+    def close_extras(self, **kwargs):
+        for wrapper in self.wrappers:
+            wrapper.env.close()
+
+
+class RLlibVecEnvAdapter(object):
+    """Exposes a GymVecEnvWrapper with the interface of RLlib's VectorEnv (vector_reset(), reset_at(), vector_step() and get_unwrapped()). RLlib only steps environments in batches if they are instances of ray.rllib.env.VectorEnv; a gym.vector.VectorEnv like GymVecEnvWrapper would be treated as a single environment with batched observations. Use get_rllib_vec_env() to create an instance that is also a ray.rllib.env.VectorEnv.
+
+    RLlib resets environments whose episode ended itself with reset_at(). Since GymVecEnvWrapper resets them automatically, vector_step() returns the terminal observations for them and reset_at() returns the start states of the episodes that were already started.
+
+    Parameters
+    ----------
+    vec_env : GymVecEnvWrapper
+        The batch of environments to expose
+    """
+
+    def __init__(self, vec_env):
+        self.vec_env = vec_env
+        self.observation_space = vec_env.single_observation_space
+        self.action_space = vec_env.single_action_space
+        self.num_envs = vec_env.num_envs
+        # Start states of the environments that were reset automatically and
+        # for which reset_at() was not called yet
+        self.reset_observations = {}
+
+    def vector_reset(self):
+        self.reset_observations = {}
+        return self.unbatch(self.vec_env.reset())
+
+    def reset_at(self, index):
+        if index in self.reset_observations:
+            return self.reset_observations.pop(index)
+        # E.g., when RLlib ends an episode at its horizon
+        return self.unbatch(self.vec_env.reset_envs([index]))[0]
+
+    def vector_step(self, actions):
+        obs, rewards, dones, info = self.vec_env.step(actions)
+        obs = self.unbatch(obs)
+        if dones.any():
+            terminal_obs = self.unbatch(info["terminal_observation"])
+            for i in np.flatnonzero(dones):
+                self.reset_observations[i] = obs[i]
+                obs[i] = terminal_obs[i]
+        return obs, rewards.tolist(), dones.tolist(), info["infos"]
+
+    def get_unwrapped(self):
+        return [wrapper.env for wrapper in self.vec_env.wrappers]
+
+    def unbatch(self, obs):
+        """Splits a batch of observations into a list with 1 observation per environment."""
+        if isinstance(obs, tuple):
+            return list(zip(*obs))
+        return list(obs)
+
+
+def get_rllib_vec_env(envs, **kwargs):
+    """Creates a GymVecEnvWrapper for the base environments envs and exposes it to RLlib as a ray.rllib.env.VectorEnv with RLlibVecEnvAdapter. Ray is only imported here. To use it with RLlib, register an env creator that returns it, e.g.:
+
+        register_env(
+            "GymVecEnvWrapper-Atari",
+            lambda config: get_rllib_vec_env(
+                [make_base_env() for i in range(num_envs)], **config
+            ),
+        )
+
+    RLlib then steps all num_envs environments in 1 batch. num_envs_per_worker should be left at 1, since RLlib uses the number of environments of a VectorEnv instead.
+
+    Parameters
+    ----------
+    envs : list of gym.Env or gym.vector.SyncVectorEnv
+        The base environments
+    kwargs : dict
+        The configs or seeds and config, as passed to GymVecEnvWrapper
+    """
+    from ray.rllib.env import VectorEnv as RLlibVectorEnv
+
+    class RLlibGymVecEnvWrapper(RLlibVecEnvAdapter, RLlibVectorEnv):
+        pass
+
+    return RLlibGymVecEnvWrapper(GymVecEnvWrapper(envs, **kwargs))
+
+
+def sample_noisy_discrete_states(uniform_samples, states, num_states, noise):
+    """Batched version of rl_toy_env.sample_noisy_discrete_state(). Maps the uniform samples in [0, 1) to states that are equal to the corresponding states with probability 1 - noise and uniformly one of the other num_states - 1 states otherwise."""
+    states = np.asarray(states, dtype=np.int64)
+    other_state_prob = noise / (num_states - 1)
+    states_start = states * other_state_prob
+    states_end = states_start + (1 - noise)
+    below = np.minimum(uniform_samples // other_state_prob, states - 1)
+    above = np.minimum(
+        states + 1 + (uniform_samples - states_end) // other_state_prob,
+        num_states - 1,
+    )
+    return np.where(
+        uniform_samples < states_start,
+        below,
+        np.where(uniform_samples < states_end, states, above),
+    ).astype(np.int64)
@@ -1,11 +1,48 @@
 # from gym.envs.mujoco.mujoco_env import MujocoEnv
-from gym.envs.mujoco.half_cheetah_v3 import HalfCheetahEnv
-from gym.envs.mujoco.pusher import PusherEnv
-from gym.envs.mujoco.reacher import ReacherEnv
 import copy
 
+# Per-process caches of the wrapper classes, keyed by base class and model
+# loader, and of the freshly constructed base environments, keyed by base class
+# and MujocoEnv kwargs. See get_mujoco_wrapper().
+mujoco_wrapper_classes = {}
+mujoco_env_cache = {}
 
-def get_mujoco_wrapper(base_class):
+# Attributes of the base environments that are not copied from the cache but
+# created anew for each instance
+mujoco_sim_attributes = ["model", "sim", "data", "viewer", "_viewers", "np_random"]
+
+
+class MujocoPyModelLoader(object):
+    """Serialises compiled MuJoCo models and creates new models and simulators from them with mujoco-py, which is only imported when needed. Loading a model from its binary MJB format skips parsing and compiling the XML."""
+
+    def serialize(self, model):
+        return model.get_mjb()
+
+    def load(self, model_binary):
+        import mujoco_py
+
+        return mujoco_py.load_model_from_mjb(model_binary)
+
+    def make_sim(self, model, sim_state):
+        import mujoco_py
+
+        sim = mujoco_py.MjSim(model)
+        sim.set_state(sim_state)
+        return sim
+
+
+mujoco_py_model_loader = MujocoPyModelLoader()
+
+
+def is_mujoco_env(base_class, module, name):
+    """Checks if base_class is the Gym Mujoco environment class name in gym.envs.mujoco.module without importing it, since that needs mujoco-py."""
+    return (
+        base_class.__module__ == "gym.envs.mujoco." + module
+        and base_class.__name__ == name
+    )
+
+
+def get_mujoco_wrapper(base_class, model_loader=None):
     """Wraps a mujoco-py environment to be able to modify its low-level Mujoco XML attributes and inject the dimensions of MDP Playground. Please see [`example.py`](example.py) for some simple examples of how to use this class. The values for these dimensions are passed in a config dict as for mdp_playground.envs.RLToyEnv. The description for the supported dimensions below can be found in mdp_playground/envs/rl_toy_env.py.
 
     Currently supported dimensions:
@@ -18,7 +55,20 @@ def get_mujoco_wrapper(base_class):
 
     Similarly for the action_space_max (which controls the action range), the new action range is achieved by multiplying the Gym Mujoco environments's action_max and action_min by the action_space_max passed in the dict.
 
+    Constructing a Mujoco environment parses and compiles its XML model. Since many instances with the same MujocoEnv kwargs are created in a process (for workers, evaluation envs and seeds), the attributes of the 1st instance right after the construction of the base environment are cached together with its serialised model and simulator state. Later instances are then initialised from this cache with their own copy of the model and simulator created by model_loader, before the dimensions above are applied. The wrapper classes are also cached, so that get_mujoco_wrapper() returns the same class for the same base_class.
+
+    Parameters
+    ----------
+    base_class : class
+        The Gym Mujoco environment class to wrap
+    model_loader : object
+        An object with the methods serialize(model), load(model_binary) and make_sim(model, sim_state) used to copy models and simulators. Defaults to a MujocoPyModelLoader.
     """
+    if model_loader is None:
+        model_loader = mujoco_py_model_loader
+    if (base_class, model_loader) in mujoco_wrapper_classes:
+        return mujoco_wrapper_classes[(base_class, model_loader)]
+
     # TODO This makes a subclass and not a wrapper. Change name. Or make it a
     # wrapper by using composition? Some frameworks might need an instance of
     # this class to also be an instance of base_class?
@@ -54,7 +104,7 @@ def get_mujoco_wrapper(base_class):
             # 'MujocoEnv', e.g. HalfCheetahV3, has a static call signature for
             # __init__ ##TODO Thanks to this, now the above del statements can be
             # removed I think.
-            super(MujocoEnvWrapper, self).__init__(**config["MujocoEnv"])
+            self.init_base_env(config["MujocoEnv"])
             self.model.opt.disableflags = 128  # IMP disables clamping of controls to the range in the XML, i.e., [-1, 1]
             if "action_space_max" in locals():
                 print(
@@ -66,7 +116,10 @@ def get_mujoco_wrapper(base_class):
                 self.action_space.high *= action_space_max
                 print("to:", self.action_space.low, self.action_space.high)
 
-                if base_class == HalfCheetahEnv and action_space_max >= 4:  # hack
+                if (
+                    is_mujoco_env(base_class, "half_cheetah_v3", "HalfCheetahEnv")
+                    and action_space_max >= 4
+                ):  # hack
                     self.model.opt.timestep /= 2  # 0.005
                     self.frame_skip *= 2
                     print(
@@ -91,8 +144,8 @@ def get_mujoco_wrapper(base_class):
                     + str(self.time_unit)
                 )
 
-                if (
-                    base_class == HalfCheetahEnv
+                if is_mujoco_env(
+                    base_class, "half_cheetah_v3", "HalfCheetahEnv"
                 ):  # hack could include other similarly defined envs from Gym Mujoco
                     self._ctrl_cost_weight *= self.time_unit
                     self._forward_reward_weight *= self.time_unit
@@ -103,15 +156,45 @@ def get_mujoco_wrapper(base_class):
                         "corresponding to time_unit in config.",
                     )
 
+        def init_base_env(self, mujoco_env_config):
+            """Initialises the base environment with the kwargs mujoco_env_config, from mujoco_env_cache if an instance with the same kwargs was constructed before."""
+            key = (base_class, repr(sorted(mujoco_env_config.items())))
+            if key not in mujoco_env_cache:
+                own_attributes = set(self.__dict__)
+                super(MujocoEnvWrapper, self).__init__(**mujoco_env_config)
+                attributes = {
+                    name: copy.deepcopy(value)
+                    for name, value in self.__dict__.items()
+                    if name not in own_attributes
+                    and name not in mujoco_sim_attributes
+                }
+                mujoco_env_cache[key] = (
+                    attributes,
+                    model_loader.serialize(self.model),
+                    self.sim.get_state(),
+                )
+                return
+
+            attributes, model_binary, sim_state = mujoco_env_cache[key]
+            # Copied because e.g. the action space bounds are modified in place
+            self.__dict__.update(copy.deepcopy(attributes))
+            self.model = model_loader.load(model_binary)
+            self.sim = model_loader.make_sim(self.model, sim_state)
+            self.data = self.sim.data
+            self.viewer = None
+            self._viewers = {}
+            self.seed()
+
         def step(self, action):  # hack
             obs, reward, done, info = super(MujocoEnvWrapper, self).step(action)
             if (
-                self.base_class in [PusherEnv, ReacherEnv]
-                and "time_unit" in self.config
-            ):
+                is_mujoco_env(self.base_class, "pusher", "PusherEnv")
+                or is_mujoco_env(self.base_class, "reacher", "ReacherEnv")
+            ) and "time_unit" in self.config:
                 reward *= self.time_unit
             return obs, reward, done, info
 
+    mujoco_wrapper_classes[(base_class, model_loader)] = MujocoEnvWrapper
     return MujocoEnvWrapper
 
 
@@ -7,6 +7,10 @@ import os
 import warnings
 import logging
 import copy
+import hashlib
+import json
+import shutil
+import tempfile
 from datetime import datetime
 import numpy as np
 import scipy
@@ -71,6 +75,7 @@ class RLToyEnv(gym.Env):
             A Python function emulating P(s, a). For discrete envs it's also possible to specify an |S|x|A| transition matrix.
         reward_function : Python function(state_sequence, action_sequence) or a 2-D numpy.ndarray
             A Python function emulating R(state_sequence, action_sequence). The state_sequence is recorded by the environment and transition_function is called before reward_function, so the "current" state (when step() was called) and next state are the last 2 states in the sequence.
+            The state_sequence is a new list of length delay + sequence_length + 1 (see get_augmented_state_list()). At the beginning of an episode, the states before the initial state are padded with NaN for discrete environments and with lists of NaN for continuous and grid environments, so that padding can't be mistaken for, or used as, a valid state index. (The augmented state that the environment itself holds, and returns from get_augmented_state(), is an np.ndarray padded with -1 for discrete and grid environments.)
             For discrete environments, it's also possible to specify an |S|x|A| transition matrix where reward is assumed to be a function over the "current" state and action.
             If use_custom_mdp = false and the environment is continuous, this is a string that chooses one of the following predefined reward functions: move_along_a_line or move_to_a_point.
             If use_custom_mdp = false and the environment is grid, this is a string that chooses one of the following predefined reward functions: move_to_a_point. Support for sequences is planned.
@@ -101,6 +106,10 @@ class RLToyEnv(gym.Env):
                     A tuple of real numbers to specify (min_scaling, max_scaling).
                 ro_quant : int
                     An int to quantise the rotation transforms.
+                image_cache_size : int
+                    The memory budget in bytes for the LRU cache of rendered image representations. Since all transforms are quantised, the images for the same state and the same transform parameters are only rendered once. Set to 0 to disable the cache. If None, the images are only cached if the images for all possible (state, transform) pairs fit into 4 MiB, e.g., for no transforms; see ImageMultiDiscrete for details. Default value: None.
+                image_bit_packed : boolean
+                    If true, the image observations are bit-packed along the height axis, which makes them 8 times smaller since their pixels are either 0 or 255. See ImageMultiDiscrete for details. mdp_playground.spaces.image_multi_discrete.unpack_image() restores the images and the config_processor registers an RLlib custom preprocessor "unpack_bits" that does the same. To reduce the size of the observations further, image_width and image_height can be set to lower resolutions. Default value: False.
 
         Specific to continuous environments:
             state_space_dim : int
@@ -153,7 +162,7 @@ class RLToyEnv(gym.Env):
         For all, continuous, discrete and grid environments:
         make_denser : boolean
             If true, makes the reward denser in environments.
-            For discrete environments, hands out a partial reward for completing partial sequences.
+            For discrete environments, hands out a partial reward for completing partial sequences, i.e., when the last states considered for the reward match the beginning of a rewardable sequence. This is in addition to the reward for a complete sequence.
             For continuous environments, for reward function move_to_a_point, the base reward handed out is equal to the distance moved towards the target point in the current timestep.
             For grid envs, the base reward handed out is equal to the Manhattan distance moved towards the target point in the current timestep.
         seed : int or dict
@@ -161,7 +170,17 @@ class RLToyEnv(gym.Env):
         log_filename : str
             The name of the log file to which logs are written.
         log_level : logging.LOG_LEVEL option
-            Python log level for logging
+            Python log level for logging. Log messages in the hot paths, i.e., step(), reset(), transition_function() and reward_function(), are only formatted if their level is enabled, so logging costs (almost) nothing at the default level of logging.CRITICAL.
+        verbose : boolean
+            If false, suppresses all printing to stdout, i.e., of the passed config, the banner and the generated MDP during initialisation. Defaults to True.
+        mdp_cache_dir : str
+            A directory in which generated discrete MDPs, i.e., their transition tables and rewardable sequences, are cached. The cache is keyed by a hash of the config values that determine the MDP and the seeds, so the seed needs to be set for caching; without it, the MDP is not cached. An environment with the same config and seed loads the MDP from the cache instead of generating it and memory-maps its transition tables, so that multiple processes can share them. Defaults to no caching.
+        shared_mdp : boolean
+            If true and mdp_cache_dir is not given, the MDP is cached in a directory in shared memory (see get_shared_mdp_cache_dir()), so that all processes on a node that instantiate the same environment, e.g., Ray's rollout workers, memory-map one copy of the transition tables. The rewardable sequences are not shared; each process builds its own dict of them from the cache. The seed needs to be set for this since the cache is keyed by it. Since shared memory is RAM, the entries are not evicted automatically and need to be removed with clear_shared_mdp_cache() when they are no longer needed. The config_processor generates the MDP once in the driver for such configs and removes these entries in post_processing(); entries created by workers on other nodes of a cluster need to be removed on those nodes. Defaults to False.
+        event_hooks : list of callables
+            Each callable is called as hook(event, data) at the end of every step() with event "step" and data a dict with keys "state", "action", "next_state", "reward" and "done", and at the end of every reset() with event "reset" and data a dict with key "state". The states are the relevant states from the augmented state and may be views that change with the next step, so a hook needs to copy them if it stores them. Defaults to no hooks.
+        validation_level : str
+            How thoroughly actions and next states are validated in transition_function() for continuous and grid environments. "full" checks actions and next states with the spaces' contains(), which also checks the shapes and dtypes, and asserts on the shapes of continuous actions. "bounds-only" only checks whether actions and next states are within the bounds of their spaces using bound arrays precomputed at initialisation (for grid environments, whether at most one dimension of an action is 1 or -1 and all others are 0). "off" doesn't validate actions at all; next states of continuous environments are still checked against the bounds of the state space and clipped. Invalid actions are replaced with 0 / noop actions with a warning for the "full" and "bounds-only" levels. "off" is only recommended for trusted agents whose actions are known to be valid. Defaults to "full".
 
     Below, we list the important attributes and methods for this class.
 
@@ -198,12 +217,16 @@ class RLToyEnv(gym.Env):
         defined as a lambda function in the call to init_reward_function() and is equivalent to calling reward_function()
     get_augmented_state()
         gets underlying Markovian state of the MDP
+    get_augmented_state_list()
+        gets a NaN padded copy of the augmented state as a list, which custom reward functions are called with
     reset()
         Resets environment state
     seed()
         Sets the seed for the numpy RNG used by the environment (state and action spaces have their own seeds as well)
     step(action, imaginary_rollout=False)
         Performs 1 transition of the MDP
+    call_event_hooks(event, data)
+        Calls the hooks passed in config["event_hooks"]
     """
 
     def __init__(self, **config):
@@ -215,7 +238,15 @@ class RLToyEnv(gym.Env):
             the member variable config is initialised to this value after inserting defaults
         """
 
-        print("Passed config:", config, "\n")
+        # verbose is needed before the config is processed below because it
+        # controls the printing of the passed config and the banner
+        if "verbose" not in config:
+            self.verbose = True
+        else:
+            self.verbose = config["verbose"]
+
+        if self.verbose:
+            print("Passed config:", config, "\n")
 
         if config == {}:
             config = {
@@ -232,14 +263,15 @@ class RLToyEnv(gym.Env):
         repeat_equal_sign = (screen_output_width - 20) // 2
         set_ansi_escape = "\033[32;1m"
         reset_ansi_escape = "\033[0m"
-        print(
-            set_ansi_escape
-            + "=" * repeat_equal_sign
-            + "Initialising Toy MDP"
-            + "=" * repeat_equal_sign
-            + reset_ansi_escape
-        )
-        print("Current working directory:", os.getcwd())
+        if self.verbose:
+            print(
+                set_ansi_escape
+                + "=" * repeat_equal_sign
+                + "Initialising Toy MDP"
+                + "=" * repeat_equal_sign
+                + reset_ansi_escape
+            )
+            print("Current working directory:", os.getcwd())
 
         # Set other default settings for config to use if config is passed without any values for them
         if "log_level" not in config:
@@ -271,6 +303,20 @@ class RLToyEnv(gym.Env):
         # log_filename = "logs/output.log"
         # os.makedirs(os.path.dirname(log_filename), exist_ok=True)
 
+        if "event_hooks" not in config:
+            self.event_hooks = []
+        else:
+            self.event_hooks = list(config["event_hooks"])
+
+        if "validation_level" not in config:
+            self.validation_level = "full"
+        else:
+            self.validation_level = config["validation_level"]
+        assert self.validation_level in ["full", "bounds-only", "off"], (
+            "validation_level should be one of full, bounds-only and off. It was: "
+            + str(self.validation_level)
+        )
+
         # #seed
         if (
             "seed" not in config
@@ -323,7 +369,7 @@ class RLToyEnv(gym.Env):
             self.seed(self.seed_dict["env"])
             # print("Mersenne0 (dict), dummy_eval:", self.np_random.get_state()[2], "dummy_eval" in config)
 
-        self.logger.warning("Seeds set to:" + str(self.seed_dict))
+        self.logger.warning("Seeds set to:%s", self.seed_dict)
         # print(f'Seeds set to {self.seed_dict=}') # Available from Python 3.8
 
         config["state_space_type"] = config["state_space_type"].lower()
@@ -417,6 +463,17 @@ class RLToyEnv(gym.Env):
         else:
             self.irrelevant_features = config["irrelevant_features"]
 
+        if "mdp_cache_dir" in config:
+            self.mdp_cache_dir = config["mdp_cache_dir"]
+        elif "shared_mdp" in config and config["shared_mdp"]:
+            assert "seed" in config, (
+                "shared_mdp needs the seed to be set since the MDP cache is keyed"
+                " by it."
+            )
+            self.mdp_cache_dir = get_shared_mdp_cache_dir()
+        else:
+            self.mdp_cache_dir = None
+
         if "image_representations" not in config:
             self.image_representations = False
         else:
@@ -477,6 +534,16 @@ class RLToyEnv(gym.Env):
                 else:
                     self.image_scale_range = config["image_scale_range"]
 
+                if "image_cache_size" not in config:
+                    self.image_cache_size = None
+                else:
+                    self.image_cache_size = config["image_cache_size"]
+
+                if "image_bit_packed" not in config:
+                    self.image_bit_packed = False
+                else:
+                    self.image_bit_packed = config["image_bit_packed"]
+
         if config["state_space_type"] == "discrete":
             if "reward_dist" not in config:
                 self.reward_dist = None
@@ -667,6 +734,8 @@ class RLToyEnv(gym.Env):
                     scale_range=self.image_scale_range,
                     ro_quant=self.image_ro_quant,
                     circle_radius=20,
+                    image_cache_size=self.image_cache_size,
+                    bit_packed=self.image_bit_packed,
                     seed=self.seed_dict["image_representations"],
                 )  # #seed
                 if self.irrelevant_features:
@@ -777,25 +846,72 @@ class RLToyEnv(gym.Env):
 
         # ###IMP The order in which the following inits are called is important, so don't change!!
         # #init_state_dist: Initialises uniform distribution over non-terminal states for discrete distribution; After looking into Gym code, I can say that for continuous, it's uniform over non-terminal if limits are [a, b], shifted exponential if exactly one of the limits is np.inf, normal if both limits are np.inf - this sampling is independent for each dimension (and is done for the defined limits for the respective dimension).
+        # Generated P and R for discrete environments are loaded from the on-disk
+        # cache if they were cached by an earlier instantiation
+        self.mdp_cache = None
+        self.mdp_cache_path = self.get_mdp_cache_path()
+        if self.mdp_cache_path is not None and os.path.isdir(self.mdp_cache_path):
+            self.mdp_cache = load_mdp_cache(self.mdp_cache_path)
+            self.logger.info("Loaded MDP from cache: %s", self.mdp_cache_path)
         self.init_init_state_dist()
         self.init_transition_function()
         # print("Mersenne1, dummy_eval:", self.np_random.get_state()[2], "dummy_eval" in self.config)
         self.init_reward_function()
+        if self.mdp_cache is not None:
+            # The RNGs continue from where they would be after generating the MDP
+            for rng, rng_state in zip(
+                self.get_mdp_generation_rngs(), self.mdp_cache["rng_states"]
+            ):
+                rng.set_state(rng_state)
+        elif self.mdp_cache_path is not None:
+            save_mdp_cache(
+                self.mdp_cache_path,
+                self.transition_matrix,
+                self.config["transition_function_irrelevant"]
+                if self.irrelevant_features
+                else None,
+                self.rewardable_sequences,
+                [rng.get_state() for rng in self.get_mdp_generation_rngs()],
+            )
+
+        # The augmented state is held in a preallocated ring buffer. Padding
+        # at the beginning of an episode is -1 for discrete and grid
+        # environments and NaN for continuous environments.
+        if config["state_space_type"] == "discrete":
+            self.augmented_state_buffer = AugmentedStateBuffer(
+                self.augmented_state_length, dtype=np.int64, pad_value=-1
+            )
+        elif config["state_space_type"] == "continuous":
+            self.augmented_state_buffer = AugmentedStateBuffer(
+                self.augmented_state_length,
+                state_shape=(self.state_space_dim,),
+                dtype=self.dtype,
+                pad_value=np.nan,
+            )
+        elif config["state_space_type"] == "grid":
+            self.augmented_state_buffer = AugmentedStateBuffer(
+                self.augmented_state_length,
+                state_shape=(2,),  # #hardcoded
+                dtype=np.int64,
+                pad_value=-1,
+            )
 
         self.curr_obs = (
             self.reset()
         )  # #TODO Maybe not call it here, since Gym seems to expect to _always_ call this method when using an environment; make this seedable? DO NOT do seed dependent initialization in reset() otherwise the initial state distrbution will always be at the same state at every call to reset()!! (Gym env has its own seed? Yes, it does, as does also space);
 
         self.logger.info(
-            "self.augmented_state, len: "
-            + str(self.augmented_state)
-            + ", "
-            + str(len(self.augmented_state))
+            "self.augmented_state, len: %s, %s",
+            self.augmented_state,
+            len(self.augmented_state),
         )
         self.logger.info(
-            "MDP Playground toy env instantiated with config: " + str(self.config)
+            "MDP Playground toy env instantiated with config: %s", self.config
         )
-        print("MDP Playground toy env instantiated with config: " + str(self.config))
+        if self.verbose:
+            print(
+                "MDP Playground toy env instantiated with config: " + str(self.config)
+            )
 
     def init_terminal_states(self):
         """Initialises terminal state set to be the 'last' states for discrete environments. For continuous environments, terminal states will be in a hypercube centred around config['terminal_states'] with the edge of the hypercube of length config['term_state_edge']."""
@@ -831,7 +947,9 @@ class RLToyEnv(gym.Env):
                     + ". Total "
                     + str(self.num_terminal_states)
                 )
-                self.is_terminal_state = lambda s: s in self.config["terminal_states"]
+                # A set makes the check O(1) in the number of terminal states
+                terminal_state_set = frozenset(self.config["terminal_states"].tolist())
+                self.is_terminal_state = lambda s: s in terminal_state_set
 
         elif self.config["state_space_type"] == "continuous":
             # print("# TODO for cont. spaces: term states")
@@ -934,6 +1052,62 @@ class RLToyEnv(gym.Env):
             else:  # no custom/user-defined terminal states
                 self.is_terminal_state = lambda s: False
 
+    def get_mdp_generation_rngs(self):
+        """Returns the RNGs that are used to generate P and R for discrete environments."""
+        return [self.np_random] + [space.np_random for space in self.observation_spaces]
+
+    def get_mdp_cache_path(self):
+        """Returns the path in config["mdp_cache_dir"] at which the generated P and R of a discrete environment are cached, or None if they are not to be cached.
+
+        The name of the path is a hash of the config values that determine the generated MDP and of the seeds and the states of the RNGs used to generate it, so the same MDP is loaded for the same config and seed.
+        """
+        if self.mdp_cache_dir is None:
+            return None
+        if self.config["state_space_type"] != "discrete" or self.use_custom_mdp:
+            warnings.warn(
+                "mdp_cache_dir is only used for generated discrete MDPs. Not caching"
+                " the MDP."
+            )
+            return None
+        if "seed" not in self.config:
+            # The cache would be keyed by freshly generated seeds and every
+            # construction would write a new entry that is never reused.
+            warnings.warn(
+                "The MDP cache is keyed by the seed, which was not set. Not"
+                " caching the MDP."
+            )
+            return None
+        if callable(self.reward_dist):
+            warnings.warn(
+                "A callable reward_dist can't be hashed for the MDP cache. Not"
+                " caching the MDP."
+            )
+            return None
+
+        generation_config = {
+            "version": MDP_CACHE_VERSION,
+            "state_space_size": [int(size) for size in self.state_space_size],
+            "action_space_size": [int(size) for size in self.action_space_size],
+            "diameter": self.diameter,
+            "maximally_connected": self.maximally_connected,
+            "terminal_state_density": self.terminal_state_density,
+            "reward_density": self.reward_density,
+            "sequence_length": self.sequence_length,
+            "repeats_in_sequences": self.repeats_in_sequences,
+            "make_denser": self.make_denser,
+            "irrelevant_features": self.irrelevant_features,
+            "reward_dist": self.reward_dist,
+            "seed_dict": self.seed_dict,
+        }
+        config_hash = hashlib.sha256(
+            json.dumps(generation_config, sort_keys=True, default=str).encode()
+        )
+        for rng in self.get_mdp_generation_rngs():
+            rng_state = rng.get_state()
+            config_hash.update(rng_state[1].tobytes())
+            config_hash.update(repr(rng_state[2:]).encode())
+        return os.path.join(self.mdp_cache_dir, config_hash.hexdigest())
+
     def init_init_state_dist(self):
         """Initialises initial state distrbution, rho_0, to be uniform over the non-terminal states for discrete environments. For both discrete and continuous environments, the uniform sampling over non-terminal states is taken care of in reset() when setting the initial state for an episode."""
         # relevant dimensions part
@@ -981,22 +1155,44 @@ class RLToyEnv(gym.Env):
                         + str(self.config["irrelevant_init_state_dist"])
                     )
 
+            # The CDFs are precomputed so that sampling a start state in reset()
+            # doesn't need to go over the whole distribution
+            self.relevant_init_state_cdf = get_cdf(
+                self.config["relevant_init_state_dist"]
+            )
+            if self.irrelevant_features:
+                self.irrelevant_init_state_cdf = get_cdf(
+                    self.config["irrelevant_init_state_dist"]
+                )
+
         else:  # if continuous or grid space
             pass  # this is handled in reset where we resample if we sample a term. state
 
     def init_transition_function(self):
         """Initialises transition function, P by selecting random next states for every (state, action) tuple for discrete environments. For continuous environments, we have 1 option for the transition function which varies depending on dynamics order and inertia and time_unit for a point object."""
 
+        self.transition_matrix = None
         if self.config["state_space_type"] == "discrete":
             if self.use_custom_mdp:  # custom/user-defined P
                 pass
+            elif self.mdp_cache is not None:  # generated P loaded from the cache
+                self.config["transition_function"] = self.mdp_cache[
+                    "transition_function"
+                ]
+                if self.irrelevant_features:
+                    self.config["transition_function_irrelevant"] = self.mdp_cache[
+                        "transition_function_irrelevant"
+                    ]
             else:
                 # relevant dimensions part
-                self.config["transition_function"] = np.zeros(
+                # The transition function is stored as a compact integer table
+                # instead of an object array to save memory for large state spaces
+                self.config["transition_function"] = np.full(
                     shape=(self.state_space_size[0], self.action_space_size[0]),
-                    dtype=object,
+                    fill_value=-1,
+                    dtype=get_int_dtype(self.state_space_size[0]),
                 )  # #hardcoded
-                self.config["transition_function"][:] = -1  # #IMP # To avoid
+                # #IMP # -1 To avoid
                 # having a valid value from the state space before we actually
                 # assign a usable value below!
                 if self.maximally_connected:
@@ -1015,184 +1211,90 @@ class RLToyEnv(gym.Env):
                             )  # #random #TODO Preferably use the seed of the
                             # Env for this? #hardcoded
                     else:  # if diam > 1
-                        for s in range(self.state_space_size[0]):
-                            i_s = (
-                                s // self.action_space_size[0]
-                            )  # select the current independent set number
-
-                            prob = np.zeros(shape=(self.state_space_size[0],))
-                            prob_next_states = (
-                                np.ones(shape=(self.action_space_size[0],))
-                                / self.action_space_size[0]
-                            )
-                            ind_1 = (
-                                (i_s + 1) * self.action_space_size[0]
-                            ) % self.state_space_size[0]
-                            ind_2 = (
-                                (i_s + 2) * self.action_space_size[0]
-                            ) % self.state_space_size[0]
-                            # print(ind_1, ind_2)
-                            if ind_2 <= ind_1:  # edge case
-                                ind_2 += self.state_space_size[0]
-                            prob[ind_1:ind_2] = prob_next_states
-                            self.config["transition_function"][
-                                s
-                            ] = self.observation_spaces[0].sample(
-                                prob=prob, size=self.action_space_size[0], replace=False
-                            )  # #random #TODO
-                            # Preferably use the seed of the Env for this? #hardcoded
-
-                            # hacky way to do the above
-                            # self.config["transition_function"][s] = self.observation_spaces[0].sample(max=self.action_space_size[0], size=self.action_space_size[0], replace=False) #random #TODO Preferably use the seed of the Env for this? #hardcoded
-                            # Set the transitions from current state to be to the next independent set's states
-                            # self.config["transition_function"][s] += ((i_s + 1) * self.action_space_size[0]) % self.state_space_size[0]
+                        generate_transition_table(
+                            self.observation_spaces[0].np_random,
+                            self.config["transition_function"],
+                            maximally_connected=True,
+                        )  # #random #TODO
+                        # Preferably use the seed of the Env for this? #hardcoded
                 else:  # if not maximally_connected
-                    for s in range(self.state_space_size[0]):
-                        i_s = (
-                            s // self.action_space_size[0]
-                        )  # select the current independent
-                        # set number
-
-                        # Set the probabilities of the next state for the current independent set
-                        prob = np.zeros(shape=(self.state_space_size[0],))
-                        prob_next_states = (
-                            np.ones(shape=(self.action_space_size[0],))
-                            / self.action_space_size[0]
-                        )
-                        ind_1 = (
-                            (i_s + 1) * self.action_space_size[0]
-                        ) % self.state_space_size[0]
-                        ind_2 = (
-                            (i_s + 2) * self.action_space_size[0]
-                        ) % self.state_space_size[0]
-                        # print(ind_1, ind_2)
-                        if ind_2 <= ind_1:  # edge case
-                            ind_2 += self.state_space_size[0]
-                        prob[ind_1:ind_2] = prob_next_states
-
-                        for a in range(self.action_space_size[0]):
-                            # prob[i_s * self.action_space_size[0] : (i_s + 1) * self.action_space_size[0]] = prob_next_states
-                            self.config["transition_function"][
-                                s, a
-                            ] = self.observation_spaces[0].sample(prob=prob)
-                            # #random #TODO Preferably use the seed of the Env for this?
+                    generate_transition_table(
+                        self.observation_spaces[0].np_random,
+                        self.config["transition_function"],
+                        maximally_connected=False,
+                    )  # #random #TODO Preferably use the seed of the Env for this?
                 # Set the next state for terminal states to be themselves, for any action taken.
-                for i_s in range(self.diameter):
-                    for s in range(
+                terminal_states = (
+                    np.arange(self.diameter)[:, np.newaxis] * self.action_space_size[0]
+                    + np.arange(
                         self.action_space_size[0] - self.num_terminal_states,
                         self.action_space_size[0],
-                    ):
-                        for a in range(self.action_space_size[0]):
-                            assert (
-                                self.is_terminal_state(
-                                    i_s * self.action_space_size[0] + s
-                                )
-
-                            )
-                            self.config["transition_function"][
-                                i_s * self.action_space_size[0] + s, a
-                            ] = (
-                                i_s * self.action_space_size[0] + s
-                            )  # Setting
-                            # P(s, a) = s for terminal states, for P() to be
-                            # meaningful even if someone doesn't check for
-                            # 'done' being = True
+                    )
+                ).ravel()
+                assert all(self.is_terminal_state(s) for s in terminal_states)
+                self.config["transition_function"][terminal_states] = terminal_states[
+                    :, np.newaxis
+                ]  # Setting
+                # P(s, a) = s for terminal states, for P() to be
+                # meaningful even if someone doesn't check for
+                # 'done' being = True
 
                 # #irrelevant dimensions part
                 if self.irrelevant_features:  # #test
-                    self.config["transition_function_irrelevant"] = np.zeros(
+                    self.config["transition_function_irrelevant"] = np.full(
                         shape=(self.state_space_size[1], self.action_space_size[1]),
-                        dtype=object,
-                    )
-                    self.config["transition_function_irrelevant"][:] = -1  # #IMP
+                        fill_value=-1,
+                        dtype=get_int_dtype(self.state_space_size[1]),
+                    )  # #IMP -1
                     # To avoid having a valid value from the state space before we
                     # actually assign a usable value below!
-                    if self.maximally_connected:
-                        for s in range(self.state_space_size[1]):
-                            i_s = s // self.action_space_size[1]  # select the
-                            # current independent set number
-
-                            # Set the probabilities of the next state for the
-                            # current independent set
-                            prob = np.zeros(shape=(self.state_space_size[1],))
-                            prob_next_states = (
-                                np.ones(shape=(self.action_space_size[1],))
-                                / self.action_space_size[1]
-                            )
-                            ind_1 = (
-                                (i_s + 1) * self.action_space_size[1]
-                            ) % self.state_space_size[1]
-                            ind_2 = (
-                                (i_s + 2) * self.action_space_size[1]
-                            ) % self.state_space_size[1]
-                            print(ind_1, ind_2)
-                            if ind_2 <= ind_1:  # edge case
-                                ind_2 += self.state_space_size[1]
-                            prob[ind_1:ind_2] = prob_next_states
-
-                            self.config["transition_function_irrelevant"][
-                                s
-                            ] = self.observation_spaces[1].sample(
-                                prob=prob, size=self.action_space_size[1], replace=False
-                            )
-                            # #random #TODO Preferably use the seed of the
-                            # Env for this? #hardcoded
-
-                            # self.config["transition_function_irrelevant"][s] = self.observation_spaces[1].sample(max=self.action_space_size[1], size=self.action_space_size[1], replace=False) #random #TODO Preferably use the seed of the Env for this?
-                            # self.config["transition_function_irrelevant"][s] += ((i_s + 1) * self.action_space_size[1]) % self.state_space_size[1]
-                    else:
-                        for s in range(self.state_space_size[1]):
-                            i_s = s // self.action_space_size[1]  # select the
-                            # current independent set number
-
-                            # Set the probabilities of the next state for the
-                            # current independent set
-                            prob = np.zeros(shape=(self.state_space_size[1],))
-                            prob_next_states = (
-                                np.ones(shape=(self.action_space_size[1],))
-                                / self.action_space_size[1]
-                            )
-                            ind_1 = (
-                                (i_s + 1) * self.action_space_size[1]
-                            ) % self.state_space_size[1]
-                            ind_2 = (
-                                (i_s + 2) * self.action_space_size[1]
-                            ) % self.state_space_size[1]
-                            # print(ind_1, ind_2)
-                            if ind_2 <= ind_1:  # edge case
-                                ind_2 += self.state_space_size[1]
-                            prob[ind_1:ind_2] = prob_next_states
-
-                            for a in range(self.action_space_size[1]):
-                                # prob[i_s * self.action_space_size[1] : (i_s + 1)
-                                # * self.action_space_size[1]] = prob_next_states
-                                self.config["transition_function_irrelevant"][
-                                    s, a
-                                ] = self.observation_spaces[1].sample(prob=prob)
-                                # #random #TODO Preferably use the seed of the Env for this?
+                    generate_transition_table(
+                        self.observation_spaces[1].np_random,
+                        self.config["transition_function_irrelevant"],
+                        maximally_connected=self.maximally_connected,
+                    )  # #random #TODO Preferably use the seed of the Env for this?
 
                     self.logger.warning(
-                        str(self.config["transition_function_irrelevant"])
-                        + "init_transition_function _irrelevant"
-                        + str(type(self.config["transition_function_irrelevant"][0, 0]))
+                        "%sinit_transition_function _irrelevant%s",
+                        self.config["transition_function_irrelevant"],
+                        type(self.config["transition_function_irrelevant"][0, 0]),
                     )
 
             if not callable(self.config["transition_function"]):
-                self.transition_matrix = self.config["transition_function"]
-                self.config[
-                    "transition_function"
-                ] = lambda s, a: self.transition_matrix[s, a]
-                print(
-                    "transition_matrix inited to:\n"
-                    + str(self.transition_matrix)
-                    + "\nPython type of state: "
-                    + str(type(self.config["transition_function"](0, 0)))
-                )  # The
-                # Python type of the state can lead to hard to catch bugs
+                # User-defined transition matrices are also converted to a
+                # contiguous integer table that is indexed directly in
+                # transition_function()
+                transition_matrix = np.asarray(self.config["transition_function"])
+                self.transition_matrix = np.ascontiguousarray(
+                    transition_matrix,
+                    dtype=get_int_dtype(np.max(transition_matrix)),
+                )
+                self.config["transition_function"] = lambda s, a: int(
+                    self.transition_matrix[s, a]
+                )
+                if self.verbose:
+                    print(
+                        "transition_matrix inited to:\n"
+                        + str(self.transition_matrix)
+                        + "\nPython type of state: "
+                        + str(type(self.config["transition_function"](0, 0)))
+                    )  # The
+                    # Python type of the state can lead to hard to catch bugs
 
-        else:  # if continuous or grid space
-            # self.logger.debug("# TODO for cont. spaces") # transition function is a
-            # fixed parameterisation for cont. envs. right now.
+        elif self.config["state_space_type"] == "continuous":
+            # transition function is a
+            # fixed parameterisation for cont. envs. right now. The Taylor update
+            # of the state derivatives over a time_unit is precomputed as a
+            # matrix, see get_dynamics_matrix().
+            self.dynamics_matrix = get_dynamics_matrix(
+                self.dynamics_order, self.time_unit
+            )
+            # Bounds for the bounds-only and off validation levels
+            self.action_space_low = self.action_space.low.copy()
+            self.action_space_high = self.action_space.high.copy()
+            self.state_space_low = self.feature_space.low.copy()
+            self.state_space_high = self.feature_space.high.copy()
+        else:  # if grid space
             pass
 
         self.P = lambda s, a: self.transition_function(s, a)
@@ -1201,6 +1303,7 @@ class RLToyEnv(gym.Env):
         """Initialises reward function, R by selecting random sequences to be rewardable for discrete environments. For continuous environments, we have fixed available options for the reward function."""
         # print("Mersenne2, dummy_eval:", self.np_random.get_state()[2], "dummy_eval" in self.config)
 
+        self.sequence_codes = None
         # #TODO Maybe refactor this code and put useful reusable permutation generators, etc. in one library
         if self.config["state_space_type"] == "discrete":
             if self.use_custom_mdp:  # custom/user-defined R
@@ -1211,7 +1314,10 @@ class RLToyEnv(gym.Env):
                     ]  # #hardcoded
                     # to be 2nd last state in state sequence passed to reward
                     # function, so that reward is R(s, a) when transition is s, a, r, s'
-                    print("reward_matrix inited to:" + str(self.reward_matrix))
+                    if self.verbose:
+                        print("reward_matrix inited to:" + str(self.reward_matrix))
+            elif self.mdp_cache is not None:  # generated R loaded from the cache
+                self.rewardable_sequences = self.mdp_cache["rewardable_sequences"]
             else:
                 non_term_state_space_size = (
                     self.action_space_size[0] - self.num_terminal_states
@@ -1233,8 +1339,6 @@ class RLToyEnv(gym.Env):
                         Relates to the diameter of the MDP
                     """
 
-                    sequences = []
-
                     if repeats:
                         num_possible_sequences = (maximum) ** length
                         num_sel_sequences = int(fraction * num_possible_sequences)
@@ -1255,41 +1359,31 @@ class RLToyEnv(gym.Env):
                         # not possible to have this function be portable as
                         # part of a library because it use the np_random
                         # member variable of this class
-                        for i_s in range(diameter):  # Allow sequences to begin in
-                            # any of the independent sets and therefore this loop is
-                            # over the no. of independent sets(= diameter)
-                            for i in range(num_sel_sequences):
-                                curr_sequence_num = sel_sequence_nums[i]
-                                specific_sequence = []
-                                while len(specific_sequence) != length:
-                                    specific_sequence.append(
-                                        curr_sequence_num % (non_term_state_space_size)
-                                        + ((len(specific_sequence) + i_s) % diameter)
-                                        * self.action_space_size[0]
-                                    )
-                                    # #TODO this uses a member variable of the
-                                    # class. Add another function param to
-                                    # receive this value? Name it independent set size?
-                                    curr_sequence_num = curr_sequence_num // (
-                                        non_term_state_space_size
-                                    )
-                                    # #bottleneck When we sample sequences here,
-                                    # it could get very slow if reward_density is
-                                    # high; alternative would be to assign numbers
-                                    # to sequences and then sample these numbers
-                                    # without replacement and take those sequences
-                                    # specific_sequence =
-                                    # self.relevant_observation_space.sample(size=self.sequence_length,
-                                    # replace=True) # Be careful that sequence_length is less than state space
-                                    # size
-                                sequences.append(specific_sequence)
-                            self.logger.info(
-                                "Total no. of rewarded sequences:"
-                                + str(len(sequences))
-                                + "Out of"
-                                + str(num_possible_sequences)
-                                + "per independent set"
-                            )
+                        # Sequences are allowed to begin in any of the independent
+                        # sets, i_s, (= diameter of them). The sequence numbers are
+                        # converted to sequences for all of them with array
+                        # operations: the position k in a sequence is the kth digit
+                        # of the sequence number in base non_term_state_space_size
+                        positions = np.arange(length)
+                        digits = (
+                            sel_sequence_nums[:, np.newaxis]
+                            // non_term_state_space_size ** positions
+                        ) % non_term_state_space_size
+                        i_s = np.arange(diameter)[:, np.newaxis, np.newaxis]
+                        # #TODO this uses a member variable of the
+                        # class. Add another function param to
+                        # receive this value? Name it independent set size?
+                        specific_sequences = (
+                            digits
+                            + ((positions + i_s) % diameter) * self.action_space_size[0]
+                        )  # shape: (diameter, num_sel_sequences, length)
+                        sequences = specific_sequences.reshape(-1, length).tolist()
+                        self.logger.info(
+                            "Total no. of rewarded sequences:%sOut of%sper"
+                            " independent set",
+                            len(sequences),
+                            num_possible_sequences,
+                        )
                     else:  # if no repeats
                         assert length <= diameter * maximum, (
                             "When there are no"
@@ -1304,108 +1398,94 @@ class RLToyEnv(gym.Env):
                             "No. of choices for each element in a"
                             " possible sequence (Total no. of permutations will be a"
                             " product of this), no. of possible perms per independent"
-                            " set: "
-                            + str(permutations)
-                            + ", "
-                            + str(np.prod(permutations))
+                            " set: %s, %s",
+                            permutations,
+                            np.prod(permutations),
                         )
 
-                        for i_s in range(diameter):  # Allow sequences to begin in
-                            # any of the independent sets and therefore this loop is
-                            # over the no. of independent sets(= diameter). Could
-                            # maybe sample independent set no. as "part" of
-                            # sel_sequence_nums below and avoid this loop?
-                            num_possible_permutations = np.prod(permutations)  # Number
-                            # of possible permutations/sequences for, say, a
-                            # diameter of 3 and 24 total states and
-                            # terminal_state_density = 0.25, i.e., 6 non-terminal
-                            # states (out of 8 states) per independent set, for
-                            # sequence length of 5 is np.prod([6, 6, 6, 5, 5]) * 3;
-                            # the * diameter at the end is needed because the
-                            # sequence can begin in any of the independent sets;
-                            # However, for simplicity, we omit * diameter here and
-                            # just perform the same procedure per independent set.
-                            # This can lead to slightly fewer rewardable sequences
-                            # than should be the case for a given reward_density -
-                            # this is due int() in the next step
-                            num_sel_sequences = int(
-                                fraction * num_possible_permutations
+                        num_possible_permutations = np.prod(permutations)  # Number
+                        # of possible permutations/sequences for, say, a
+                        # diameter of 3 and 24 total states and
+                        # terminal_state_density = 0.25, i.e., 6 non-terminal
+                        # states (out of 8 states) per independent set, for
+                        # sequence length of 5 is np.prod([6, 6, 6, 5, 5]) * 3;
+                        # the * diameter at the end is needed because the
+                        # sequence can begin in any of the independent sets;
+                        # However, for simplicity, we omit * diameter here and
+                        # just perform the same procedure per independent set.
+                        # This can lead to slightly fewer rewardable sequences
+                        # than should be the case for a given reward_density -
+                        # this is due int() in the next step
+                        num_sel_sequences = int(fraction * num_possible_permutations)
+                        if (
+                            num_sel_sequences == 0
+                        ):  # ##TODO Remove this test here and above?
+                            num_sel_sequences = 1
+                            warnings.warn(
+                                "0 rewardable sequences per"
+                                " independent set for given reward_density,"
+                                " sequence_length, diameter and"
+                                " terminal_state_density. Setting it to 1."
                             )
-                            if (
-                                num_sel_sequences == 0
-                            ):  # ##TODO Remove this test here and above?
-                                num_sel_sequences = 1
-                                warnings.warn(
-                                    "0 rewardable sequences per"
-                                    " independent set for given reward_density,"
-                                    " sequence_length, diameter and"
-                                    " terminal_state_density. Setting it to 1."
+                        # Allow sequences to begin in any of the independent sets
+                        # and therefore the permutation numbers are sampled for
+                        # each of the independent sets(= diameter)
+                        sel_sequence_nums = np.array(
+                            [
+                                self.np_random.choice(
+                                    num_possible_permutations,
+                                    size=num_sel_sequences,
+                                    replace=False,
                                 )
-                            # print("Mersenne3:", self.np_random.get_state()[2])
-                            sel_sequence_nums = self.np_random.choice(
-                                num_possible_permutations,
-                                size=num_sel_sequences,
-                                replace=False,
-                            )  # #random # This assumes that all
-                            # sequences have an equal likelihood of being
-                            # selected for being a reward sequence; # TODO
-                            # this code could be replaced with self.np_random.permutation(
-                            # non_term_state_space_size)[self.sequence_length]?
-                            # Replacement becomes a problem then! We have to
-                            # keep sampling until we have all unique rewardable sequences.
-                            # print("Mersenne4:", self.np_random.get_state()[2])
-
-                            total_clashes = 0
-                            for i in range(num_sel_sequences):
-                                curr_permutation = sel_sequence_nums[i]
-                                seq_ = []
-                                curr_rem_digits = []
-                                for j in range(diameter):
-                                    curr_rem_digits.append(
-                                        list(range(maximum))
-                                    )  # # has to contain every number up to n so
-                                    # that any one of them can be picked as part
-                                    # of the sequence below
-                                for enum, j in enumerate(permutations):  # Goes
-                                    # from largest to smallest number among the factors of nPk
-                                    rem_ = curr_permutation % j
-                                    # rem_ = (enum // maximum) * maximum + rem_
-                                    seq_.append(
-                                        curr_rem_digits[(enum + i_s) % diameter][rem_]
-                                        + ((enum + i_s) % diameter)
-                                        * self.action_space_size[0]
-                                    )  # Use (enum + i_s)
-                                    # to allow other independent sets to have
-                                    # states beginning a rewardable sequence
-                                    del curr_rem_digits[(enum + i_s) % diameter][rem_]
-                                    #         print("curr_rem_digits", curr_rem_digits)
-                                    curr_permutation = curr_permutation // j
-
-                                if seq_ in sequences:  # #hack
-                                    total_clashes += (
-                                        1  # #TODO remove these extra checks and
-                                    )
-                                    # assert below
-                                sequences.append(seq_)
-
-                            self.logger.debug(
-                                "Number of generated sequences that"
-                                " did not clash with an existing one when it was"
-                                " generated:" + str(total_clashes)
-                            )
-                            assert total_clashes == 0, (
-                                "None of the generated"
-                                " sequences should have clashed with an existing"
-                                " rewardable sequence when it was generated. No. of"
-                                " times a clash was detected:" + str(total_clashes)
-                            )
-                            self.logger.info(
-                                "Total no. of rewarded sequences:"
-                                + str(len(sequences))
-                                + "Out of"
-                                + str(num_possible_permutations)
-                                + "per independent set"
-                            )
+                                for i_s in range(diameter)
+                            ]
+                        ).ravel()  # #random # This assumes that all
+                        # sequences have an equal likelihood of being
+                        # selected for being a reward sequence; # TODO
+                        # this code could be replaced with self.np_random.permutation(
+                        # non_term_state_space_size)[self.sequence_length]?
+                        # Replacement becomes a problem then! We have to
+                        # keep sampling until we have all unique rewardable sequences.
+                        i_s = np.repeat(np.arange(diameter), num_sel_sequences)
+
+                        # The permutation numbers of all independent sets are
+                        # unranked into sequences with array operations. The
+                        # independent set used at position enum is
+                        # (enum + i_s) % diameter.
+                        states = unrank_sequences(
+                            sel_sequence_nums, permutations, diameter
+                        )
+                        offsets = (
+                            (np.arange(length) + i_s[:, np.newaxis]) % diameter
+                        ) * self.action_space_size[0]
+                        seqs_ = states + offsets  # Use (enum + i_s)
+                        # to allow other independent sets to have
+                        # states beginning a rewardable sequence
+
+                        sequences = seqs_.tolist()
+                        # Hashed check for clashes between the generated sequences
+                        total_clashes = len(sequences) - len(
+                            set(map(tuple, sequences))
+                        )  # #hack #TODO remove these extra checks and
+                        # assert below
+                        self.logger.debug(
+                            "Number of generated sequences that"
+                            " did not clash with an existing one when it was"
+                            " generated:%s",
+                            total_clashes,
+                        )
+                        assert total_clashes == 0, (
+                            "None of the generated"
+                            " sequences should have clashed with an existing"
+                            " rewardable sequence when it was generated. No. of"
+                            " times a clash was detected:" + str(total_clashes)
+                        )
+                        self.logger.info(
+                            "Total no. of rewarded sequences:%sOut of%sper"
+                            " independent set",
+                            len(sequences),
+                            num_possible_permutations,
+                        )
 
                     return sequences
 
@@ -1423,7 +1503,7 @@ class RLToyEnv(gym.Env):
                         self.rewardable_sequences[sequence] = 1.0  # this is the
                         # default reward value, reward scaling will be handled later
                     self.logger.warning(
-                        "specific_sequence that will be rewarded" + str(sequence)
+                        "specific_sequence that will be rewarded%s", sequence
                     )
                     # #TODO impose a different distribution for these:
                     # independently sample state for each step of specific
@@ -1465,7 +1545,8 @@ class RLToyEnv(gym.Env):
                 if isinstance(self.reward_dist, list):  # Specified as interval
                     reward_dist_ = self.reward_dist
                     num_rews = self.diameter * len(rewardable_sequences)
-                    print("num_rewardable_sequences set to:", num_rews)
+                    if self.verbose:
+                        print("num_rewardable_sequences set to:", num_rews)
                     if num_rews == 1:
                         rews = [1.0]
                     else:
@@ -1483,7 +1564,8 @@ class RLToyEnv(gym.Env):
                 if len(rewardable_sequences) > 1000:
                     warnings.warn(
                         "Too many rewardable sequences and/or too long"
-                        " rewardable sequence length. Environment might be too slow."
+                        " rewardable sequence length. Environment initialisation"
+                        " might be slow and take a lot of memory."
                         " Please consider setting the reward_density to be lower or"
                         " reducing the sequence length. No. of rewardable sequences:"
                         + str(len(rewardable_sequences))
@@ -1493,15 +1575,39 @@ class RLToyEnv(gym.Env):
 
                 for specific_sequence in rewardable_sequences:
                     insert_sequence(specific_sequence)
+
                 # else: # "repeats" in sequences are allowed until diameter - 1
                 # steps have been taken: We sample the sequences as the state
                 # number inside each independent set, which are numbered from 0 to
                 # action_space_size - 1
                 #     pass
 
-                print(
-                    "rewardable_sequences: " + str(self.rewardable_sequences)
-                )  # #debug print
+            if not self.use_custom_mdp:
+                # Rewardable sequences (including the partial ones for
+                # make_denser) are also stored with integer codes as keys. The
+                # code for the sequence of the last sequence_length states is
+                # updated incrementally in step(), so that the reward lookup
+                # doesn't depend on sequence_length or on the number of
+                # rewardable sequences. For make_denser, the code of the last
+                # ss_len states, which are matched against the partial sequences
+                # of length ss_len, is the code modulo base ** ss_len.
+                self.sequence_code_base = int(self.state_space_size[0]) + 1
+                self.sequence_code_modulus = self.sequence_code_base ** (
+                    self.sequence_length - 1
+                )
+                self.sub_sequence_code_moduli = [
+                    self.sequence_code_base ** ss_len
+                    for ss_len in range(1, self.sequence_length)
+                ]
+                self.sequence_codes = {
+                    self.encode_sequence(sequence): reward
+                    for sequence, reward in self.rewardable_sequences.items()
+                }
+
+                if self.verbose:
+                    print(
+                        "rewardable_sequences: " + str(self.rewardable_sequences)
+                    )  # #debug print
         elif self.config["state_space_type"] == "continuous":
             # self.logger.debug("# TODO for cont. spaces?: init_reward_function")
             # reward functions are fixed for cont. right now with a few available choices.
@@ -1511,6 +1617,67 @@ class RLToyEnv(gym.Env):
 
         self.R = lambda s, a: self.reward_function(s, a)
 
+    @property
+    def augmented_state(self):
+        """A view of the augmented state, i.e., the sequence of the last delay + sequence_length + 1 states held in the ring buffer, from oldest to newest."""
+        return self.augmented_state_buffer.view
+
+    def get_augmented_state_list(self):
+        """Returns a copy of the augmented state as a list of states from oldest to newest, which is what custom reward functions are called with and what get_augmented_state() returns. Padding states are NaN for discrete environments and lists of NaN for continuous and grid environments instead of the -1 that the ring buffer uses for discrete and grid environments, so that they can't be used as valid indices. Continuous states are np.ndarrays, discrete states are ints and grid states are lists of ints.
+
+        Returns
+        -------
+        list
+            The augmented state of length delay + sequence_length + 1
+
+        """
+        num_padding = max(
+            self.augmented_state_length - 1 - self.total_transitions_episode, 0
+        )
+        if self.config["state_space_type"] == "discrete":
+            padding = [np.nan] * num_padding
+            states = self.augmented_state[num_padding:].tolist()
+        elif self.config["state_space_type"] == "continuous":
+            padding = [[np.nan] * self.state_space_dim for i in range(num_padding)]
+            states = list(self.augmented_state[num_padding:].copy())
+        elif self.config["state_space_type"] == "grid":
+            padding = [[np.nan] * 2 for i in range(num_padding)]  # #hardcoded
+            states = self.augmented_state[num_padding:].tolist()
+        return padding + states
+
+    def encode_sequence(self, sequence):
+        """Encodes a sequence of discrete states as an integer with one digit per state in base (state_space_size + 1). The digit for a state s is s + 1 so that sequences of different lengths have different codes. Padding states (-1 or NaN), which are used to pad the augmented state at the beginning of an episode, have the digit 0.
+
+        Parameters
+        ----------
+        sequence : list or tuple
+            The sequence of discrete states to encode
+
+        Returns
+        -------
+        int
+            The code for the sequence
+        """
+        code = 0
+        for state in sequence:
+            # "not >= 0" is True for both -1 and NaN padding
+            code = code * self.sequence_code_base + (
+                0 if not state >= 0 else int(state) + 1
+            )
+        return code
+
+    def update_sequence_code(self):
+        """Updates the code for the sequence of the last sequence_length states considered for the reward (i.e., ending delay steps before the current state) in O(1) by dropping the oldest state's digit and appending the newest one."""
+        # The entering state is still NaN padding during the 1st delay steps
+        digit = (
+            int(self.augmented_state[-1 - self.delay]) + 1
+            if self.total_transitions_episode >= self.delay
+            else 0
+        )
+        self.sequence_code = (
+            self.sequence_code % self.sequence_code_modulus
+        ) * self.sequence_code_base + digit
+
     def transition_function(self, state, action):
         """The transition function, P.
 
@@ -1531,68 +1698,69 @@ class RLToyEnv(gym.Env):
         """
 
         if self.config["state_space_type"] == "discrete":
-            next_state = self.config["transition_function"](state, action)
+            if self.transition_matrix is not None:  # Fast path for tables
+                next_state = int(self.transition_matrix[state, action])
+            else:
+                next_state = self.config["transition_function"](state, action)
             if self.transition_noise:
-                probs = (
-                    np.ones(shape=(self.state_space_size[0],))
-                    * self.transition_noise
-                    / (self.state_space_size[0] - 1)
-                )
-                probs[next_state] = 1 - self.transition_noise
-                # TODO Samples according to new probs to get noisy discrete transition
-                new_next_state = self.observation_spaces[0].sample(prob=probs)  # random
+                # Samples a noisy discrete transition in O(1), see
+                # sample_noisy_discrete_state()
+                new_next_state = sample_noisy_discrete_state(
+                    self.observation_spaces[0].np_random,
+                    next_state,
+                    self.state_space_size[0],
+                    self.transition_noise,
+                )  # random
                 # print("noisy old next_state, new_next_state", next_state, new_next_state)
                 if next_state != new_next_state:
                     self.logger.info(
-                        "NOISE inserted! old next_state, new_next_state"
-                        + str(next_state)
-                        + str(new_next_state)
+                        "NOISE inserted! old next_state, new_next_state%s%s",
+                        next_state,
+                        new_next_state,
                     )
                     self.total_noisy_transitions_episode += 1
-                # print("new probs:", probs, self.relevant_observation_space.sample(prob=probs))
                 next_state = new_next_state
-                # assert np.sum(probs) == 1, str(np.sum(probs)) + " is not equal to " + str(1)
 
         elif self.config["state_space_type"] == "continuous":
             # ##TODO implement imagined transitions also for cont. spaces
             if self.use_custom_mdp:
                 next_state = self.config["transition_function"](state, action)
             else:
-                assert len(action.shape) == 1, (
-                    "Action should be specified as a 1-D tensor."
-                    " However, shape of action was: " + str(action.shape)
-                )
-                assert action.shape[0] == self.action_space_dim, (
-                    "Action shape is: "
-                    + str(action.shape[0])
-                    + ". Expected: "
-                    + str(self.action_space_dim)
-                )
-                if self.action_space.contains(action):
+                if self.validation_level == "full":
+                    assert len(action.shape) == 1, (
+                        "Action should be specified as a 1-D tensor."
+                        " However, shape of action was: " + str(action.shape)
+                    )
+                    assert action.shape[0] == self.action_space_dim, (
+                        "Action shape is: "
+                        + str(action.shape[0])
+                        + ". Expected: "
+                        + str(self.action_space_dim)
+                    )
+                    valid_action = self.action_space.contains(action)
+                elif self.validation_level == "bounds-only":
+                    valid_action = np.all(action >= self.action_space_low) and np.all(
+                        action <= self.action_space_high
+                    )
+                else:
+                    valid_action = True
+
+                if valid_action:
                     # ### TODO implement for multiple orders, currently only for 1st order systems.
                     # if self.dynamics_order == 1:
                     #     next_state = state + action * self.time_unit / self.inertia
 
-                    # print('self.state_derivatives:', self.state_derivatives)
-                    # Except the last member of state_derivatives, the other occupy the same
-                    # place in memory. Could create a new copy of them every time, but I think
-                    # this should be more efficient and as long as tests don't fail should be
-                    # fine.
                     # action is presumed to be n-th order force ##TODO Could easily scale this
                     # per dimension to give different kinds of dynamics per dimension: maybe
                     # even sample this scale per dimension from a probability distribution to
                     # generate different random Ps?
-                    self.state_derivatives[-1] = (action / self.inertia)
-                    factorial_array = scipy.special.factorial(
-                        np.arange(1, self.dynamics_order + 1)
-                    )  # This is just to speed things up as scipy calculates the factorial only for largest array member
-                    for i in range(self.dynamics_order):
-                        for j in range(self.dynamics_order - i):
-                            # print('i, j, self.state_derivatives, (self.time_unit**(j + 1)), factorial_array:', i, j, self.state_derivatives, (self.time_unit**(j + 1)), factorial_array)
-                            # + state_derivatives_prev[i] Don't need to add previous value as it's already in there at the beginning ##### TODO Keep an old self.state_derivatives and a new one otherwise higher order derivatives will be overwritten before being used by lower order ones.
-                            self.state_derivatives[i] += (self.state_derivatives[i + j + 1] *
-                                                          (self.time_unit ** (j + 1)) / factorial_array[j])
-                    # print('self.state_derivatives:', self.state_derivatives)
+                    self.state_derivatives[-1] = action / self.inertia
+                    # The state derivatives are updated in place, so that
+                    # curr_state, which is a view of state_derivatives[0], is
+                    # updated as well.
+                    self.state_derivatives[:] = integrate_dynamics(
+                        self.dynamics_matrix, self.state_derivatives
+                    )
                     next_state = self.state_derivatives[0]
 
                 else:  # if action is from outside allowed action_space
@@ -1609,30 +1777,39 @@ class RLToyEnv(gym.Env):
             self.total_abs_noise_in_transition_episode += np.abs(noise_in_transition)
             next_state += noise_in_transition  # ##IMP Noise is only applied to
             # state and not to higher order derivatives
-            # TODO Check if next_state is within state space bounds
-            if not self.observation_space.contains(next_state):
-                self.logger.info(
-                    "next_state out of bounds. next_state, clipping to"
-                    + str(next_state)
-                    + str(
-                        np.clip(next_state, -self.state_space_max, self.state_space_max)
-                    )
-                )
-                next_state = np.clip(
-                    next_state, -self.state_space_max, self.state_space_max
+            if self.validation_level == "full":
+                out_of_bounds = not self.observation_space.contains(next_state)
+            elif self.image_representations:
+                # The ImageContinuous observation space never contains a
+                # feature space state, so the full level always clips
+                out_of_bounds = True
+            else:
+                out_of_bounds = not (
+                    np.all(next_state >= self.state_space_low)
+                    and np.all(next_state <= self.state_space_high)
                 )
+            if out_of_bounds:
+                if self.logger.isEnabledFor(logging.INFO):
+                    self.logger.info(
+                        "next_state out of bounds. next_state, clipping to%s%s",
+                        next_state,
+                        np.clip(
+                            next_state, -self.state_space_max, self.state_space_max
+                        ),
+                    )
                 # Could also "reflect"
                 # next_state when it goes out of bounds. Would seem more logical
                 # for a "wall", but would need to take care of multiple
                 # reflections near a corner/edge.
                 # Resets all higher order derivatives to 0
-                zero_state = np.array([0.0] * (self.state_space_dim), dtype=self.dtype)
-                # #####IMP to have copy() otherwise it's the same array
-                # (in memory) at every position in the list:
-                self.state_derivatives = [
-                    zero_state.copy() for i in range(self.dynamics_order + 1)
-                ]
-                self.state_derivatives[0] = next_state
+                self.state_derivatives[1:] = 0
+                np.clip(
+                    next_state,
+                    -self.state_space_max,
+                    self.state_space_max,
+                    out=self.state_derivatives[0],
+                )
+                next_state = self.state_derivatives[0]
 
             if self.config["reward_function"] == "move_to_a_point":
                 next_state_rel = np.array(next_state, dtype=self.dtype)[
@@ -1644,11 +1821,19 @@ class RLToyEnv(gym.Env):
 
         elif self.config["state_space_type"] == "grid":
             # state passed and returned is an np.array
-            # Need to check that dtype is int because Gym doesn't
-            if (
-                self.action_space.contains(action)
-                and np.array(action).dtype == np.int64
-            ):
+            if self.validation_level == "full":
+                # Need to check that dtype is int because Gym doesn't
+                valid_action = (
+                    self.action_space.contains(action)
+                    and np.array(action).dtype == np.int64
+                )
+            elif self.validation_level == "bounds-only":
+                abs_action = np.abs(action)
+                valid_action = np.all(abs_action <= 1) and np.sum(abs_action) <= 1
+            else:
+                valid_action = True
+
+            if valid_action:
                 if self.transition_noise:
                     # self.np_random.choice only works for 1-D arrays
                     if self.np_random.uniform() < self.transition_noise:  # #random
@@ -1656,9 +1841,9 @@ class RLToyEnv(gym.Env):
                             new_action = list(self.action_space.sample())  # #random
                             if new_action != action:
                                 self.logger.info(
-                                    "NOISE inserted! old action, new_action"
-                                    + str(action)
-                                    + str(new_action)
+                                    "NOISE inserted! old action, new_action%s%s",
+                                    action,
+                                    new_action,
                                 )
                                 # print(str(action) + str(new_action))
                                 self.total_noisy_transitions_episode += 1
@@ -1728,6 +1913,8 @@ class RLToyEnv(gym.Env):
         #     assert len(state_considered) == self.augmented_state_length, "Length of list of states passed should be equal to self.augmented_state_length. It was: " + str(len(state_considered))
 
         if self.use_custom_mdp:
+            if state_considered is self.augmented_state:
+                state_considered = self.get_augmented_state_list()
             reward = self.config["reward_function"](state_considered, action)
             self.reward_buffer.append(reward)  # ##TODO Modify seq_len and delay
             # code for discrete and continuous case to use buffer too?
@@ -1736,7 +1923,8 @@ class RLToyEnv(gym.Env):
             del self.reward_buffer[0]
 
         elif self.config["state_space_type"] == "discrete":
-            if np.isnan(state_considered[0]):
+            if not state_considered[0] >= 0:  # padding is -1 (or NaN if a list
+                # of states was passed by the user)
                 pass  # ###IMP: This check is to get around case of
                 # augmented_state_length being > 2, i.e. non-vanilla seq_len or
                 # delay, because then rewards may be handed out for the initial
@@ -1744,27 +1932,37 @@ class RLToyEnv(gym.Env):
                 # handed out without having the agent take an action.
             else:
                 self.logger.debug(
-                    "state_considered for reward:"
-                    + str(state_considered)
-                    + " with delay "
-                    + str(self.delay)
+                    "state_considered for reward:%s with delay %s",
+                    state_considered,
+                    self.delay,
                 )
                 if not self.reward_every_n_steps or (
                     self.reward_every_n_steps
                     and self.total_transitions_episode % self.sequence_length == delay
                 ):
                     # ###TODO also implement this for make_denser case and continuous envs.
-                    sub_seq = tuple(
-                        state_considered[1: self.augmented_state_length - delay]
-                    )
-                    if sub_seq in self.rewardable_sequences:
+                    if state_considered is self.augmented_state:
+                        # Maintained incrementally in step()
+                        sub_seq_code = self.sequence_code
+                    else:
+                        sub_seq_code = self.encode_sequence(
+                            state_considered[1: self.augmented_state_length - delay]
+                        )
+                    if sub_seq_code in self.sequence_codes:
                         # print(state_considered, "with delay", self.delay, "rewarded with:", 1)
-                        reward += self.rewardable_sequences[sub_seq]
+                        reward += self.sequence_codes[sub_seq_code]
                     else:
                         # print(state_considered, "with delay", self.delay, "NOT rewarded.")
                         pass
+                    if self.make_denser:
+                        # Partial rewards for the partial sequences that the last
+                        # states complete
+                        for modulus in self.sub_sequence_code_moduli:
+                            reward += self.sequence_codes.get(
+                                sub_seq_code % modulus, 0.0
+                            )
 
-                    self.logger.info("rew" + str(reward))
+                    self.logger.info("rew%s", reward)
 
         elif self.config["state_space_type"] == "continuous":
             # ##TODO Make reward for along a line case to be length of line
@@ -1783,17 +1981,18 @@ class RLToyEnv(gym.Env):
                 if self.config["reward_function"] == "move_along_a_line":
                     # print("######reward test", self.total_transitions_episode, np.array(self.augmented_state), np.array(self.augmented_state).shape)
                     # #test: 1. for checking 0 distance for same action being always applied; 2. similar to 1. but for different dynamics orders; 3. similar to 1 but for different action_space_dims; 4. for a known applied action case, check manually the results of the formulae and see that programmatic results match: should also have a unit version of 4. for dist_of_pt_from_line() and an integration version here for total_deviation calc.?.
-                    data_ = np.array(state_considered, dtype=self.dtype)[
+                    # np.asarray() doesn't copy the view of the augmented state
+                    data_ = np.asarray(state_considered, dtype=self.dtype)[
                         1: self.augmented_state_length - delay,
                         self.config["relevant_indices"],
                     ]
                     data_mean = data_.mean(axis=0)
                     uu, dd, vv = np.linalg.svd(data_ - data_mean)
                     self.logger.info(
-                        "uu.shape, dd.shape, vv.shape ="
-                        + str(uu.shape)
-                        + str(dd.shape)
-                        + str(vv.shape)
+                        "uu.shape, dd.shape, vv.shape =%s%s%s",
+                        uu.shape,
+                        dd.shape,
+                        vv.shape,
                     )
                     line_end_pts = (
                         vv[0] * np.linspace(-1, 1, 2)[:, np.newaxis]
@@ -1816,7 +2015,7 @@ class RLToyEnv(gym.Env):
                             data_pt, line_end_pts[0], line_end_pts[-1]
                         )
                     self.logger.info(
-                        "total_deviation of pts from fit line:" + str(total_deviation)
+                        "total_deviation of pts from fit line:%s", total_deviation
                     )
 
                     reward += -total_deviation / self.sequence_length
@@ -1825,10 +2024,10 @@ class RLToyEnv(gym.Env):
                     # generate target points randomly but leaving it to the user to do
                     # that. #TODO Generate it randomly to have random Rs?
                     if self.make_denser:
-                        old_relevant_state = np.array(
+                        old_relevant_state = np.asarray(
                             state_considered, dtype=self.dtype
                         )[-2 - delay, self.config["relevant_indices"]]
-                        new_relevant_state = np.array(
+                        new_relevant_state = np.asarray(
                             state_considered, dtype=self.dtype
                         )[-1 - delay, self.config["relevant_indices"]]
                         reward = -np.linalg.norm(new_relevant_state - self.target_point)
@@ -1841,7 +2040,7 @@ class RLToyEnv(gym.Env):
                         # #TODO To enable seq_len, we can hand out reward if distance to target point is reduced (or increased - since that also gives a better signal than giving 0 in that case!!) for seq_len consecutive steps, otherwise 0 reward - however we need to hand out fixed reward for every "sequence" achieved otherwise, if we do it by adding the distance moved towards target in the sequence, it leads to much bigger rewards for larger seq_lens because of overlapping consecutive sequences.
                         # TODO also make_denser, sparse rewards only at target
                     else:  # sparse reward
-                        new_relevant_state = np.array(
+                        new_relevant_state = np.asarray(
                             state_considered, dtype=self.dtype
                         )[-1 - delay, self.config["relevant_indices"]]
                         if (
@@ -1859,20 +2058,22 @@ class RLToyEnv(gym.Env):
         elif self.config["state_space_type"] == "grid":
             if self.config["reward_function"] == "move_to_a_point":
                 if self.make_denser:
-                    old_relevant_state = np.array(state_considered)[-2 - delay]
-                    new_relevant_state = np.array(state_considered)[-1 - delay]
+                    old_relevant_state = np.asarray(state_considered)[-2 - delay]
+                    new_relevant_state = np.asarray(state_considered)[-1 - delay]
 
-                    manhat_dist_old = distance.cityblock(
-                        old_relevant_state, np.array(self.target_point)
-                    )
-                    manhat_dist_new = distance.cityblock(
-                        new_relevant_state, np.array(self.target_point)
-                    )
+                    # The old state is still padding in the 1st delay steps
+                    if old_relevant_state[0] >= 0:
+                        manhat_dist_old = distance.cityblock(
+                            old_relevant_state, np.array(self.target_point)
+                        )
+                        manhat_dist_new = distance.cityblock(
+                            new_relevant_state, np.array(self.target_point)
+                        )
 
-                    reward += manhat_dist_old - manhat_dist_new
+                        reward += manhat_dist_old - manhat_dist_new
 
                 else:  # sparse reward
-                    new_relevant_state = np.array(state_considered)[-1 - delay]
+                    new_relevant_state = np.asarray(state_considered)[-1 - delay]
                     if list(new_relevant_state) == self.target_point:
                         reward += 1.0
 
@@ -1937,39 +2138,37 @@ class RLToyEnv(gym.Env):
         # ### TODO Decide whether to give reward before or after transition ("after" would mean taking next state into account and seems more logical to me) - make it a dimension? - R(s) or R(s, a) or R(s, a, s')? I'd say give it after and store the old state in the augmented_state to be able to let the R have any of the above possible forms. That would also solve the problem of implicit 1-step delay with giving it before. _And_ would not give any reward for already being in a rewarding state in the 1st step but _would_ give a reward if 1 moved to a rewardable state - even if called with R(s, a) because s' is stored in the augmented_state! #####IMP
 
         # ###TODO P uses last state while R uses augmented state; for cont. env, P does know underlying state_derivatives - we don't want this to be the case for the imaginary rollout scenario;
-        next_state = self.P(state, action)
+        next_state = self.transition_function(state, action)  # Same as self.P()
 
         # if imaginary_rollout:
         #     pass
         #     # print("imaginary_rollout") # Since transition_function currently depends only on current state and action, we don't need to do anything here!
         # else:
-        del self.augmented_state[0]
-        if self.config["state_space_type"] == "discrete":
-            self.augmented_state.append(next_state)
-        elif self.config["state_space_type"] == "continuous":
-            self.augmented_state.append(next_state.copy())
-        elif self.config["state_space_type"] == "grid":
-            self.augmented_state.append([next_state[i] for i in range(2)])
+        if self.config["state_space_type"] == "grid":
+            self.augmented_state_buffer.push(next_state[:2])  # #hardcoded
+        else:  # The buffer holds a copy for continuous states
+            self.augmented_state_buffer.push(next_state)
 
         self.total_transitions_episode += 1
+        if self.sequence_codes is not None:
+            self.update_sequence_code()
 
         self.reward = self.R(self.augmented_state, action)
 
         # #irrelevant dimensions part
         if self.config["state_space_type"] == "discrete":
             if self.irrelevant_features:
-                next_state_irrelevant = self.config["transition_function_irrelevant"][
-                    state_irrelevant, action_irrelevant
-                ]
+                next_state_irrelevant = int(
+                    self.config["transition_function_irrelevant"][
+                        state_irrelevant, action_irrelevant
+                    ]
+                )
                 if self.transition_noise:
-                    probs = (
-                        np.ones(shape=(self.state_space_size[1],))
-                        * self.transition_noise
-                        / (self.state_space_size[1] - 1)
-                    )
-                    probs[next_state_irrelevant] = 1 - self.transition_noise
-                    new_next_state_irrelevant = self.observation_spaces[1].sample(
-                        prob=probs
+                    new_next_state_irrelevant = sample_noisy_discrete_state(
+                        self.observation_spaces[1].np_random,
+                        next_state_irrelevant,
+                        self.state_space_size[1],
+                        self.transition_noise,
                     )
                     # #random
                     # if next_state_irrelevant != new_next_state_irrelevant:
@@ -1999,21 +2198,36 @@ class RLToyEnv(gym.Env):
                 self.term_state_reward * self.reward_scale
             )  # Scale before or after?
         self.logger.info(
-            "sas'r:   "
-            + str(self.augmented_state[-2])
-            + "   "
-            + str(action)
-            + "   "
-            + str(self.augmented_state[-1])
-            + "   "
-            + str(self.reward)
+            "sas'r:   %s   %s   %s   %s",
+            self.augmented_state[-2],
+            action,
+            self.augmented_state[-1],
+            self.reward,
         )
+        if self.event_hooks:
+            self.call_event_hooks(
+                "step",
+                {
+                    "state": self.augmented_state[-2],
+                    "action": action,
+                    "next_state": self.augmented_state[-1],
+                    "reward": self.reward,
+                    "done": self.done,
+                },
+            )
 
         return self.curr_obs, self.reward, self.done, self.get_augmented_state()
 
+    def call_event_hooks(self, event, data):
+        """Calls the hooks in config["event_hooks"] with the event name and a dict of data for the event. See the config documentation for the events and their data."""
+        for hook in self.event_hooks:
+            hook(event, data)
+
     def get_augmented_state(self):
         """Intended to return the full augmented state which would be Markovian. (However, it's not Markovian wrt the noise in P and R because we're not returning the underlying RNG.) Currently, returns the augmented state which is the sequence of length "delay + sequence_length + 1" of past states for both discrete and continuous environments. Additonally, the current state derivatives are also returned for continuous environments.
 
+        The augmented state is returned as a new list of states, as returned by get_augmented_state_list(). At the beginning of an episode, it is padded with NaN for discrete environments and with lists of NaN for continuous and grid environments.
+
         Returns
         -------
         dict
@@ -2021,24 +2235,25 @@ class RLToyEnv(gym.Env):
 
         """
         # #TODO For noisy processes, this would need the noise distribution and random seed too. Also add the irrelevant state parts, etc.? We don't need the irrelevant parts for the state to be Markovian.
+        augmented_state = self.get_augmented_state_list()
         if self.config["state_space_type"] == "discrete":
             augmented_state_dict = {
                 "curr_state": self.curr_state,
                 "curr_obs": self.curr_obs,
-                "augmented_state": self.augmented_state,
+                "augmented_state": augmented_state,
             }
         elif self.config["state_space_type"] == "continuous":
             augmented_state_dict = {
                 "curr_state": self.curr_state,
                 "curr_obs": self.curr_obs,
-                "augmented_state": self.augmented_state,
+                "augmented_state": augmented_state,
                 "state_derivatives": self.state_derivatives,
             }
         elif self.config["state_space_type"] == "grid":
             augmented_state_dict = {
                 "curr_state": self.curr_state,
                 "curr_obs": self.curr_obs,
-                "augmented_state": self.augmented_state,
+                "augmented_state": augmented_state,
             }
 
         return augmented_state_dict
@@ -2058,20 +2273,15 @@ class RLToyEnv(gym.Env):
         # been called in the middle of an episode):
         if not self.total_episodes == 0:
             self.logger.info(
-                "Noise stats for previous episode num.: "
-                + str(self.total_episodes)
-                + " (total abs. noise in rewards, total abs."
-                " noise in transitions, total reward, total noisy transitions, total"
-                " transitions): "
-                + str(self.total_abs_noise_in_reward_episode)
-                + " "
-                + str(self.total_abs_noise_in_transition_episode)
-                + " "
-                + str(self.total_reward_episode)
-                + " "
-                + str(self.total_noisy_transitions_episode)
-                + " "
-                + str(self.total_transitions_episode)
+                "Noise stats for previous episode num.: %s (total abs. noise in"
+                " rewards, total abs. noise in transitions, total reward, total noisy"
+                " transitions, total transitions): %s %s %s %s %s",
+                self.total_episodes,
+                self.total_abs_noise_in_reward_episode,
+                self.total_abs_noise_in_transition_episode,
+                self.total_reward_episode,
+                self.total_noisy_transitions_episode,
+                self.total_transitions_episode,
             )
 
         # on episode start stuff:
@@ -2080,33 +2290,29 @@ class RLToyEnv(gym.Env):
         self.total_episodes += 1
 
         if self.config["state_space_type"] == "discrete":
-            self.curr_state_relevant = self.np_random.choice(
-                self.state_space_size[0], p=self.config["relevant_init_state_dist"]
+            self.curr_state_relevant = sample_from_cdf(
+                self.np_random, self.relevant_init_state_cdf
             )  # #random
             self.curr_state = self.curr_state_relevant  # # curr_state set here
             # already in case if statement below is not entered
             if self.irrelevant_features:
-                self.curr_state_irrelevant = self.np_random.choice(
-                    self.state_space_size[1],
-                    p=self.config["irrelevant_init_state_dist"],
+                self.curr_state_irrelevant = sample_from_cdf(
+                    self.np_random, self.irrelevant_init_state_cdf
                 )  # #random
                 self.curr_state = (self.curr_state_relevant, self.curr_state_irrelevant)
                 self.logger.info(
-                    "RESET called. Relevant part of state reset to:"
-                    + str(self.curr_state_relevant)
+                    "RESET called. Relevant part of state reset to:%s",
+                    self.curr_state_relevant,
                 )
                 self.logger.info(
-                    "Irrelevant part of state reset to:"
-                    + str(self.curr_state_irrelevant)
+                    "Irrelevant part of state reset to:%s", self.curr_state_irrelevant
                 )
 
-            self.augmented_state = [
-                np.nan for i in range(self.augmented_state_length - 1)
-            ]
-            self.augmented_state.append(self.curr_state_relevant)
-            # self.augmented_state = np.array(self.augmented_state) # Do NOT make an
-            # np.array out of it because we want to test existence of the array in an
-            # array of arrays which is not possible with np.array!
+            self.augmented_state_buffer.reset(self.curr_state_relevant)
+            if self.sequence_codes is not None:
+                self.sequence_code = self.encode_sequence(
+                    self.augmented_state[1: self.augmented_state_length - self.delay]
+                )
         elif self.config["state_space_type"] == "continuous":
             # self.logger.debug("#TODO for cont. spaces: reset")
             while True:  # Be careful about infinite loops
@@ -2122,9 +2328,9 @@ class RLToyEnv(gym.Env):
                             j = i
                     self.logger.info(
                         "A state was sampled in term state subspace."
-                        " Therefore, resampling. State was, subspace was:"
-                        + str(self.curr_state)
-                        + str(j)
+                        " Therefore, resampling. State was, subspace was:%s%s",
+                        self.curr_state,
+                        j,
                     )  # ##TODO Move this logic
                     # into a new class in Gym spaces that can contain
                     # subspaces for term states! (with warning/error if term
@@ -2135,19 +2341,16 @@ class RLToyEnv(gym.Env):
                     break
 
             # if not self.use_custom_mdp:
-            # init the state derivatives needed for continuous spaces
-            zero_state = np.array([0.0] * (self.state_space_dim), dtype=self.dtype)
-            self.state_derivatives = [
-                zero_state.copy() for i in range(self.dynamics_order + 1)
-            ]  # #####IMP to have copy()
-            # otherwise it's the same array (in memory) at every position in the list
+            # init the state derivatives needed for continuous spaces. They are
+            # stacked in an array of shape (dynamics_order + 1, state_space_dim)
+            # and curr_state is a view of the 0th derivative.
+            self.state_derivatives = np.zeros(
+                (self.dynamics_order + 1, self.state_space_dim), dtype=self.dtype
+            )
             self.state_derivatives[0] = self.curr_state
+            self.curr_state = self.state_derivatives[0]
 
-            self.augmented_state = [
-                [np.nan] * self.state_space_dim
-                for i in range(self.augmented_state_length - 1)
-            ]
-            self.augmented_state.append(self.curr_state.copy())
+            self.augmented_state_buffer.reset(self.curr_state)
 
         elif self.config["state_space_type"] == "grid":
             # Need to set self.curr_state, self.augmented_state
@@ -2159,17 +2362,15 @@ class RLToyEnv(gym.Env):
                 if self.is_terminal_state(self.curr_state_relevant):
                     self.logger.info(
                         "A terminal state was sampled. Therefore,"
-                        " resampling. State was:" + str(self.curr_state)
+                        " resampling. State was:%s",
+                        self.curr_state,
                     )
                     term_space_was_sampled = True
                     break
                 if not term_space_was_sampled:
                     break
 
-            self.augmented_state = [
-                np.nan for i in range(self.augmented_state_length - 1)
-            ]
-            self.augmented_state.append(self.curr_state_relevant)
+            self.augmented_state_buffer.reset(self.curr_state_relevant)
 
         if self.image_representations:
             self.curr_obs = self.observation_space.get_concatenated_image(
@@ -2178,7 +2379,7 @@ class RLToyEnv(gym.Env):
         else:
             self.curr_obs = self.curr_state
 
-        self.logger.info("RESET called. curr_state reset to: " + str(self.curr_state))
+        self.logger.info("RESET called. curr_state reset to: %s", self.curr_state)
         self.reached_terminal = False
 
         self.total_abs_noise_in_reward_episode = 0
@@ -2190,10 +2391,10 @@ class RLToyEnv(gym.Env):
         self.total_transitions_episode = 0
 
         self.logger.info(
-            " self.delay, self.sequence_length:"
-            + str(self.delay)
-            + str(self.sequence_length)
+            " self.delay, self.sequence_length:%s%s", self.delay, self.sequence_length
         )
+        if self.event_hooks:
+            self.call_event_hooks("reset", {"state": self.augmented_state[-1]})
 
         return self.curr_obs
 
@@ -2214,15 +2415,60 @@ class RLToyEnv(gym.Env):
         """
         # If seed is None, you get a randomly generated seed from gym.utils...
         self.np_random, self.seed_ = gym.utils.seeding.np_random(seed)  # #random
-        print(
-            "Env SEED set to: "
-            + str(seed)
-            + ". Returned seed from Gym: "
-            + str(self.seed_)
-        )
+        if self.verbose:
+            print(
+                "Env SEED set to: "
+                + str(seed)
+                + ". Returned seed from Gym: "
+                + str(self.seed_)
+            )
         return self.seed_
 
 
+class AugmentedStateBuffer:
+    """A preallocated ring buffer that holds the last length states, i.e., the augmented state of an RLToyEnv. Every state is written twice, at positions i and i + length of an array of 2 * length states, so that the last length states are always available as a contiguous view of the array without copying. A push() is O(1).
+
+    Attributes
+    ----------
+    view : np.ndarray
+        A view of the last length states from oldest to newest. It's updated in place by push() and reset().
+    """
+
+    def __init__(self, length, state_shape=(), dtype=np.int64, pad_value=-1):
+        """
+        Parameters
+        ----------
+        length : int
+            The number of states held
+        state_shape : tuple
+            The shape of a single state
+        dtype : numpy.dtype
+            The dtype of the states
+        pad_value : int or float
+            The value that the buffer is filled with at reset
+        """
+        self.length = length
+        self.pad_value = pad_value
+        self.buffer = np.full(
+            (2 * length,) + tuple(state_shape), pad_value, dtype=dtype
+        )
+        self.oldest = 0  # position of the oldest state
+        self.view = self.buffer[self.oldest: self.oldest + self.length]
+
+    def push(self, state):
+        """Overwrites the oldest state with state."""
+        self.buffer[self.oldest] = state
+        self.buffer[self.oldest + self.length] = state
+        self.oldest = (self.oldest + 1) % self.length
+        self.view = self.buffer[self.oldest: self.oldest + self.length]
+
+    def reset(self, state):
+        """Fills the buffer with padding and pushes state as the newest state."""
+        self.buffer[:] = self.pad_value
+        self.oldest = 0
+        self.push(state)
+
+
 def dist_of_pt_from_line(pt, ptA, ptB):
     """Returns shortest distance of a point from a line defined by 2 points - ptA and ptB. Based on: https://softwareengineering.stackexchange.com/questions/168572/distance-from-point-to-n-dimensional-line"""
 
@@ -2252,11 +2498,223 @@ def dist_of_pt_from_line(pt, ptA, ptB):
         return dist
 
 
+MDP_CACHE_VERSION = 1
+
+
+def get_shared_mdp_cache_dir():
+    """Returns the directory for MDP caches in shared memory, i.e., in /dev/shm where it's available and in the temporary directory otherwise."""
+    shared_memory_dir = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(shared_memory_dir, "mdp_playground_mdp_cache")
+
+
+def clear_shared_mdp_cache(paths=None):
+    """Removes MDP caches from shared memory, where they are not evicted automatically. Processes that have already memory-mapped the removed transition tables can keep using them.
+
+    Parameters
+    ----------
+    paths : list of str
+        The paths of the cache entries to remove, e.g., the mdp_cache_path of environments. If None, the whole directory from get_shared_mdp_cache_dir() is removed.
+    """
+    if paths is None:
+        paths = [get_shared_mdp_cache_dir()]
+    for path in paths:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def save_mdp_cache(
+    path,
+    transition_function,
+    transition_function_irrelevant,
+    rewardable_sequences,
+    rng_states,
+):
+    """Saves a generated discrete MDP to the directory path as .npy files that can be loaded memory-mapped by load_mdp_cache(). The files are first written to a temporary directory which is then renamed to path, so that concurrent processes never see a partially written cache."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = tempfile.mkdtemp(dir=os.path.dirname(path))
+    np.save(os.path.join(tmp_path, "transition_function.npy"), transition_function)
+    if transition_function_irrelevant is not None:
+        np.save(
+            os.path.join(tmp_path, "transition_function_irrelevant.npy"),
+            transition_function_irrelevant,
+        )
+    # Sequences of different lengths (partial sequences for make_denser) are
+    # padded with -1
+    max_len = max([len(sequence) for sequence in rewardable_sequences], default=0)
+    sequences = np.full((len(rewardable_sequences), max_len), -1, dtype=np.int64)
+    for i, sequence in enumerate(rewardable_sequences):
+        sequences[i, : len(sequence)] = sequence
+    np.save(os.path.join(tmp_path, "rewardable_sequences.npy"), sequences)
+    np.save(
+        os.path.join(tmp_path, "rewards.npy"),
+        np.array(list(rewardable_sequences.values()), dtype=np.float64),
+    )
+    np.save(
+        os.path.join(tmp_path, "rng_keys.npy"),
+        np.stack([rng_state[1] for rng_state in rng_states]),
+    )
+    with open(os.path.join(tmp_path, "metadata.json"), "w") as f:
+        json.dump(
+            {
+                "version": MDP_CACHE_VERSION,
+                "rng_states": [
+                    [rng_state[0]] + [rng_state_ for rng_state_ in rng_state[2:]]
+                    for rng_state in rng_states
+                ],
+            },
+            f,
+        )
+    try:
+        os.rename(tmp_path, path)
+    except OSError:  # Another process cached the same MDP in the meantime
+        shutil.rmtree(tmp_path)
+
+
+def load_mdp_cache(path):
+    """Loads a discrete MDP saved by save_mdp_cache(). The transition tables are memory-mapped read-only, so that processes that load the same MDP share one copy of them in memory. The rewardable sequences are read into a new dict, of which each process has its own copy.
+
+    Returns
+    -------
+    dict
+        With keys transition_function, transition_function_irrelevant (None if not cached), rewardable_sequences and rng_states.
+    """
+    with open(os.path.join(path, "metadata.json")) as f:
+        metadata = json.load(f)
+    irrelevant_path = os.path.join(path, "transition_function_irrelevant.npy")
+    sequences = np.load(os.path.join(path, "rewardable_sequences.npy")).tolist()
+    rewards = np.load(os.path.join(path, "rewards.npy")).tolist()
+    rng_keys = np.load(os.path.join(path, "rng_keys.npy"))
+    return {
+        "transition_function": np.load(
+            os.path.join(path, "transition_function.npy"), mmap_mode="r"
+        ),
+        "transition_function_irrelevant": np.load(irrelevant_path, mmap_mode="r")
+        if os.path.exists(irrelevant_path)
+        else None,
+        "rewardable_sequences": {
+            tuple(state for state in sequence if state >= 0): reward
+            for sequence, reward in zip(sequences, rewards)
+        },
+        "rng_states": [
+            (rng_state[0], keys, *rng_state[1:])
+            for rng_state, keys in zip(metadata["rng_states"], rng_keys)
+        ],
+    }
+
+
+def get_dynamics_matrix(dynamics_order, time_unit):
+    """Returns the (dynamics_order + 1) x (dynamics_order + 1) matrix M that propagates the state derivatives (0th to nth) of an nth order system over time_unit with a Taylor expansion: M[i, k] = time_unit ** (k - i) / (k - i)! for k >= i and 0 otherwise. The nth derivative is held constant over the time_unit."""
+    orders = np.arange(dynamics_order + 1)
+    exponents = np.maximum(orders[np.newaxis, :] - orders[:, np.newaxis], 0)
+    return np.triu(time_unit ** exponents / scipy.special.factorial(exponents))
+
+
+def integrate_dynamics(dynamics_matrix, state_derivatives):
+    """Applies the matrix from get_dynamics_matrix() to the state derivatives. The state derivatives can be of shape (dynamics_order + 1, state_space_dim) or stacked for multiple environments with a shape of (num_envs, dynamics_order + 1, state_space_dim).
+
+    For a dynamics_order > 1, the terms of the Taylor expansion are summed in a different order and precision than by the nested loops over the state derivatives that were used before, so seeded trajectories differ from those in their last bits (a relative difference of about 1e-7 for float32 states). For a dynamics_order of 1, they are the same.
+    """
+    return np.matmul(dynamics_matrix, state_derivatives)
+
+
+def generate_transition_table(np_random, transition_table, maximally_connected):
+    """Fills transition_table, of shape (state_space_size, action_space_size), with random next states for a generated discrete MDP. The states are split into independent sets of action_space_size states and the next states of every state are sampled from the states of the next independent set. If maximally_connected, every action of a state leads to a different one of these states.
+
+    The next states are sampled from the action_space_size states of the next independent set only. This gives exactly the same tables for a given seed as sampling them with np_random.choice() and a probability vector over all states for every state, but it takes O(state_space_size * action_space_size) time instead of O(state_space_size ** 2). If not maximally_connected, the table is sampled with array operations.
+    """
+    num_states, num_actions = transition_table.shape
+    # The 1st state of the next independent set for every state
+    next_set_starts = (
+        (np.arange(num_states) // num_actions + 1) * num_actions
+    ) % num_states
+    prob_next_states = np.ones(shape=(num_actions,)) / num_actions
+    if maximally_connected:
+        # The number of draws from np_random for sampling without replacement
+        # depends on the samples, so this can't be done for all states at once
+        for s in range(num_states):
+            transition_table[s] = next_set_starts[s] + np_random.choice(
+                num_actions, size=num_actions, replace=False, p=prob_next_states
+            )  # #random
+    else:
+        # Consumes 1 uniform sample per (state, action) pair in the same order
+        # as sampling them one by one
+        uniform_samples = np_random.random_sample(size=transition_table.shape)
+        transition_table[:] = next_set_starts[:, np.newaxis] + get_cdf(
+            prob_next_states
+        ).searchsorted(uniform_samples, side="right")
+
+
+def get_cdf(prob):
+    """Returns the CDF of the discrete distribution prob in the same way as np.random.RandomState.choice() computes it, so that sample_from_cdf() samples exactly the same values as choice() with p=prob."""
+    cdf = np.asarray(prob, dtype=np.float64).cumsum()
+    cdf /= cdf[-1]
+    return cdf
+
+
+def sample_from_cdf(np_random, cdf):
+    """Samples from a discrete distribution given its CDF from get_cdf() with a binary search. Consumes a single uniform sample from np_random like np_random.choice() does with p set."""
+    return int(cdf.searchsorted(np_random.random_sample(), side="right"))  # #random
+
+
+def sample_noisy_discrete_state(np_random, state, num_states, noise):
+    """Samples a state that is equal to state with probability 1 - noise and uniformly one of the other num_states - 1 states otherwise.
+
+    This inverts the CDF of that distribution analytically in O(1) instead of building the probability vector over all num_states states. It consumes a single uniform sample from np_random and maps it to the same state that np_random.choice(num_states, p=probs) would sample with the probability vector probs of the distribution, up to floating point rounding at the boundaries between states. Seeded environments therefore have the same noisy transitions as with choice().
+    """
+    other_state_prob = noise / (num_states - 1)
+    u = np_random.random_sample()  # #random
+    state_start = state * other_state_prob
+    if u < state_start:
+        return int(min(u // other_state_prob, state - 1))
+    state_end = state_start + (1 - noise)
+    if u < state_end:
+        return int(state)
+    return int(min(state + 1 + (u - state_end) // other_state_prob, num_states - 1))
+
+
+def unrank_sequences(permutation_nums, permutations, diameter):
+    """Unranks permutation numbers into sequences of states without repeats, as used for the rewardable sequences of discrete environments.
+
+    Position i of a sequence picks one of the permutations[i] states of its independent set that are still unused in the sequence and the independent sets cycle with the positions, so the states already used at position i are those at the earlier positions with the same i % diameter. As for a Lehmer code, the index of the chosen state among the unused ones is the remainder of the permutation number and the state itself is found by going over the used states in increasing order and incrementing the index for each used state <= it. This needs memory only proportional to the number of sequences times their length, independent of the number of states.
+
+    Parameters
+    ----------
+    permutation_nums : np.ndarray
+        The permutation numbers, one per sequence
+    permutations : list of int
+        The number of choices at each position of the sequences
+    diameter : int
+        The number of independent sets
+
+    Returns
+    -------
+    np.ndarray
+        The states of the sequences within their independent sets, of shape (len(permutation_nums), len(permutations))
+    """
+    permutation_nums = np.asarray(permutation_nums, dtype=np.int64)
+    length = len(permutations)
+    states = np.empty((len(permutation_nums), length), dtype=np.int64)
+    for i, num_choices in enumerate(permutations):  # Goes from largest to
+        # smallest number among the factors of nPk
+        state = permutation_nums % num_choices
+        used = np.sort(states[:, i % diameter: i: diameter], axis=1)
+        for j in range(used.shape[1]):
+            state += used[:, j] <= state
+        states[:, i] = state
+        permutation_nums = permutation_nums // num_choices
+
+    return states
+
+
 def list_to_float_np_array(lis):
     """Converts list to numpy float array"""
     return np.array(list(float(i) for i in lis))
 
 
+def get_int_dtype(max_value):
+    """Returns the smallest of int32 and int64 that can hold integers up to max_value"""
+    return np.int32 if max_value <= np.iinfo(np.int32).max else np.int64
+
+
 if __name__ == "__main__":
 
     print("Please see example.py for how to use RLToyEnv.")
@@ -0,0 +1,761 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import copy
+import warnings
+import numpy as np
+from gym.vector import VectorEnv
+from mdp_playground.envs.rl_toy_env import (
+    RLToyEnv,
+    integrate_dynamics,
+    sample_noisy_discrete_state,
+)
+
+
+class RLToyVecEnv(VectorEnv):
+    """A batched version of RLToyEnv that steps B independent environments with one call to step().
+
+    The B environments are first instantiated as regular RLToyEnvs, so that the generated MDPs (transition tables, rewardable sequences, terminal states, initial state distributions) and the RNG streams are exactly the same as for B scalar RLToyEnvs with the same configs. The state of all B environments is then held as stacked NumPy arrays and a step() performs the transition lookup (or the integration of the dynamics for continuous environments), the update of the augmented state, the reward computation and the terminal state check for all environments with NumPy calls over the batch dimension. Only the parts of a step that draw from the RNGs of the individual environments (transition and reward noise) and that generate image representations are performed per environment, so that these remain bit-for-bit equivalent to the scalar case. The only exception is the move_along_a_line reward for continuous environments where the distances of points from the fit line are computed in a batched way and may differ in the last bits from those computed by RLToyEnv.
+
+    Environments whose episode ended are reset automatically. The observation returned for them is then the start state of the new episode and the terminal observation of the episode that ended is available in the info dict under the key "terminal_observation".
+
+    The generated (use_custom_mdp = False) discrete, continuous and grid environments are stepped in a batched way as described above. If any environment in the batch has a custom MDP (use_custom_mdp = True) or event_hooks, whose user-defined functions can only be called for one environment at a time, RLToyVecEnv falls back to stepping the underlying RLToyEnvs one after the other with their own step(). The returned batches and the auto-reset are the same in both cases.
+
+    Attributes
+    ----------
+    envs : list of RLToyEnv
+        The underlying scalar environments. These are used to generate the MDPs, as the holders of the RNGs and for resets.
+    step_scalar_envs : bool
+        Whether the underlying environments are stepped one after the other, because at least one of them has a custom MDP or event_hooks.
+    num_envs : int
+        The number of environments, B, in the batch.
+    single_observation_space : Gym.Space
+        The observation space of a single environment.
+    single_action_space : Gym.Space
+        The action space of a single environment.
+
+    Methods
+    -------
+    reset()
+        Resets all environments and returns the batch of start states.
+    step(actions)
+        Performs 1 transition for all environments in the batch.
+    """
+
+    def __init__(self, configs=None, seeds=None, **config):
+        """Initialises the batch of environments.
+
+        Parameters
+        ----------
+        configs : list of dict
+            A list of B config dicts, one per environment, as they would be passed to RLToyEnv. If this is not provided, seeds has to be provided.
+        seeds : list of int or dict
+            A list of B seeds. The environments are then instantiated from the config passed as keyword arguments with the seed set to one of these values. Passing the same seed multiple times results in copies of the same environment.
+        config : dict
+            The config shared by all environments if seeds is provided.
+        """
+        if configs is None:
+            assert seeds is not None, (
+                "Please provide either a list of configs or a list of seeds for"
+                " RLToyVecEnv."
+            )
+            configs = []
+            for seed in seeds:
+                config_ = copy.deepcopy(config)
+                config_["seed"] = seed
+                configs.append(config_)
+
+        assert len(configs) > 0, "RLToyVecEnv needs at least 1 config."
+        # Configs are copied because RLToyEnv writes to the config it receives and
+        # the configs may be shared.
+        self.envs = [RLToyEnv(**copy.deepcopy(config_)) for config_ in configs]
+        env = self.envs[0]
+        self.config = env.config
+        self.state_space_type = env.config["state_space_type"]
+        self.env_indices = np.arange(len(self.envs))
+        self.step_scalar_envs = any(
+            env_.use_custom_mdp or env_.event_hooks for env_ in self.envs
+        )
+        if self.step_scalar_envs:
+            super(RLToyVecEnv, self).__init__(
+                len(self.envs), env.observation_space, env.action_space
+            )
+            self.curr_obs = self.get_reset_observations(self.env_indices)
+            return
+
+        for env_ in self.envs:
+            assert env_.config["state_space_type"] == self.state_space_type
+            assert env_.augmented_state_length == env.augmented_state_length
+            assert env_.delay == env.delay
+            assert env_.irrelevant_features == env.irrelevant_features
+            assert env_.image_representations == env.image_representations
+
+        self.delay = env.delay
+        self.sequence_length = env.sequence_length
+        self.augmented_state_length = env.augmented_state_length
+        self.irrelevant_features = env.irrelevant_features
+        self.image_representations = env.image_representations
+
+        super(RLToyVecEnv, self).__init__(
+            len(self.envs), env.observation_space, env.action_space
+        )
+
+        # Parameters that may differ across the environments in the batch are
+        # stacked along the 1st dimension.
+        self.reward_scale = np.array(
+            [env_.reward_scale for env_ in self.envs], dtype=np.float64
+        )
+        self.reward_shift = np.array(
+            [env_.reward_shift for env_ in self.envs], dtype=np.float64
+        )
+        self.term_state_reward = np.array(
+            [env_.term_state_reward for env_ in self.envs], dtype=np.float64
+        )
+
+        if self.state_space_type == "discrete":
+            self.init_discrete()
+        elif self.state_space_type == "continuous":
+            self.init_continuous()
+        elif self.state_space_type == "grid":
+            self.init_grid()
+
+        self.total_transitions_episode = np.zeros(self.num_envs, dtype=np.int64)
+        self.reached_terminal = np.zeros(self.num_envs, dtype=bool)
+        for i in range(self.num_envs):
+            self.copy_state_from_env(i)
+        self.curr_obs = self.get_reset_observations(self.env_indices)
+
+    def init_discrete(self):
+        """Stacks the transition functions, terminal states and rewardable sequences of the discrete environments."""
+        env = self.envs[0]
+        self.state_space_size = env.state_space_size
+        for env_ in self.envs:
+            assert (
+                np.array(env_.state_space_size) == np.array(self.state_space_size)
+            ).all(), "All environments need to have the same state_space_size."
+
+        self.transition_tables = np.stack(
+            [env_.transition_matrix for env_ in self.envs]
+        )
+        if self.irrelevant_features:
+            self.transition_tables_irrelevant = np.stack(
+                [env_.config["transition_function_irrelevant"] for env_ in self.envs]
+            )
+
+        self.terminal_tables = np.zeros(
+            (self.num_envs, self.state_space_size[0]), dtype=bool
+        )
+        for i, env_ in enumerate(self.envs):
+            for s in range(self.state_space_size[0]):
+                self.terminal_tables[i, s] = env_.is_terminal_state(s)
+
+        # Rewardable sequences of all environments are encoded as integers in
+        # base |S| and the environment number is prepended as the most
+        # significant "digit", so that the rewards for the whole batch can be
+        # looked up with a single searchsorted() per sequence length. The
+        # sequences of length sequence_length are looked up first and then the
+        # shorter make_denser partial sequences, in the same order as in
+        # RLToyEnv.reward_function().
+        base = int(self.state_space_size[0])
+        self.sequence_code_base = base
+        self.sequence_lengths = [self.sequence_length] + list(
+            range(1, self.sequence_length)
+        )
+        self.use_sequence_codes = (
+            base ** self.sequence_length * self.num_envs < np.iinfo(np.int64).max
+        )
+        if self.use_sequence_codes:
+            codes = {ss_len: [] for ss_len in self.sequence_lengths}
+            rewards = {ss_len: [] for ss_len in self.sequence_lengths}
+            for i, env_ in enumerate(self.envs):
+                for sequence, reward in env_.rewardable_sequences.items():
+                    code = i
+                    for s in sequence:
+                        code = code * base + int(s)
+                    codes[len(sequence)].append(code)
+                    rewards[len(sequence)].append(reward)
+            self.sequence_codes, self.sequence_rewards = {}, {}
+            for ss_len in self.sequence_lengths:
+                codes_ = np.array(codes[ss_len], dtype=np.int64)
+                order = np.argsort(codes_)
+                self.sequence_codes[ss_len] = codes_[order]
+                self.sequence_rewards[ss_len] = np.array(
+                    rewards[ss_len], dtype=np.float64
+                )[order]
+
+        # Padding at the beginning of an episode is -1, as in RLToyEnv
+        self.augmented_states = np.full(
+            (self.num_envs, self.augmented_state_length), -1, dtype=np.int64
+        )
+        self.curr_states = np.zeros(self.num_envs, dtype=np.int64)
+        if self.irrelevant_features:
+            self.curr_states_irrelevant = np.zeros(self.num_envs, dtype=np.int64)
+
+    def init_continuous(self):
+        """Stacks the dynamics parameters, terminal regions and target points of the continuous environments."""
+        env = self.envs[0]
+        self.dtype = env.dtype
+        self.state_space_dim = env.state_space_dim
+        self.dynamics_order = env.dynamics_order
+        self.relevant_indices = list(env.config["relevant_indices"])
+        self.reward_function = env.config["reward_function"]
+        for env_ in self.envs:
+            assert env_.state_space_dim == self.state_space_dim
+            assert env_.dynamics_order == self.dynamics_order
+            assert env_.dtype == self.dtype
+            assert env_.config["reward_function"] == self.reward_function
+            assert list(env_.config["relevant_indices"]) == self.relevant_indices
+            # Time unit and inertia are shared because the dynamics are integrated
+            # for the whole batch at once
+            assert env_.time_unit == env.time_unit
+            assert np.array_equal(env_.inertia, env.inertia)
+
+        self.time_unit = env.time_unit
+        self.inertia = env.inertia
+        self.state_space_max = np.array(
+            [env_.state_space_max for env_ in self.envs]
+        )[:, np.newaxis]
+        self.action_space_low = np.stack([env_.action_space.low for env_ in self.envs])
+        self.action_space_high = np.stack(
+            [env_.action_space.high for env_ in self.envs]
+        )
+        self.feature_space_low = np.stack(
+            [env_.feature_space.low for env_ in self.envs]
+        )
+        self.feature_space_high = np.stack(
+            [env_.feature_space.high for env_ in self.envs]
+        )
+        self.action_loss_weight = np.array(
+            [env_.action_loss_weight for env_ in self.envs], dtype=np.float64
+        )
+        self.make_denser = env.make_denser
+        if self.reward_function == "move_to_a_point":
+            self.target_point = np.stack([env_.target_point for env_ in self.envs])
+            self.target_radius = np.array([env_.target_radius for env_ in self.envs])
+
+        self.init_terminal_boxes()
+
+        # The state derivatives are stacked like in RLToyEnv, with an additional
+        # batch dimension: (B, dynamics_order + 1, state_space_dim)
+        self.dynamics_matrix = env.dynamics_matrix
+        self.state_derivatives = np.zeros(
+            (self.num_envs, self.dynamics_order + 1, self.state_space_dim),
+            dtype=self.dtype,
+        )
+        self.augmented_states = np.full(
+            (self.num_envs, self.augmented_state_length, self.state_space_dim),
+            np.nan,
+            dtype=self.dtype,
+        )
+
+    def init_grid(self):
+        """Stacks the grid shapes, terminal states and target points of the grid environments."""
+        env = self.envs[0]
+        self.grid_shape = np.array(env.grid_shape)
+        self.reward_function = env.config["reward_function"]
+        for env_ in self.envs:
+            assert np.array_equal(env_.grid_shape, env.grid_shape)
+            assert env_.config["reward_function"] == self.reward_function
+
+        self.make_denser = env.make_denser
+        if self.reward_function == "move_to_a_point":
+            self.target_point = np.array([env_.target_point for env_ in self.envs])
+
+        self.init_terminal_boxes()
+
+        self.curr_states = np.zeros((self.num_envs, len(self.grid_shape)), dtype=np.int64)
+        # Grid augmented states only hold the relevant 2 dimensions and are
+        # padded with -1, as in RLToyEnv
+        self.augmented_states = np.full(
+            (self.num_envs, self.augmented_state_length, 2), -1, dtype=np.int64
+        )
+
+    def init_terminal_boxes(self):
+        """Stacks the terminal sub-spaces of continuous and grid environments as (B, T, dim) arrays of lows and highs. If the terminal states are specified as a Python function for an environment, the function is called per environment in step()."""
+        self.callable_terminal_states = any(
+            callable(env_.config.get("terminal_states")) for env_ in self.envs
+        )
+        num_term_spaces = [len(env_.term_spaces) for env_ in self.envs]
+        self.term_spaces_low, self.term_spaces_high = None, None
+        if not self.callable_terminal_states and max(num_term_spaces) > 0:
+            assert len(set(num_term_spaces)) == 1, (
+                "All environments need to have the same number of terminal"
+                " sub-spaces."
+            )
+            self.term_spaces_low = np.stack(
+                [[space.low for space in env_.term_spaces] for env_ in self.envs]
+            )
+            self.term_spaces_high = np.stack(
+                [[space.high for space in env_.term_spaces] for env_ in self.envs]
+            )
+
+    def copy_state_from_env(self, i):
+        """Copies the state of the i-th underlying environment (after it was reset) into the stacked arrays."""
+        env = self.envs[i]
+        if self.state_space_type == "discrete":
+            self.augmented_states[i] = env.augmented_state
+            if self.irrelevant_features:
+                self.curr_states[i] = env.curr_state[0]
+                self.curr_states_irrelevant[i] = env.curr_state[1]
+            else:
+                self.curr_states[i] = env.curr_state
+        elif self.state_space_type == "continuous":
+            self.state_derivatives[i] = env.state_derivatives
+            self.augmented_states[i] = np.array(env.augmented_state, dtype=self.dtype)
+        elif self.state_space_type == "grid":
+            self.curr_states[i] = env.curr_state
+            self.augmented_states[i] = env.augmented_state
+
+        self.total_transitions_episode[i] = 0
+        self.reached_terminal[i] = env.reached_terminal
+
+    def reset_async(self):
+        pass
+
+    def reset_wait(self, **kwargs):
+        """Resets all environments in the batch.
+
+        Returns
+        -------
+        np.array
+            The batch of start states for the new episodes.
+        """
+        for i, env in enumerate(self.envs):
+            env.reset()
+            if not self.step_scalar_envs:
+                self.copy_state_from_env(i)
+        self.curr_obs = self.get_reset_observations(self.env_indices)
+        return self.curr_obs
+
+    def step_async(self, actions):
+        self.actions = actions
+
+    def step_wait(self, **kwargs):
+        """Performs 1 transition for all environments in the batch with the actions passed to step().
+
+        Returns
+        -------
+        np.array, np.array, np.array, dict
+            The batch of next states, rewards, dones and an info dict at the end of the current transition.
+        """
+        actions = self.actions
+        if self.step_scalar_envs:
+            return self.step_envs(actions)
+
+        if self.state_space_type == "discrete":
+            rewards = self.step_discrete(actions)
+        elif self.state_space_type == "continuous":
+            rewards = self.step_continuous(actions)
+        elif self.state_space_type == "grid":
+            rewards = self.step_grid(actions)
+
+        rewards = self.apply_reward_scale_noise_and_shift(rewards)
+        dones = self.is_terminal_state() | self.reached_terminal
+        rewards[dones] += self.term_state_reward[dones] * self.reward_scale[dones]
+
+        self.curr_obs = self.get_observations(self.env_indices)
+        info = {}
+
+        # Auto-reset the environments that reached the end of an episode
+        if dones.any():
+            info["terminal_observation"] = self.curr_obs.copy()
+            done_indices = np.flatnonzero(dones)
+            for i in done_indices:
+                self.envs[i].reset()
+                self.copy_state_from_env(i)
+            self.curr_obs[done_indices] = self.get_reset_observations(done_indices)
+
+        return self.curr_obs, rewards, dones, info
+
+    def step_envs(self, actions):
+        """Steps the underlying environments one after the other with their own step(), which calls their custom transition and reward functions and event_hooks, and auto-resets them in the same way as step_wait().
+
+        Returns
+        -------
+        np.array, np.array, np.array, dict
+            The batch of next states, rewards, dones and an info dict at the end of the current transition.
+        """
+        rewards = np.zeros(self.num_envs)
+        dones = np.zeros(self.num_envs, dtype=bool)
+        next_obs = []
+        for i, env in enumerate(self.envs):
+            action = actions[i]
+            if self.state_space_type == "grid":  # RLToyEnv takes lists for grids
+                action = np.asarray(action).tolist()
+            next_ob, rewards[i], dones[i], _ = env.step(action)
+            next_obs.append(np.asarray(next_ob))
+        self.curr_obs = np.stack(next_obs)
+        info = {}
+
+        if dones.any():
+            info["terminal_observation"] = self.curr_obs.copy()
+            done_indices = np.flatnonzero(dones)
+            for i in done_indices:
+                self.envs[i].reset()
+            self.curr_obs[done_indices] = self.get_reset_observations(done_indices)
+
+        return self.curr_obs, rewards, dones, info
+
+    def push_to_augmented_states(self, next_states):
+        """Shifts the augmented states of all environments by 1 and appends next_states at the end."""
+        self.augmented_states[:, :-1] = self.augmented_states[:, 1:]
+        self.augmented_states[:, -1] = next_states
+        self.total_transitions_episode += 1
+
+    def get_noisy_next_state(self, env, next_state, space_num):
+        """Samples a noisy next state for a discrete environment in the same way as RLToyEnv.transition_function() does."""
+        return sample_noisy_discrete_state(
+            env.observation_spaces[space_num].np_random,
+            next_state,
+            env.state_space_size[space_num],
+            env.transition_noise,
+        )  # #random
+
+    def step_discrete(self, actions):
+        """Performs the transition for all discrete environments and returns the rewards before scaling, noise and shift are applied."""
+        actions = np.asarray(actions, dtype=np.int64)
+        if self.irrelevant_features:
+            actions, actions_irrelevant = actions[:, 0], actions[:, 1]
+
+        next_states = self.transition_tables[
+            self.env_indices, self.curr_states, actions
+        ]
+        for i, env in enumerate(self.envs):
+            if env.transition_noise:
+                next_states[i] = self.get_noisy_next_state(env, next_states[i], 0)
+
+        self.push_to_augmented_states(next_states)
+        rewards = self.discrete_rewards()
+
+        if self.irrelevant_features:
+            next_states_irrelevant = self.transition_tables_irrelevant[
+                self.env_indices, self.curr_states_irrelevant, actions_irrelevant
+            ]
+            for i, env in enumerate(self.envs):
+                if env.transition_noise:
+                    next_states_irrelevant[i] = self.get_noisy_next_state(
+                        env, next_states_irrelevant[i], 1
+                    )
+            self.curr_states_irrelevant = next_states_irrelevant
+
+        self.curr_states = next_states
+        return rewards
+
+    def discrete_rewards(self):
+        """Looks up the rewards for the rewardable sequences at the end of the augmented states of all discrete environments."""
+        rewards = np.zeros(self.num_envs)
+        # The check for padding is for the initial steps of an episode, see
+        # RLToyEnv.reward_function()
+        rewardable = self.augmented_states[:, 0] >= 0
+        for i, env in enumerate(self.envs):
+            if env.reward_every_n_steps:
+                rewardable[i] &= (
+                    self.total_transitions_episode[i] % self.sequence_length
+                    == self.delay
+                )
+        if not rewardable.any():
+            return rewards
+
+        indices = np.flatnonzero(rewardable)
+        sequences = self.augmented_states[
+            indices, 1: self.augmented_state_length - self.delay
+        ]
+        for ss_len in self.sequence_lengths:
+            # The partial sequences are matched against the last ss_len states
+            sub_sequences = sequences[:, self.sequence_length - ss_len:]
+            if self.use_sequence_codes:
+                sequence_codes = self.sequence_codes[ss_len]
+                if len(sequence_codes) == 0:
+                    continue
+                codes = indices.astype(np.int64)
+                for j in range(ss_len):
+                    codes = codes * self.sequence_code_base + sub_sequences[:, j]
+                pos = np.searchsorted(sequence_codes, codes)
+                pos[pos == len(sequence_codes)] = 0
+                matched = sequence_codes[pos] == codes
+                rewards[indices[matched]] += self.sequence_rewards[ss_len][
+                    pos[matched]
+                ]
+            else:
+                for i, sequence in zip(indices, sub_sequences):
+                    sequence = tuple(sequence)
+                    if sequence in self.envs[i].rewardable_sequences:
+                        rewards[i] += self.envs[i].rewardable_sequences[sequence]
+
+        return rewards
+
+    def step_continuous(self, actions):
+        """Integrates the dynamics for all continuous environments and returns the rewards before scaling, noise and shift are applied."""
+        actions = np.asarray(actions)
+        assert actions.shape == (self.num_envs, self.state_space_dim), (
+            "Actions should be specified as a tensor of shape (num_envs,"
+            " action_space_dim). However, shape of actions was: " + str(actions.shape)
+        )
+        valid_actions = np.all(
+            (actions >= self.action_space_low) & (actions <= self.action_space_high),
+            axis=1,
+        )
+        for i in np.flatnonzero(~valid_actions):
+            warnings.warn(
+                "WARNING: Action "
+                + str(actions[i])
+                + " out of range of action space. Applying 0 action!!"
+            )
+
+        if valid_actions.all():
+            self.state_derivatives[:, -1] = actions / self.inertia
+            self.state_derivatives[:] = integrate_dynamics(
+                self.dynamics_matrix, self.state_derivatives
+            )
+        elif valid_actions.any():
+            self.state_derivatives[valid_actions, -1] = (
+                actions[valid_actions] / self.inertia
+            )
+            self.state_derivatives[valid_actions] = integrate_dynamics(
+                self.dynamics_matrix, self.state_derivatives[valid_actions]
+            )
+
+        next_states = self.state_derivatives[:, 0]
+        noises = [
+            env.transition_noise(env.np_random) if env.transition_noise else 0
+            for env in self.envs
+        ]  # #random
+        noises = np.array(noises)
+        if noises.ndim == 1:
+            # Scalar noise is cast to the state dtype before it's added, as for a
+            # single state
+            noises = noises.astype(self.dtype)[:, np.newaxis]
+        next_states += noises
+
+        if self.image_representations:
+            # The ImageContinuous observation space never contains a feature
+            # space state, so this always clips in RLToyEnv
+            out_of_bounds = np.ones(self.num_envs, dtype=bool)
+        else:
+            out_of_bounds = ~np.all(
+                (next_states >= self.feature_space_low)
+                & (next_states <= self.feature_space_high),
+                axis=1,
+            )
+        if out_of_bounds.any():
+            clipped_states = np.clip(
+                next_states[out_of_bounds],
+                -self.state_space_max[out_of_bounds],
+                self.state_space_max[out_of_bounds],
+            ).astype(self.dtype)
+            # Resets all higher order derivatives to 0
+            self.state_derivatives[out_of_bounds, 1:] = 0
+            self.state_derivatives[out_of_bounds, 0] = clipped_states
+
+        next_states = self.state_derivatives[:, 0]
+        if self.reward_function == "move_to_a_point":
+            dists = np.linalg.norm(
+                next_states[:, self.relevant_indices] - self.target_point, axis=1
+            )
+            self.reached_terminal |= dists < self.target_radius
+
+        self.push_to_augmented_states(next_states)
+        return self.continuous_rewards(actions)
+
+    def continuous_rewards(self, actions):
+        """Computes the rewards for the move_along_a_line and move_to_a_point reward functions for all continuous environments."""
+        delay = self.delay
+        rewards = np.zeros(self.num_envs)
+        rewardable = ~np.isnan(self.augmented_states[:, 0, 0])
+        if not rewardable.any():
+            return rewards
+
+        states = self.augmented_states[rewardable][:, :, self.relevant_indices]
+        if self.reward_function == "move_along_a_line":
+            data_ = states[:, 1: self.augmented_state_length - delay]
+            data_mean = data_.mean(axis=1)
+            uu, dd, vv = np.linalg.svd(data_ - data_mean[:, np.newaxis])
+            line_end_pts = (
+                vv[:, 0][:, np.newaxis] * np.linspace(-1, 1, 2)[:, np.newaxis]
+            )
+            line_end_pts += data_mean[:, np.newaxis]
+            dists = dists_of_pts_from_lines(
+                data_, line_end_pts[:, 0], line_end_pts[:, -1]
+            )
+            # Summed point by point to have the same order of summation as in
+            # RLToyEnv
+            total_deviation = 0
+            for j in range(dists.shape[1]):
+                total_deviation = total_deviation + dists[:, j]
+            rewards[rewardable] += -total_deviation / self.sequence_length
+
+        elif self.reward_function == "move_to_a_point":
+            target_point = self.target_point[rewardable]
+            new_relevant_states = states[:, -1 - delay]
+            if self.make_denser:
+                old_relevant_states = states[:, -2 - delay]
+                rewards_ = -np.linalg.norm(new_relevant_states - target_point, axis=1)
+                rewards_ += np.linalg.norm(old_relevant_states - target_point, axis=1)
+                rewards_ = rewards_.astype(np.float64)
+            else:  # sparse reward
+                rewards_ = np.where(
+                    np.linalg.norm(new_relevant_states - target_point, axis=1)
+                    < self.target_radius[rewardable],
+                    1.0,
+                    0.0,
+                )
+            rewards_ -= self.action_loss_weight[rewardable] * np.linalg.norm(
+                np.array(actions, dtype=self.dtype)[rewardable], axis=1
+            ).astype(np.float64)
+            rewards[rewardable] = rewards_
+
+        return rewards
+
+    def step_grid(self, actions):
+        """Performs the transition for all grid environments and returns the rewards before scaling, noise and shift are applied."""
+        actions = np.asarray(actions)
+        assert actions.shape == self.curr_states.shape, (
+            "Actions should be specified as a tensor of shape (num_envs,"
+            " len(grid_shape)). However, shape of actions was: " + str(actions.shape)
+        )
+        if actions.dtype == np.int64:
+            valid_actions = np.all(np.isin(actions, (-1, 0, 1)), axis=1) & (
+                np.abs(actions).sum(axis=1) <= 1
+            )
+        else:
+            valid_actions = np.zeros(self.num_envs, dtype=bool)
+
+        actions = actions.astype(np.int64)
+        for i, env in enumerate(self.envs):
+            if not valid_actions[i]:
+                warnings.warn(
+                    "WARNING: Action " + str(actions[i]) + " out of range"
+                    " of action space. Applying noop action!!"
+                )
+            elif env.transition_noise:
+                if env.np_random.uniform() < env.transition_noise:  # #random
+                    action = [int(a) for a in actions[i]]
+                    while True:  # Be careful of infinite loops
+                        new_action = list(env.action_space.sample())  # #random
+                        if new_action != action:
+                            actions[i] = new_action
+                            break
+
+        actions[~valid_actions] = 0
+        next_states = np.clip(self.curr_states + actions, 0, self.grid_shape - 1)
+
+        if self.reward_function == "move_to_a_point":
+            if self.target_point.shape[1] == next_states.shape[1]:
+                self.reached_terminal |= np.all(next_states == self.target_point, axis=1)
+
+        self.push_to_augmented_states(next_states[:, :2])
+        self.curr_states = next_states
+
+        delay = self.delay
+        rewards = np.zeros(self.num_envs)
+        if self.reward_function == "move_to_a_point":
+            target_point = self.target_point[:, np.newaxis]
+            if self.make_denser:
+                manhat_dists = np.abs(
+                    self.augmented_states[:, [-2 - delay, -1 - delay]] - target_point
+                ).sum(axis=2)
+                # The old state is still padding in the 1st delay steps
+                rewardable = self.augmented_states[:, -2 - delay, 0] >= 0
+                rewards[rewardable] += (
+                    manhat_dists[rewardable, 0] - manhat_dists[rewardable, 1]
+                )
+            else:  # sparse reward
+                rewards += np.all(
+                    self.augmented_states[:, -1 - delay] == self.target_point, axis=1
+                )
+
+        return rewards
+
+    def apply_reward_scale_noise_and_shift(self, rewards):
+        """Applies the reward scale, reward noise and reward shift in the same order as RLToyEnv.reward_function()."""
+        rewards *= self.reward_scale
+        for i, env in enumerate(self.envs):
+            if env.reward_noise:
+                rewards[i] += env.reward_noise(env.np_random)  # #random
+        rewards += self.reward_shift
+        return rewards
+
+    def is_terminal_state(self):
+        """Returns whether the last states in the augmented states of the environments are terminal."""
+        if self.state_space_type == "discrete":
+            return self.terminal_tables[self.env_indices, self.augmented_states[:, -1]]
+
+        if self.callable_terminal_states:
+            dones = np.zeros(self.num_envs, dtype=bool)
+            for i, env in enumerate(self.envs):
+                if self.state_space_type == "continuous":
+                    dones[i] = env.is_terminal_state(self.augmented_states[i, -1])
+                else:
+                    dones[i] = env.is_terminal_state(
+                        [int(s) for s in self.augmented_states[i, -1]]
+                    )
+            return dones
+
+        if self.term_spaces_low is None:
+            return np.zeros(self.num_envs, dtype=bool)
+
+        states = self.augmented_states[:, -1]
+        if self.state_space_type == "continuous":
+            states = states[:, self.relevant_indices]
+        states = states[:, np.newaxis]
+        return np.any(
+            np.all(
+                (states >= self.term_spaces_low) & (states <= self.term_spaces_high),
+                axis=2,
+            ),
+            axis=1,
+        )
+
+    def get_observations(self, indices):
+        """Returns the (external) observations for the environments with the given indices."""
+        if self.state_space_type == "discrete":
+            if self.irrelevant_features:
+                states = np.stack(
+                    [self.curr_states[indices], self.curr_states_irrelevant[indices]],
+                    axis=1,
+                )
+            else:
+                states = self.curr_states[indices]
+        elif self.state_space_type == "continuous":
+            states = self.state_derivatives[indices, 0].copy()
+        elif self.state_space_type == "grid":
+            states = self.curr_states[indices].copy()
+
+        if self.image_representations:
+            if self.state_space_type == "discrete":
+                states = [
+                    list(state) if np.ndim(state) else int(state) for state in states
+                ]
+            return np.stack(
+                [
+                    self.envs[i].observation_space.get_concatenated_image(state)
+                    for i, state in zip(indices, states)
+                ]
+            )
+        return states
+
+    def get_reset_observations(self, indices):
+        """Returns the observations of the underlying environments with the given indices after they were reset. These are taken from the environments because image representations for discrete environments are randomly transformed and may not be generated a 2nd time."""
+        return np.stack([np.asarray(self.envs[i].curr_obs) for i in indices])
+
+    def close_extras(self, **kwargs):
+        for env in self.envs:
+            env.close()
+
+
+def dists_of_pts_from_lines(pts, ptsA, ptsB):
+    """Batched version of rl_toy_env.dist_of_pt_from_line(). Returns shortest distances of points of shape (B, n, dim) from B lines defined by 2 points each - ptsA and ptsB of shape (B, dim)."""
+
+    tolerance = 1e-13
+    linesAB = ptsA - ptsB
+    linesApt = ptsA[:, np.newaxis] - pts
+    dot_products = np.einsum("bd,bnd->bn", linesAB, linesApt)
+    norms_AB = np.linalg.norm(linesAB, axis=1)[:, np.newaxis]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        projs = dot_products / norms_AB
+        sq_dists = np.linalg.norm(linesApt, axis=2) ** 2 - projs ** 2
+    sq_dists[sq_dists < 0] = 0
+    dists = np.sqrt(sq_dists)
+    dists[np.broadcast_to(norms_AB < tolerance, dists.shape)] = 0
+    return dists
@@ -8,6 +8,35 @@ class BoxExtended(Box):
         super(BoxExtended, self).__init__(low, high, shape=shape, dtype=dtype)
         super(BoxExtended, self).seed(seed=seed)
 
+    def sample_batch(self, n):
+        """Samples n elements of the space in the same way as sample(), with a single call to the RNG if the space is bounded.
+
+        Returns
+        -------
+        np.ndarray
+            Array of shape (n,) + shape of the space
+        """
+        if not self.is_bounded():
+            return np.stack([self.sample() for i in range(n)])
+
+        high = self.high if self.dtype.kind == "f" else self.high.astype("int64") + 1
+        sampled = self.np_random.uniform(
+            low=self.low, high=high, size=(n,) + self.shape
+        )
+        if self.dtype.kind == "i":
+            sampled = np.floor(sampled)
+
+        return sampled.astype(self.dtype)
+
+    def contains_batch(self, x):
+        """Vectorised contains() for a batch of elements x, i.e., along the first dimension. Returns a boolean array with an entry for each element."""
+        x = np.asarray(x)
+        if x.shape[1:] != self.shape:
+            return np.zeros(x.shape[:1], dtype=bool)
+        return np.all(
+            (x >= self.low) & (x <= self.high), axis=tuple(range(1, x.ndim))
+        )
+
     # def sample(self, prob=None, size=1, replace=True):
     #     sampled = np.squeeze(self.np_random.choice(self.n, size=size, p=prob, replace=replace))
     #     if sampled.shape == ():
@@ -21,3 +21,22 @@ class DiscreteExtended(Discrete):
                 sampled
             )  # TODO Just made it an int otherwise np.array(scalar) looks ugly in output.
         return sampled
+
+    def sample_batch(self, n, max=None, prob=None):
+        """Samples n elements with a single call to the RNG. These are the same as the elements sampled by n calls to sample().
+
+        Returns
+        -------
+        np.ndarray
+            1-D array of n ints
+        """
+        if max is None:
+            max = self.n
+        return self.np_random.choice(max, size=n, p=prob)
+
+    def contains_batch(self, x):
+        """Vectorised contains() for a batch of elements x. Returns a boolean array with an entry for each element."""
+        x = np.asarray(x)
+        if x.dtype.kind not in "iu":
+            return np.zeros(x.shape, dtype=bool)
+        return (x >= 0) & (x < self.n)
@@ -21,19 +21,35 @@ class GridActionSpace(BoxExtended):
 
         return samp.astype(int)
 
+    def sample_batch(self, n):
+        """Samples n actions like sample(), with one call to the RNG each for the dimensions and values of all actions. The RNG is therefore consumed in a different order than by n calls to sample().
+
+        Returns
+        -------
+        np.ndarray
+            Array of shape (n,) + shape of the space
+        """
+        inds = self.np_random.randint(self.high.size, size=n)
+        vals = self.np_random.randint(3, size=n)
+        samp = np.zeros(shape=(n,) + self.high.shape, dtype=int)
+        samp[np.arange(n), inds] = vals - 1  # Shift into grid action range of [-1, 0, 1]
+
+        return samp
+
     def contains(self, x):
         x = np.array(x)
         if x.dtype.kind != "i":
             return False
 
-        a = x == 0
-        b = x == 1
-        c = x == -1
-        truth = a + b + c
-        if not np.all(truth):
-            return False
+        # All values in [-1, 0, 1] and at most 1 non-zero value
+        abs_x = np.abs(x)
+        return bool(np.all(abs_x <= 1) and np.sum(abs_x) <= 1)
 
-        if np.sum(np.abs(x)) != 0 and np.sum(np.abs(x)) != 1:
-            return False
+    def contains_batch(self, x):
+        """Vectorised contains() for a batch of actions x, i.e., along the first dimension. Returns a boolean array with an entry for each action."""
+        x = np.asarray(x)
+        if x.dtype.kind != "i":
+            return np.zeros(x.shape[:1], dtype=bool)
 
-        return True
+        abs_x = np.abs(x)
+        return np.all(abs_x <= 1, axis=1) & (np.sum(abs_x, axis=1) <= 1)
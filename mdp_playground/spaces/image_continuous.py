@@ -14,8 +14,10 @@ class ImageContinuous(Box):
 
     Methods
     -------
-    get_concatenated_image(continuous_obs)
-        Gets an image representation for a given feature space observation
+    get_concatenated_image(continuous_obs, out=None, channels_first=False)
+        Gets an image representation for a given feature space observation, optionally written into a preallocated array
+
+    Only the agent changes between observations. So, the static parts of the images (grid lines, terminal sub-spaces and the target point) are rendered once into a background array for the relevant and irrelevant sub-spaces each and an observation is generated by copying the background and stamping a pre-rendered sprite of the agent onto it.
     """
 
     def __init__(
@@ -106,12 +108,16 @@ class ImageContinuous(Box):
                 target_point += 0.5
             self.target_point_pixel = self.convert_to_pixel(target_point)
 
-    def generate_image(self, position, relevant=True):
-        """
-        Parameters
-        ----------
-        position : np.array
+        self.backgrounds = {}
+        self.agent_sprite = self.render_agent_sprite()
+
+    def render_background(self, relevant=True):
+        """Renders the static parts of the image for the relevant or irrelevant sub-space, i.e., everything except the agent.
 
+        Returns
+        -------
+        np.ndarray
+            Array of shape (width, height, 3)
         """
         # Use RGB
         image_ = Image.new("RGB", (self.width, self.height), color=self.bg_colour)
@@ -123,8 +129,6 @@ class ImageContinuous(Box):
         # Draw in decreasing order of importance:
         # grid lines, term_spaces, etc. first, so that others are drawn over them
         if self.draw_grid:
-            position = position.astype(float)
-            position += 0.5
             offset = 0 if relevant else 2
             for i in range(
                 1, self.grid_shape[0 + offset] + 1
@@ -171,38 +175,105 @@ class ImageContinuous(Box):
             twoPointList = [leftUpPoint, rightDownPoint]
             draw.ellipse(twoPointList, fill=self.goal_colour)
 
-        pos_pixel = self.convert_to_pixel(position)
-        # print("draw1", pos_pixel)
-        # Draw circle https://stackoverflow.com/a/2980931/11063709
-        leftUpPoint = tuple(pos_pixel - R)
-        rightDownPoint = tuple(pos_pixel + R)
-        twoPointList = [leftUpPoint, rightDownPoint]
-        draw.ellipse(twoPointList, fill=self.agent_colour)
-
         # Because numpy is row-major and Image is column major, need to transpose
         # ret_arr = np.array(image_).T # For 2-D
         ret_arr = np.transpose(np.array(image_), axes=(1, 0, 2))
 
         return ret_arr
 
-    def get_concatenated_image(self, obs):
+    def render_agent_sprite(self):
+        """Renders the circle for the agent once as a mask. The circle drawn by PIL for a bounding box with integer corners doesn't depend on its position, so stamping the mask is the same as drawing the circle.
+
+        Returns
+        -------
+        np.ndarray
+            Boolean array of shape (2 * circle_radius + 1, 2 * circle_radius + 1)
+        """
+        R = self.circle_radius
+        image_ = Image.new("L", (2 * R + 1, 2 * R + 1))
+        draw = ImageDraw.Draw(image_)
+        # Draw circle https://stackoverflow.com/a/2980931/11063709
+        draw.ellipse([(0, 0), (2 * R, 2 * R)], fill=255)
+
+        return np.array(image_).T > 0
+
+    def generate_image(self, position, relevant=True, out=None):
+        """
+        Parameters
+        ----------
+        position : np.array
+
+        relevant : boolean
+            Whether position is in the relevant or irrelevant sub-space
+        out : np.ndarray
+            Array of shape (width, height, 3) to write the image into. If None, a new one is allocated.
+        """
+        if relevant not in self.backgrounds:
+            self.backgrounds[relevant] = self.render_background(relevant)
+        if out is None:
+            out = np.empty((self.width, self.height, 3), dtype=np.uint8)
+        out[...] = self.backgrounds[relevant]
+
+        if self.draw_grid:
+            position = position.astype(float)
+            position += 0.5
+        pos_pixel = self.convert_to_pixel(position)
+        # print("draw1", pos_pixel)
+        # Stamp the agent's circle, clipped to the image
+        R = self.circle_radius
+        x_start, y_start = pos_pixel - R
+        x_end, y_end = pos_pixel + R + 1
+        sprite = self.agent_sprite[
+            max(0, -x_start): max(0, self.width - x_start),
+            max(0, -y_start): max(0, self.height - y_start),
+        ]
+        out[
+            max(0, x_start): max(0, min(x_end, self.width)),
+            max(0, y_start): max(0, min(y_end, self.height)),
+        ][sprite] = self.agent_colour
+
+        return out
+
+    def get_concatenated_image(self, obs, out=None, channels_first=False):
         """Gets the "stitched together" image made from images corresponding to
         each continuous sub-space within the continuous space, concatenated
-        along the X-axis.
+        along the X-axis. The images for the relevant and irrelevant sub-spaces
+        are written directly into their slices of the output array.
+
+        Parameters
+        ----------
+        obs : np.array
+            The feature space observation
+        out : np.ndarray or None
+            A uint8 array to write the image into, of shape (width * number of sub-spaces, height, 3) or, if channels_first, (3, width * number of sub-spaces, height). Passing the same array on every call avoids allocating new frames. If None, a new array is allocated.
+        channels_first : boolean
+            Whether to return the image with the channels as the first instead of the last dimension. Default: False.
+
+        Returns
+        -------
+        np.ndarray
+            The image, i.e., out if it was given
         """
-        concatenated_image = []
         # For relevant/irrelevant sub-spaces:
-        concatenated_image.append(self.generate_image(obs[self.relevant_indices]))
+        num_images = 2 if self.irrelevant_features else 1
+        if out is None:
+            if channels_first:
+                shape = (3, num_images * self.width, self.height)
+            else:
+                shape = (num_images * self.width, self.height, 3)
+            out = np.empty(shape, dtype=np.uint8)
+        # An image is always >=3 dims because Ray expects that
+        out_ = np.moveaxis(out, 0, -1) if channels_first else out
+
+        self.generate_image(obs[self.relevant_indices], out=out_[: self.width])
         if self.irrelevant_features:
-            irr_image = self.generate_image(
-                obs[self.irrelevant_indices], relevant=False
+            self.generate_image(
+                obs[self.irrelevant_indices],
+                relevant=False,
+                out=out_[self.width:],
             )
-            concatenated_image.append(irr_image)
-
-        concatenated_image = np.concatenate(tuple(concatenated_image), axis=0)
 
-        return np.atleast_3d(concatenated_image)  # because Ray expects an
-        # image to have >=3 dims
+        return out
 
     def convert_to_pixel(self, position):
         """ """
@@ -220,6 +291,28 @@ class ImageContinuous(Box):
         sampled = self.feature_space.sample()
         return self.get_concatenated_image(sampled)
 
+    def sample_batch(self, n):
+        """Samples n observations from the feature space, with a single call to the RNG if it's a BoxExtended, and renders their images into one array.
+
+        Returns
+        -------
+        np.ndarray
+            Array of shape (n,) + shape of a concatenated image
+        """
+        if hasattr(self.feature_space, "sample_batch"):  # BoxExtended
+            sampled = self.feature_space.sample_batch(n)
+        else:
+            sampled = [self.feature_space.sample() for i in range(n)]
+
+        num_images = 2 if self.irrelevant_features else 1
+        images = np.empty(
+            (n, num_images * self.width, self.height, 3), dtype=np.uint8
+        )
+        for i in range(n):
+            self.get_concatenated_image(sampled[i], out=images[i])
+
+        return images
+
     def __repr__(self):
         return (
             "{} with continuous underlying space of shape: {} and "
@@ -240,6 +333,12 @@ class ImageContinuous(Box):
         ):  # TODO compare each pixel for all possible images?
             return True
 
+    def contains_batch(self, x):
+        """contains() for a batch of images x, i.e., along the first dimension, which may also be a list of images of different shapes. Returns a boolean array with an entry for each image."""
+        return np.array(
+            [bool(self.contains(np.asarray(image))) for image in x], dtype=bool
+        )
+
     def to_jsonable(self, sample_n):
         """Convert a batch of samples from this space to a JSONable data type."""
         # By default, assume identity is JSONable
@@ -1,4 +1,5 @@
 import warnings
+from collections import OrderedDict
 import numpy as np
 import gym
 from gym.spaces import Box, Discrete, MultiDiscrete, Space
@@ -8,13 +9,145 @@ from PIL.Image import FLIP_LEFT_RIGHT, FLIP_TOP_BOTTOM
 import os
 
 
+def rasterize_polygons(
+    polygon_sides, centres, radii, rotations, flips, width, height, out=None
+):
+    """Rasterizes a batch of regular polygons with NumPy by intersecting the half-planes of the polygons' edges. The polygons are traced in the same way as in ImageMultiDiscrete.render_image(), i.e., with integer vertices, and the rotations and flips are applied to the vertices instead of to the rendered image. The results therefore match the images rendered with PIL except possibly for pixels on the edges of polygons.
+
+    Parameters
+    ----------
+    polygon_sides : np.ndarray
+        1-D array of ints with the number of sides of each polygon
+    centres : np.ndarray
+        Array of shape (N, 2) with the (x, y) centres of the polygons
+    radii : np.ndarray
+        1-D array with the circumradii of the polygons
+    rotations : np.ndarray
+        1-D array with the counter-clockwise rotations of the polygons in degrees around the centre of the image
+    flips : np.ndarray
+        1-D array of ints: 0 for no flip, 1 to flip left-right and 2 to flip top-bottom (after rotating)
+    width : int
+    height : int
+    out : np.ndarray or None
+        A uint8 array of shape (N, width, height) to render into. If None, a new one is allocated.
+
+    Returns
+    -------
+    np.ndarray
+        The uint8 array of shape (N, width, height) with the polygons filled with 255 on a background of 0
+    """
+    polygon_sides = np.asarray(polygon_sides)
+    num_polygons = len(polygon_sides)
+    max_sides = int(polygon_sides.max()) if num_polygons > 0 else 0
+
+    # Trace the polygons. Vertices beyond the number of sides of a polygon are
+    # set to its first vertex, so that they only add empty edges.
+    vertex_nums = np.arange(max_sides)
+    vertex_nums = np.where(vertex_nums < polygon_sides[:, None], vertex_nums, 0)
+    angles = (2 * np.pi / polygon_sides[:, None]) * vertex_nums
+    radii = np.asarray(radii, dtype=np.float64)[:, None]
+    centres = np.asarray(centres, dtype=np.float64)
+    vertices = np.stack(
+        (
+            np.trunc(centres[:, 0:1] + radii * np.cos(angles)),
+            np.trunc(centres[:, 1:2] + radii * np.sin(angles)),
+        ),
+        axis=2,
+    )  # Same as int() in render_image()
+
+    # Rotate around the centre of the image; y points downwards in images, so
+    # a counter-clockwise rotation on screen is clockwise in (x, y).
+    image_centre = np.array([(width - 1) / 2, (height - 1) / 2])
+    theta = np.deg2rad(np.asarray(rotations, dtype=np.float64))[:, None]
+    cos_, sin_ = np.cos(theta), np.sin(theta)
+    dx = vertices[..., 0] - image_centre[0]
+    dy = vertices[..., 1] - image_centre[1]
+    vertices = np.stack(
+        (
+            image_centre[0] + dx * cos_ + dy * sin_,
+            image_centre[1] - dx * sin_ + dy * cos_,
+        ),
+        axis=2,
+    )
+    flips = np.asarray(flips)
+    vertices[flips == 1, :, 0] = width - 1 - vertices[flips == 1, :, 0]
+    vertices[flips == 2, :, 1] = height - 1 - vertices[flips == 2, :, 1]
+
+    # A pixel is inside a convex polygon if it's on the inner side of all its
+    # edges. Flips reverse the orientation of the polygons, so the inner side
+    # is given by the sign of their areas. Since the polygons are convex, the
+    # pixels inside are an interval [lower, upper] of y for each x, which is
+    # computed from the half-planes before filling the image. Pixels within
+    # half a pixel (along the minor axis of an edge) of the edges are drawn
+    # like by PIL's ImageDraw.polygon().
+    edges = np.roll(vertices, -1, axis=1) - vertices
+    orientation = np.sign(
+        np.sum(
+            vertices[..., 0] * edges[..., 1] - vertices[..., 1] * edges[..., 0],
+            axis=1,
+        )
+    )[:, None]
+    xs = np.arange(width, dtype=np.float64)[None, :]
+    lower = np.full((num_polygons, width), -np.inf)
+    upper = np.full((num_polygons, width), np.inf)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for i in range(max_sides):
+            edge_x = orientation * edges[:, i, 0:1]
+            edge_y = orientation * edges[:, i, 1:2]
+            # edge_x * y - edge_y * x + offset >= 0 on the inner side of edge i
+            offset = (
+                edge_y * vertices[:, i, 0:1]
+                - edge_x * vertices[:, i, 1:2]
+                + 0.49 * np.maximum(np.abs(edge_x), np.abs(edge_y))  # #hardcoded
+            )
+            bound = (edge_y * xs - offset) / edge_x
+            lower = np.where(edge_x > 0, np.maximum(lower, bound), lower)
+            upper = np.where(edge_x < 0, np.minimum(upper, bound), upper)
+            # Vertical edges restrict x instead of y
+            outside = (edge_x == 0) & (offset - edge_y * xs < 0)
+            upper[outside] = -np.inf
+    upper[orientation[:, 0] == 0] = -np.inf  # Degenerate polygons
+
+    ys = np.arange(height, dtype=np.float64)[None, None, :]
+    inside = (ys >= lower[:, :, None]) & (ys <= upper[:, :, None])
+
+    if out is None:
+        out = np.empty((num_polygons, width, height), dtype=np.uint8)
+    np.multiply(inside, 255, out=out, casting="unsafe")
+
+    return out
+
+
+def unpack_image(packed_image, height, axis=-2):
+    """Unpacks (a batch of) bit-packed images generated by ImageMultiDiscrete with bit_packed=True into uint8 images with pixels that are 0 or 255.
+
+    Parameters
+    ----------
+    packed_image : np.ndarray
+        The bit-packed image(s)
+    height : int
+        The height of the unpacked images, i.e., the number of bits along axis that are used
+    axis : int
+        The axis along which the images were packed, i.e., the height axis: -2 for channel-last and -1 for channel-first images. Default: -2.
+
+    Returns
+    -------
+    np.ndarray
+    """
+    return np.unpackbits(packed_image, axis=axis, count=height) * np.uint8(255)
+
+
 class ImageMultiDiscrete(Box):
     """A space that maps a (multi-)discrete space 1-to-1 to images so that the images may be used as representations for corresponding (multi-)discrete states. A MultiDiscrete space will have multiple dimensions. For each of these dimensions, there is a size that represents the number of categorical states that correspond to that dimension. For size = n, each of these categorical states is numbered from 0 to n-1. For each categorical state numbered n, we associate a polygon with n + 3 sides. This polygon is present in the image associated with this dimension. The images generated for all the dimensions are concatenated together by placing them side by side in the order of the dimensions in Space. Any of the transforms - rotate, flip, scale, shift - can be associated with an object of this class, to apply at random to polygons in the images whenever they are generated.
 
     Methods
     -------
-    get_concatenated_image(multi_discrete_state)
-        Gets an image representation for a given multi_discrete_state
+    get_concatenated_image(multi_discrete_state, out=None, channels_first=False)
+        Gets an image representation for a given multi_discrete_state, optionally written into a preallocated array
+    get_concatenated_images(multi_discrete_states)
+        Gets image representations for a batch of multi_discrete_states, rendered with NumPy
+
+    The transforms applied to the polygons are quantised (shifts, rotations and radii are ints and flips are discrete), so the image for a discrete state is fully determined by the sampled transform parameters. Rendered images are therefore cached in an LRU cache keyed by the discrete state and these parameters, so that every (state, transform) pair is only rendered once with PIL as long as the cache is large enough. The RNG is consumed in the same way whether an image is cached or not.
     """
 
     def __init__(
@@ -31,6 +164,8 @@ class ImageMultiDiscrete(Box):
         use_custom_images=None,
         cust_path=None,
         dtype=np.uint8,
+        image_cache_size=None,
+        bit_packed=False,
     ):  # , polygon_sides=4
         """
         Parameters
@@ -57,6 +192,10 @@ class ImageMultiDiscrete(Box):
             If None, then default setting of no custom textures or images. If this value is "textures" or "images", then all images in the cust_path directories are loaded in alphabetical order and correspond 1-to-1 with discrete states which are in numeric order. If this value is "textures", the textures are applied to the polygons that would have been generated for the default setting (of no custom textures or images). If this value is "images", then the custom images are drawn in a square (with side length = circle_radius * sqrt(2)) in the centre of the polygon when no transforms are applied. When the underlying state space sizes are multi-discrete, the 1-to-1 state number to image mapping is the same for all discrete sub-spaces.
         cust_path : str or None
             The directory containing the custom images to be loaded
+        image_cache_size : int
+            The memory budget in bytes for the LRU cache of rendered images. The least recently used images are evicted when it's exceeded. Set to 0 to disable the cache. If None, the images are only cached if the images for all possible (state, transform) pairs fit into 4 MiB, with a budget of exactly their size, e.g., for no transforms or coarsely quantised ones. Otherwise, e.g., for fine-grained shifts and rotations, the hit rate would be low and the cache is disabled. Default: None.
+        bit_packed : boolean
+            If true, the images, which only contain pixels that are 0 or 255 for the default of no custom images or textures, are bit-packed along the height axis with np.packbits. This makes them 8 times smaller, e.g., in replay buffers. The shape of this space is then (width * number of discrete sub-spaces, ceil(height / 8), 1) and unpack_image() restores the images. Default: False.
         """
         self.width = width
         self.height = height
@@ -70,6 +209,16 @@ class ImageMultiDiscrete(Box):
         # self.state_space = state_space
         self.use_custom_images = use_custom_images
 
+        self.image_cache_size = image_cache_size
+        self.image_cache = OrderedDict()
+        self.image_cache_nbytes = 0
+
+        self.bit_packed = bit_packed
+        if bit_packed:
+            assert (
+                use_custom_images is None
+            ), "Bit-packed images are only supported without custom images or textures."
+
         # if isinstance(state_space, Discrete):
         #     state_space_sizes = [state_space.n] # can be an int to map images to discrete spaces or it can be a list to map images (each image = multiple images, one for each discrete dimension, concatenated along the X-axis) to multi-discrete spaces
         # elif isinstance(state_space, MultiDiscrete):
@@ -80,30 +229,34 @@ class ImageMultiDiscrete(Box):
         self.state_space_sizes = state_space_sizes
 
         if use_custom_images is not None:  # TODO test for textures, custom images
-            cust_imgs = []
-            # cust_arrs = []
-            for img_file in sorted(os.listdir(cust_path)):
-                img_ = Image.open(cust_path + "/" + img_file)
-                cust_imgs.append(img_)
-                # The following code might be used to resize the texture to a canonical size here already or to tile the texture.
-                # sq_width = circle_radius * 2 # np.sqrt(2)
-                # self.sq_width = sq_width
-                # img_ = img_.resize((sq_width, sq_width))
-                # cust_imgs.append(img_)
-                # img_arr = np.array(img_)
-                # cust_arrs.append(img_arr)
-            assert len(cust_imgs) > max(
+            # The images are only loaded when they are first needed in
+            # get_custom_image_array()
+            self.cust_path = cust_path
+            self.cust_img_files = sorted(os.listdir(cust_path))
+            self.cust_imgs = {}
+            self.cust_arrs = {}
+            assert len(self.cust_img_files) > max(
                 state_space_sizes
             ), "cust_path should be a directory with at least as many as the larget Discrete sub-space in the MultiDiscrete space."
             # "The cust_path should be a directory with only texture images, at least as many as the larget Discrete sub-space in the MultiDiscrete space."
-            self.cust_imgs = cust_imgs
 
         # self.shape = (width, height, 1)
+        if bit_packed:
+            self.unpacked_shape = (len(state_space_sizes) * width, height, 1)
+            self.unpacked_image = np.empty(self.unpacked_shape, dtype=np.uint8)
+            shape = (len(state_space_sizes) * width, (height + 7) // 8, 1)
+        else:
+            shape = (width, height, 1)
         super(ImageMultiDiscrete, self).__init__(
-            shape=(width, height, 1), dtype=dtype, low=0, high=255
+            shape=shape, dtype=dtype, low=0, high=255
         )  #
         super(ImageMultiDiscrete, self).seed(seed=seed)  #
 
+        if image_cache_size is None:
+            image_bytes = width * height * (1 if use_custom_images is None else 3)
+            cache_bytes = self.get_num_image_variants() * image_bytes
+            self.image_cache_size = cache_bytes if cache_bytes <= 2 ** 22 else 0  # #hardcoded
+
     # def seed(self, seed=None):
     #     pass
 
@@ -115,24 +268,61 @@ class ImageMultiDiscrete(Box):
     #     return states_
 
     def generate_image(self, discrete_state):  # , state_space_size, polygon_sides
-        polygon_sides = discrete_state + 3
+        """Generates the image for discrete_state with the transforms sampled at random. Returns a cached image if the same state and transform parameters were rendered before. The returned array is read-only."""
+        image_key = self.sample_transforms(discrete_state)
+        if self.image_cache_size <= 0:
+            return self.render_image(*image_key)
+
+        if image_key in self.image_cache:
+            self.image_cache.move_to_end(image_key)
+            return self.image_cache[image_key]
+
+        ret_arr = self.render_image(*image_key)
+        ret_arr.setflags(write=False)
+        self.image_cache[image_key] = ret_arr
+        self.image_cache_nbytes += ret_arr.nbytes
+        while self.image_cache_nbytes > self.image_cache_size:
+            _, evicted_arr = self.image_cache.popitem(last=False)
+            self.image_cache_nbytes -= evicted_arr.nbytes
+
+        return ret_arr
+
+    def get_num_image_variants(self):
+        """Returns an upper bound for the number of distinct images, i.e., of (state, transform) pairs, that sample_transforms() can produce."""
+        num_variants = max(self.state_space_sizes)
+        min_R = self.circle_radius
+        if "scale" in self.transforms:
+            min_R = int(self.scale_range[0] * self.circle_radius)
+            max_R = int(self.scale_range[1] * self.circle_radius)
+            num_variants *= max(max_R - min_R + 1, 1)
+        if "shift" in self.transforms:
+            for size in [self.width, self.height]:
+                max_shift = max(size / 2 - min_R, 1)
+                num_variants *= int(np.ceil(2 * max_shift / self.sh_quant)) + 1
+        if "rotate" in self.transforms:
+            num_variants *= int(np.ceil(360 / self.ro_quant))
+        if "flip" in self.transforms:
+            num_variants *= 3
+
+        return num_variants
+
+    def sample_transforms(self, discrete_state):
+        """Samples the parameters of the transforms for the polygon for discrete_state. This is the only part of generating an image that consumes the RNG.
+
+        Returns
+        -------
+        tuple
+            (discrete_state, R, shift_w, shift_h, rotation, flip) with rotation and flip None if they are not applied and flip either FLIP_LEFT_RIGHT or FLIP_TOP_BOTTOM otherwise
+        """
         sh_quant = self.sh_quant
         ro_quant = self.ro_quant
         scale_range = self.scale_range
 
-        if self.use_custom_images is not None:  # textures / custom images
-            image_ = Image.new(
-                "RGB", (self.width, self.height)
-            )  # Use RGB for textures / custom images
-        else:
-            image_ = Image.new(
-                "L", (self.width, self.height)
-            )  # Use L for black and white 8-bit pixels instead of RGB in case not using custom images
-        draw = ImageDraw.Draw(image_)
-
         R = self.circle_radius
         shift_w = int(self.width / 2)
         shift_h = int(self.height / 2)
+        rotation = None
+        flip = None
 
         if "scale" in self.transforms:
             # max_R = 0.6 * min(self.width, self.height) / 2 # Not sure whether to make this depend on provided R as well
@@ -168,6 +358,37 @@ class ImageMultiDiscrete(Box):
             shift_w += add_shift_w
             shift_h += add_shift_h
 
+        if (
+            "rotate" in self.transforms
+        ):  # TODO rotation can lead to image going out of bounds.
+            # rotation_ = (360 / polygon_sides) * (discrete_state / state_space_size) # Need to divide by polygon_sides because
+            rotation = self.np_random.randint(360)
+            rotation = (rotation // ro_quant) * ro_quant
+            # print("rotation", rotation)
+
+        if "flip" in self.transforms:
+            if self.np_random.randint(2) == 0:  # Only flip half the times
+                if self.np_random.randint(2) == 0:
+                    flip = FLIP_LEFT_RIGHT
+                else:
+                    flip = FLIP_TOP_BOTTOM
+
+        return (int(discrete_state), R, shift_w, shift_h, rotation, flip)
+
+    def render_image(self, discrete_state, R, shift_w, shift_h, rotation, flip):
+        """Renders the image for discrete_state with the given transform parameters from sample_transforms()."""
+        polygon_sides = discrete_state + 3
+
+        if self.use_custom_images is not None:  # textures / custom images
+            image_ = Image.new(
+                "RGB", (self.width, self.height)
+            )  # Use RGB for textures / custom images
+        else:
+            image_ = Image.new(
+                "L", (self.width, self.height)
+            )  # Use L for black and white 8-bit pixels instead of RGB in case not using custom images
+        draw = ImageDraw.Draw(image_)
+
         if self.use_custom_images == "images":
             pass
         else:
@@ -185,9 +406,7 @@ class ImageMultiDiscrete(Box):
         if self.use_custom_images == "textures":
             draw.polygon(points_, fill=(255, 255, 255))
             img_arr_ = np.array(image_)
-            tex_img = self.cust_imgs[discrete_state]
-            tex_img = tex_img.resize((R * 2, R * 2))
-            tex_arr = np.array(tex_img)
+            tex_arr = self.get_custom_image_array(discrete_state, R * 2)
             top_left = (
                 shift_h - tex_arr.shape[0] // 2,
                 shift_w - tex_arr.shape[1] // 2,
@@ -205,7 +424,6 @@ class ImageMultiDiscrete(Box):
             image_ = Image.fromarray(img_arr_, "RGB")
         elif self.use_custom_images == "images":
             img_arr_ = np.array(image_)
-            tex_img = self.cust_imgs[discrete_state]
             sq_width = int(
                 R * np.sqrt(2)
             )  # For textures it is not square root because polygons like a pentagon would go outside the sqrt(2) region.
@@ -213,8 +431,7 @@ class ImageMultiDiscrete(Box):
                 sq_width % 2 == 1
             ):  # If sq_width is not even, it causes errors with the //2 below.
                 sq_width += 1
-            tex_img = tex_img.resize((sq_width, sq_width))
-            tex_arr = np.array(tex_img)
+            tex_arr = self.get_custom_image_array(discrete_state, sq_width)
             top_left = (
                 shift_h - tex_arr.shape[0] // 2,
                 shift_w - tex_arr.shape[1] // 2,
@@ -230,22 +447,12 @@ class ImageMultiDiscrete(Box):
         else:
             draw.polygon(points_, fill=(255))
 
-        if (
-            "rotate" in self.transforms
-        ):  # TODO rotation can lead to image going out of bounds.
-            # rotation_ = (360 / polygon_sides) * (discrete_state / state_space_size) # Need to divide by polygon_sides because
-            rotation = self.np_random.randint(360)
-            rotation = (rotation // ro_quant) * ro_quant
-            # print("rotation", rotation)
+        if rotation is not None:
             image_ = image_.rotate(rotation)
             # image_.rotate(
 
-        if "flip" in self.transforms:
-            if self.np_random.randint(2) == 0:  # Only flip half the times
-                if self.np_random.randint(2) == 0:
-                    image_ = image_.transpose(FLIP_LEFT_RIGHT)
-                else:
-                    image_ = image_.transpose(FLIP_TOP_BOTTOM)
+        if flip is not None:
+            image_ = image_.transpose(flip)
 
         # Because numpy is row-major and Image is column major, need to transpose
         if self.use_custom_images is None:
@@ -255,23 +462,127 @@ class ImageMultiDiscrete(Box):
 
         return ret_arr
 
+    def get_custom_image_array(self, discrete_state, size):
+        """Returns the custom image or texture for discrete_state resized to (size, size) as a read-only array. The images are loaded from cust_path when they are first needed and the resized arrays are cached by (discrete_state, size). Since the size only depends on the radius of the polygon, which takes finitely many values for the scale transform, each image is only resized a few times."""
+        key = (discrete_state, size)
+        if key not in self.cust_arrs:
+            if discrete_state not in self.cust_imgs:
+                self.cust_imgs[discrete_state] = Image.open(
+                    self.cust_path + "/" + self.cust_img_files[discrete_state]
+                )
+            tex_arr = np.array(self.cust_imgs[discrete_state].resize((size, size)))
+            tex_arr.setflags(write=False)
+            self.cust_arrs[key] = tex_arr
+
+        return self.cust_arrs[key]
+
     def get_concatenated_image(
         self,
         multi_discrete_state,
+        out=None,
+        channels_first=False,
     ):
-        """Gets the "stitched together" image made from images corresponding to each discrete sub-space within the multidiscrete space, concatenated along the X-axis"""
+        """Gets the "stitched together" image made from images corresponding to each discrete sub-space within the multidiscrete space, concatenated along the X-axis. The image for each sub-space is written directly into its slice of the output array.
+
+        Parameters
+        ----------
+        multi_discrete_state : int or list
+            The state in each discrete sub-space
+        out : np.ndarray or None
+            A uint8 array to write the image into, of shape (width * number of discrete sub-spaces, height, channels) or, if channels_first, (channels, width * number of discrete sub-spaces, height), where channels is 1 for the default of no custom images or textures and 3 otherwise. If bit_packed, height is replaced by ceil(height / 8). Passing the same array on every call avoids allocating new frames. If None, a new array is allocated.
+        channels_first : boolean
+            Whether to return the image with the channels as the first instead of the last dimension. Default: False.
+
+        Returns
+        -------
+        np.ndarray
+            The image, i.e., out if it was given
+        """
         if isinstance(multi_discrete_state, int):
             multi_discrete_state = [multi_discrete_state]
-        concatenated_image = []
-        for i in range(len(self.state_space_sizes)):  # For each Discrete sub-space
-            concatenated_image.append(self.generate_image(multi_discrete_state[i]))
+        num_sub_spaces = len(self.state_space_sizes)
+        if out is None:
+            num_channels = 1 if self.use_custom_images is None else 3
+            height = self.shape[1] if self.bit_packed else self.height
+            if channels_first:
+                shape = (num_channels, num_sub_spaces * self.width, height)
+            else:
+                shape = (num_sub_spaces * self.width, height, num_channels)
+            out = np.empty(shape, dtype=np.uint8)
+        # An image is always >=3 dims because Ray expects that
+        out_ = np.moveaxis(out, 0, -1) if channels_first else out
+        concatenated_image = self.unpacked_image if self.bit_packed else out_
+
+        for i in range(num_sub_spaces):  # For each Discrete sub-space
+            image_ = self.generate_image(multi_discrete_state[i])
+            concatenated_image[
+                i * self.width: (i + 1) * self.width
+            ] = image_.reshape(self.width, self.height, -1)
         # for i in range(len(self.disjoint_states)):
         #     concatenated_image.append(self.disjoint_states[i][multi_discrete_state[i]])
-        concatenated_image = np.concatenate(tuple(concatenated_image), axis=0)
 
-        return np.atleast_3d(
-            concatenated_image
-        )  # because Ray expects an image to have >=3 dims
+        if self.bit_packed:
+            out_[...] = np.packbits(concatenated_image > 0, axis=1)
+
+        return out
+
+    def get_concatenated_images(self, multi_discrete_states):
+        """Gets the concatenated images for a batch of multi-discrete states in one go. The transforms are sampled in the same order as for calling get_concatenated_image() on each state in turn, but all polygons are rasterized together with rasterize_polygons(), which is much faster than rendering each of them with PIL. Images for custom images or textures are still rendered one by one with PIL.
+
+        Parameters
+        ----------
+        multi_discrete_states : array_like
+            Array of shape (B, number of discrete sub-spaces) or, for a single sub-space, of shape (B,)
+
+        Returns
+        -------
+        np.ndarray
+            Array of shape (B, width * number of discrete sub-spaces, height, 1) for the default of no custom images or textures. If bit_packed, height is replaced by ceil(height / 8).
+        """
+        multi_discrete_states = np.asarray(multi_discrete_states)
+        if multi_discrete_states.ndim == 1:
+            multi_discrete_states = multi_discrete_states[:, None]
+        batch_size = multi_discrete_states.shape[0]
+        num_sub_spaces = len(self.state_space_sizes)
+
+        if self.use_custom_images is not None:
+            return np.stack(
+                [
+                    self.get_concatenated_image(list(multi_discrete_state))
+                    for multi_discrete_state in multi_discrete_states
+                ]
+            )
+
+        image_keys = [
+            self.sample_transforms(multi_discrete_states[b, i])
+            for b in range(batch_size)
+            for i in range(num_sub_spaces)
+        ]
+        discrete_states, radii, shifts_w, shifts_h, rotations, flips = zip(
+            *image_keys
+        )
+        flip_nums = {None: 0, FLIP_LEFT_RIGHT: 1, FLIP_TOP_BOTTOM: 2}
+
+        out = np.empty(
+            (batch_size * num_sub_spaces, self.width, self.height), dtype=np.uint8
+        )
+        rasterize_polygons(
+            np.array(discrete_states) + 3,
+            np.stack((shifts_w, shifts_h), axis=1),
+            radii,
+            [0 if rotation is None else rotation for rotation in rotations],
+            [flip_nums[flip] for flip in flips],
+            self.width,
+            self.height,
+            out=out,
+        )
+
+        # Concatenate the images of the sub-spaces along the X-axis
+        out = out.reshape(batch_size, num_sub_spaces * self.width, self.height, 1)
+        if self.bit_packed:
+            out = np.packbits(out > 0, axis=2)
+
+        return out
 
     # def get_multi_discrete_state(self,
 
@@ -286,6 +597,21 @@ class ImageMultiDiscrete(Box):
 
         return self.get_concatenated_image(sampled)
 
+    def sample_batch(self, n):
+        """Samples n multi-discrete states with a single call to the RNG and returns their images rendered in a batch by get_concatenated_images(). (For the default of no custom images or textures, these images are rendered with NumPy and may therefore differ from those rendered by sample() in the pixels on the edges of polygons.)
+
+        Returns
+        -------
+        np.ndarray
+            Array of shape (n,) + shape of a concatenated image
+        """
+        sss = np.array(self.state_space_sizes)
+        sampled = (self.np_random.random_sample((n,) + sss.shape) * sss).astype(
+            self.dtype
+        )  # Based on Gym's MultiDiscrete sampling
+
+        return self.get_concatenated_images(sampled)
+
     def __repr__(self):
         return (
             "{} with multi-discrete space of shape: {} and "
@@ -299,6 +625,8 @@ class ImageMultiDiscrete(Box):
         Return boolean specifying if x is a valid
         member of this space
         """
+        if self.bit_packed:
+            return x.shape == self.shape
         if x.shape == (
             self.width,
             self.height,
@@ -306,6 +634,12 @@ class ImageMultiDiscrete(Box):
         ):  # TODO compare each pixel for all possible images?
             return True
 
+    def contains_batch(self, x):
+        """contains() for a batch of images x, i.e., along the first dimension, which may also be a list of images of different shapes. Returns a boolean array with an entry for each image."""
+        return np.array(
+            [bool(self.contains(np.asarray(image))) for image in x], dtype=bool
+        )
+
     def to_jsonable(self, sample_n):
         """Convert a batch of samples from this space to a JSONable data type."""
         # By default, assume identity is JSONable
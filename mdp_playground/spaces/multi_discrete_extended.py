@@ -12,6 +12,25 @@ class MultiDiscreteExtended(MultiDiscrete):
         super(MultiDiscreteExtended, self).__init__(nvec)
         super(MultiDiscreteExtended, self).seed(seed=seed)
 
+    def sample_batch(self, n):
+        """Samples n elements with a single call to the RNG. These are the same as the elements sampled by n calls to sample().
+
+        Returns
+        -------
+        np.ndarray
+            Array of shape (n,) + shape of nvec
+        """
+        return (
+            self.np_random.random_sample((n,) + self.nvec.shape) * self.nvec
+        ).astype(self.dtype)
+
+    def contains_batch(self, x):
+        """Vectorised contains() for a batch of elements x, i.e., along the first dimension. Returns a boolean array with an entry for each element."""
+        x = np.asarray(x)
+        if x.shape[1:] != self.nvec.shape or x.dtype.kind not in "iu":
+            return np.zeros(x.shape[:1], dtype=bool)
+        return np.all((x >= 0) & (x < self.nvec), axis=tuple(range(1, x.ndim)))
+
     # def sample(self, prob=None, size=1, replace=True):
     #     sampled = np.squeeze(self.np_random.choice(self.n, size=size, p=prob, replace=replace))
     #     if sampled.shape == ():
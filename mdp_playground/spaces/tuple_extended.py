@@ -12,6 +12,22 @@ class TupleExtended(Tuple):
         super(TupleExtended, self).__init__(spaces)
         super(TupleExtended, self).seed(seed=seed)
 
+    def sample_batch(self, n):
+        """Samples n elements from each sub-space with their sample_batch().
+
+        Returns
+        -------
+        tuple
+            A tuple with a batch of n elements for each sub-space
+        """
+        return tuple(space.sample_batch(n) for space in self.spaces)
+
+    def contains_batch(self, x):
+        """Vectorised contains() for a batch of elements x given as a tuple with a batch for each sub-space, as returned by sample_batch(). Returns a boolean array with an entry for each element."""
+        return np.logical_and.reduce(
+            [space.contains_batch(part) for (space, part) in zip(self.spaces, x)]
+        )
+
     # def sample(self, prob=None, size=1, replace=True):
     #     sampled = np.squeeze(self.np_random.choice(self.n, size=size, p=prob, replace=replace))
     #     if sampled.shape == ():
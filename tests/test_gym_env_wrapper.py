@@ -1,7 +1,11 @@
 import logging
 import copy
 import numpy as np
-from mdp_playground.envs.gym_env_wrapper import GymEnvWrapper
+import gym
+from mdp_playground.envs.gym_env_wrapper import GymEnvWrapper, LazyFrames
+from mdp_playground.envs.rl_toy_env import RLToyEnv
+from mdp_playground.envs.mujoco_env_wrapper import get_mujoco_wrapper
+from types import SimpleNamespace
 import unittest
 import pytest
 
@@ -22,6 +26,83 @@ import sys
 # TODO None of the tests do anything when done = True. Should try calling reset() in one of them and see that this works?
 
 
+class RandomImageEnv(gym.Env):
+    """A small env with random square images with pixels in [1, 255] as observations, to test the wrapper without Atari. The images are 2-D if channels is None."""
+
+    def __init__(self, size=8, channels=3, episode_length=100, reward_scale=1.0):
+        shape = (size, size) if channels is None else (size, size, channels)
+        self.observation_space = gym.spaces.Box(
+            low=0, high=255, shape=shape, dtype=np.uint8
+        )
+        self.action_space = gym.spaces.Discrete(4)
+        self.episode_length = episode_length
+        self.reward_scale = reward_scale
+        self.seed()
+
+    def seed(self, seed=None):
+        self.np_random = np.random.RandomState(seed)
+        return [seed]
+
+    def get_image(self):
+        return self.np_random.randint(
+            1, 256, size=self.observation_space.shape
+        ).astype(np.uint8)
+
+    def reset(self):
+        self.num_steps = 0
+        return self.get_image()
+
+    def step(self, action):
+        self.num_steps += 1
+        done = self.num_steps >= self.episode_length
+        return self.get_image(), float(action) * self.reward_scale, done, {}
+
+
+class StubMujocoEnv(gym.Env):
+    """Mimics the attributes of a Gym MujocoEnv that get_mujoco_wrapper() uses, without MuJoCo, to test the caching of the base environments. num_model_loads counts the constructions, which parse and compile the XML model for a real MujocoEnv."""
+
+    num_model_loads = 0
+
+    def __init__(self, frame_skip=5):
+        StubMujocoEnv.num_model_loads += 1
+        self.frame_skip = frame_skip
+        self.model = SimpleNamespace(
+            opt=SimpleNamespace(disableflags=0, timestep=0.01)
+        )
+        self.sim = StubModelLoader().make_sim(self.model, np.zeros(3))
+        self.data = self.sim.data
+        self.viewer = None
+        self._viewers = {}
+        self.init_qpos = np.zeros(3)
+        self.action_space = gym.spaces.Box(-1.0, 1.0, shape=(2,), dtype=np.float32)
+        self.observation_space = gym.spaces.Box(
+            -np.inf, np.inf, shape=(3,), dtype=np.float64
+        )
+        self.seed()
+
+    def seed(self, seed=None):
+        self.np_random, seed = gym.utils.seeding.np_random(seed)
+        return [seed]
+
+    def step(self, action):
+        return self.sim.state.copy(), 1.0, False, {}
+
+
+class StubModelLoader(object):
+    """A model loader for get_mujoco_wrapper() that copies stub models."""
+
+    def serialize(self, model):
+        return copy.deepcopy(model)
+
+    def load(self, model_binary):
+        return copy.deepcopy(model_binary)
+
+    def make_sim(self, model, sim_state):
+        sim = SimpleNamespace(model=model, state=np.array(sim_state), data=SimpleNamespace())
+        sim.get_state = lambda: sim.state.copy()
+        return sim
+
+
 class TestGymEnvWrapper(unittest.TestCase):
     def test_r_delay(self):
         """ """
@@ -296,6 +377,313 @@ class TestGymEnvWrapper(unittest.TestCase):
         aew.reset()
 
 
+    def test_image_transforms_canvas(self):
+        """Tests that the shift transform places the (transposed) base env image at a quantised shift on a zero-padded canvas and that returned observations are not changed by later steps."""
+        print("\033[32;1;4mTEST_IMAGE_TRANSFORMS_CANVAS\033[0m")
+        for channels in [3, 1]:
+            config = {
+                "image_transforms": "shift",
+                "image_sh_quant": 2,
+                "image_padding": 6,
+                "state_space_type": "discrete",
+                "action_space_type": "discrete",
+                "seed": 0,
+            }
+            env = RandomImageEnv(size=8, channels=channels)
+            aew = GymEnvWrapper(env, **config)
+            self.assertEqual(aew.observation_space.shape, (20, 20, channels))
+
+            # The base env's images are regenerated from its RNG states
+            env_rng_states = [env.np_random.get_state()]
+            observations = [aew.reset()]
+            for i in range(30):
+                env_rng_states.append(env.np_random.get_state())
+                next_state, _, _, _ = aew.step(aew.action_space.sample())
+                observations.append(next_state)
+
+            shifts = set()
+            for ob, env_rng_state in zip(observations, env_rng_states):
+                self.assertEqual(ob.shape, (20, 20, channels))
+                self.assertEqual(ob.dtype, np.uint8)
+                non_zero = np.argwhere(ob.any(axis=2))
+                top_left = non_zero.min(axis=0)
+                self.assertTrue(np.all(top_left % 2 == 0))
+                self.assertTrue(np.all(non_zero.max(axis=0) - top_left == 7))
+                self.assertEqual(len(non_zero), 64)
+                shifts.add(tuple(top_left))
+                env.np_random.set_state(env_rng_state)
+                np.testing.assert_array_equal(
+                    ob[top_left[0]: top_left[0] + 8, top_left[1]: top_left[1] + 8],
+                    env.get_image().transpose(1, 0, 2),
+                )
+            self.assertGreater(len(shifts), 1)
+
+    def test_image_transforms_rotate_scale_flip(self):
+        """Tests that the rotate and flip transforms with rotations quantised to multiples of 90 degrees permute the pixels of the base env image and that the scale transform resizes it within the scale range."""
+        print("\033[32;1;4mTEST_IMAGE_TRANSFORMS_ROTATE_SCALE_FLIP\033[0m")
+        config = {
+            "image_transforms": "rotate,flip",
+            "image_ro_quant": 90,
+            "image_padding": 6,
+            "state_space_type": "discrete",
+            "action_space_type": "discrete",
+            "seed": 0,
+        }
+        env = RandomImageEnv(size=8, channels=3)
+        aew = GymEnvWrapper(env, **config)
+
+        env_rng_states = [env.np_random.get_state()]
+        observations = [aew.reset()]
+        for i in range(30):
+            env_rng_states.append(env.np_random.get_state())
+            next_state, _, _, _ = aew.step(aew.action_space.sample())
+            observations.append(next_state)
+
+        symmetries = set()
+        for ob, env_rng_state in zip(observations, env_rng_states):
+            self.assertEqual(ob.shape, (20, 20, 3))
+            # Only the centre of the canvas is written
+            self.assertEqual(np.count_nonzero(ob.any(axis=2)), 64)
+            env.np_random.set_state(env_rng_state)
+            img = env.get_image().transpose(1, 0, 2)
+            transformed = [np.rot90(img, k) for k in range(4)]
+            transformed += [t[::-1] for t in transformed]
+            matches = [
+                i for i, t in enumerate(transformed)
+                if np.array_equal(ob[6:14, 6:14], t)
+            ]
+            self.assertEqual(len(matches), 1)
+            symmetries.add(matches[0])
+        self.assertGreater(len(symmetries), 4)
+        # The inverse maps are cached across frames
+        self.assertLessEqual(len(aew.image_inverse_maps), 12)
+
+        config["image_transforms"] = "scale,shift"
+        config["image_scale_range"] = (0.5, 1.0)
+        aew = GymEnvWrapper(RandomImageEnv(size=8, channels=1), **config)
+        sizes = set()
+        observations = [aew.reset()]
+        for i in range(30):
+            observations.append(aew.step(aew.action_space.sample())[0])
+        for ob in observations:
+            non_zero = np.argwhere(ob.any(axis=2))
+            size = non_zero.max(axis=0) - non_zero.min(axis=0) + 1
+            self.assertEqual(size[0], size[1])
+            self.assertEqual(len(non_zero), size[0] * size[1])
+            self.assertTrue(4 <= size[0] <= 8)
+            sizes.add(size[0])
+        self.assertGreater(len(sizes), 1)
+
+    def test_r_delay_p_noise_buffer(self):
+        """Tests the circular reward delay buffer, including the delayed rewards handed out at the end of an episode, and that noisy actions are sampled as with np_random.choice()."""
+        print("\033[32;1;4mTEST_R_DELAY_P_NOISE_BUFFER\033[0m")
+        config = {
+            "delay": 3,
+            "state_space_type": "discrete",
+            "action_space_type": "discrete",
+            "seed": 0,
+        }
+        # RandomImageEnv's reward is the action taken
+        aew = GymEnvWrapper(RandomImageEnv(episode_length=10), **config)
+        for episode in range(2):
+            aew.reset()
+            rewards = []
+            actions = [(3 * i + episode) % 4 for i in range(10)]
+            for action in actions:
+                _, reward, done, _ = aew.step(action)
+                rewards.append(reward)
+            self.assertTrue(done)
+            self.assertEqual(rewards[:3], [0.0, 0.0, 0.0])
+            self.assertEqual(rewards[3:9], [float(a) for a in actions[:6]])
+            self.assertEqual(rewards[9], float(sum(actions[6:9])))
+
+        # The delayed rewards handed out at the end of a long episode are exactly
+        # their sum, oldest first, without drift.
+        aew = GymEnvWrapper(
+            RandomImageEnv(episode_length=20000, reward_scale=0.1), **config
+        )
+        aew.reset()
+        rng = np.random.RandomState(0)
+        env_rewards = []
+        for i in range(20000):
+            action = rng.randint(4)
+            _, reward, done, _ = aew.step(action)
+            env_rewards.append(float(action) * 0.1)
+            if not done:
+                self.assertEqual(reward, env_rewards[-4] if i >= 3 else 0.0)
+        self.assertTrue(done)
+        self.assertEqual(reward, np.sum(env_rewards[-4:-1]))
+
+        config["delay"] = 0
+        config["transition_noise"] = 0.25
+        aew = GymEnvWrapper(RandomImageEnv(episode_length=1000), **config)
+        aew.reset()
+        num_noisy = 0
+        for i in range(500):
+            action = i % 4
+            probs = np.ones(4) * 0.25 / 3
+            probs[action] = 0.75
+            rng = copy.deepcopy(aew.np_random)
+            expected_action = rng.choice(4, size=1, p=probs)[0]
+            _, reward, done, _ = aew.step(action)
+            self.assertEqual(reward, float(expected_action))
+            num_noisy += expected_action != action
+        self.assertEqual(aew.total_noisy_transitions_episode, num_noisy)
+        self.assertGreater(num_noisy, 75)
+
+    def test_cont_irr_features_observation_buffer(self):
+        """Tests that the observations of continuous envs with irrelevant features are written into the persistent observation buffer and that actions are split into views."""
+        print("\033[32;1;4mTEST_CONT_IRR_FEATURES_OBSERVATION_BUFFER\033[0m")
+        base_env_config = {
+            "state_space_type": "continuous",
+            "action_space_type": "continuous",
+            "state_space_dim": 3,
+            "action_space_dim": 3,
+            "transition_dynamics_order": 1,
+            "reward_function": "move_to_a_point",
+            "target_point": [1, 1, 1],
+            "delay": 0,
+            "sequence_length": 1,
+            "seed": 1,
+            "dtype": np.float64,
+        }
+        config = {
+            "state_space_type": "continuous",
+            "action_space_type": "continuous",
+            "seed": 0,
+            "irr_state_space_dim": 2,
+            "irrelevant_features": {
+                "state_space_type": "continuous",
+                "action_space_type": "continuous",
+                "action_space_dim": 2,
+                "reward_function": "move_to_a_point",
+                "target_point": [3, 3],
+                "transition_dynamics_order": 1,
+                "dtype": np.float64,
+            },
+        }
+        for reuse_observation_buffer in [False, True]:
+            config_ = copy.deepcopy(config)
+            config_["reuse_observation_buffer"] = reuse_observation_buffer
+            aew = GymEnvWrapper(RLToyEnv(**copy.deepcopy(base_env_config)), **config_)
+            self.assertEqual(aew.observation_space.shape, (5,))
+            self.assertEqual(aew.action_space.shape, (5,))
+
+            ob = aew.reset()
+            prev_ob = ob.copy()
+            for i in range(10):
+                action = aew.action_space.sample()
+                action_base, action_irr = aew.split_action(action)
+                self.assertTrue(np.shares_memory(action_base, action))
+                self.assertTrue(np.shares_memory(action_irr, action))
+                np.testing.assert_array_equal(action_irr, action[3:])
+                next_ob, _, _, _ = aew.step(action)
+                self.assertEqual(next_ob.dtype, np.float64)
+                np.testing.assert_array_equal(next_ob[:3], aew.env.curr_obs)
+                np.testing.assert_array_equal(next_ob[3:], aew.irr_toy_env.curr_obs)
+                # Returned observations alias the buffer only if requested
+                self.assertEqual(next_ob is ob, reuse_observation_buffer)
+                if not reuse_observation_buffer:
+                    np.testing.assert_array_equal(ob, prev_ob)
+                ob = next_ob
+                prev_ob = ob.copy()
+
+    def test_frame_stack(self):
+        """Tests that frame_stack stacks the most recent (transformed) observations along the last axis, with the start state repeated after a reset, and that consecutive stacks share their frames."""
+        print("\033[32;1;4mTEST_FRAME_STACK\033[0m")
+        config = {
+            "frame_stack": 4,
+            "image_transforms": "shift",
+            "image_padding": 2,
+            "state_space_type": "discrete",
+            "action_space_type": "discrete",
+            "seed": 0,
+        }
+        aew = GymEnvWrapper(RandomImageEnv(size=8, channels=3), **config)
+        self.assertEqual(aew.observation_space.shape, (12, 12, 12))
+
+        ob = aew.reset()
+        self.assertIsInstance(ob, LazyFrames)
+        self.assertEqual(ob.shape, (12, 12, 12))
+        self.assertEqual(ob.dtype, np.uint8)
+        stacked = np.asarray(ob)
+        self.assertEqual(stacked.shape, (12, 12, 12))
+        self.assertTrue(aew.observation_space.contains(stacked))
+        for i in range(1, 4):
+            np.testing.assert_array_equal(stacked[..., 3 * i: 3 * i + 3], stacked[..., :3])
+
+        frames = [ob.frames[-1]]
+        prev_ob = ob
+        for i in range(6):
+            ob, _, _, _ = aew.step(aew.action_space.sample())
+            frames.append(ob.frames[-1])
+            # Each frame is stored only once
+            for frame, prev_frame in zip(ob.frames[:-1], prev_ob.frames[1:]):
+                self.assertIs(frame, prev_frame)
+            prev_ob = ob
+        stacked = np.asarray(ob)
+        np.testing.assert_array_equal(stacked, np.concatenate(frames[-4:], axis=-1))
+        np.testing.assert_array_equal(ob[0], stacked[0])
+        self.assertEqual(np.asarray(ob, dtype=np.float32).dtype, np.float32)
+
+        # 2-D frames, like grayscale Atari frames, are stacked along a new axis
+        config = {
+            "frame_stack": 4,
+            "state_space_type": "discrete",
+            "action_space_type": "discrete",
+            "seed": 0,
+        }
+        aew = GymEnvWrapper(RandomImageEnv(size=8, channels=None), **config)
+        self.assertEqual(aew.observation_space.shape, (8, 8, 4))
+        ob = aew.reset()
+        self.assertEqual(ob.shape, (8, 8, 4))
+        frames = [ob.frames[-1]]
+        for i in range(5):
+            ob, _, _, _ = aew.step(aew.action_space.sample())
+            frames.append(ob.frames[-1])
+        stacked = np.asarray(ob)
+        self.assertEqual(stacked.shape, (8, 8, 4))
+        self.assertTrue(aew.observation_space.contains(stacked))
+        np.testing.assert_array_equal(stacked, np.stack(frames[-4:], axis=-1))
+
+        # wrap_deepmind_ray already stacks frames
+        config["wrap_deepmind_ray"] = True
+        with self.assertRaisesRegex(AssertionError, "wrap_deepmind_ray"):
+            GymEnvWrapper(RandomImageEnv(size=8, channels=None), **config)
+
+    def test_mujoco_wrapper_model_cache(self):
+        """Tests that get_mujoco_wrapper() constructs the base environment only once per MujocoEnv config and that instances initialised from the cache get their own model, simulator and spaces, to which the time_unit and action_space_max dimensions are applied independently."""
+        print("\033[32;1;4mTEST_MUJOCO_WRAPPER_MODEL_CACHE\033[0m")
+        model_loader = StubModelLoader()
+        StubMujocoWrapper = get_mujoco_wrapper(StubMujocoEnv, model_loader)
+        self.assertIs(get_mujoco_wrapper(StubMujocoEnv, model_loader), StubMujocoWrapper)
+
+        StubMujocoEnv.num_model_loads = 0
+        env_1 = StubMujocoWrapper(**{"time_unit": 2.0, "action_space_max": 3.0})
+        env_2 = StubMujocoWrapper(**{"time_unit": 0.4})
+        env_3 = StubMujocoWrapper()
+        self.assertEqual(StubMujocoEnv.num_model_loads, 1)
+        self.assertIsInstance(env_2, StubMujocoEnv)
+
+        self.assertEqual([env_1.frame_skip, env_2.frame_skip, env_3.frame_skip], [10, 2, 5])
+        np.testing.assert_array_equal(env_1.action_space.high, [3.0, 3.0])
+        np.testing.assert_array_equal(env_2.action_space.high, [1.0, 1.0])
+        for env in [env_1, env_2, env_3]:
+            self.assertEqual(env.model.opt.disableflags, 128)
+            self.assertIs(env.data, env.sim.data)
+        self.assertIsNot(env_2.model, env_1.model)
+        self.assertIsNot(env_3.sim, env_2.sim)
+        self.assertIsNot(env_3.np_random, env_2.np_random)
+        env_2.model.opt.timestep = 0.1
+        self.assertEqual(env_3.model.opt.timestep, 0.01)
+        np.testing.assert_array_equal(env_3.step(env_3.action_space.sample())[0], np.zeros(3))
+
+        # Different MujocoEnv kwargs are cached separately
+        env_4 = StubMujocoWrapper(**{"MujocoEnv": {"frame_skip": 4}})
+        env_5 = StubMujocoWrapper(**{"MujocoEnv": {"frame_skip": 4}, "time_unit": 0.5})
+        self.assertEqual(StubMujocoEnv.num_model_loads, 2)
+        self.assertEqual([env_4.frame_skip, env_5.frame_skip], [4, 2])
+
     @pytest.mark.skip(reason="Cannot run mojoco in CI/CD currently.")
     def test_cont_irr_features(self):
         """ """
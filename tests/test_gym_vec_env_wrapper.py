@@ -0,0 +1,276 @@
+import copy
+import importlib.util
+import numpy as np
+from mdp_playground.envs.gym_env_wrapper import GymEnvWrapper
+from mdp_playground.envs.gym_vec_env_wrapper import (
+    GymVecEnvWrapper,
+    RLlibVecEnvAdapter,
+    get_rllib_vec_env,
+)
+from mdp_playground.envs.rl_toy_env import RLToyEnv
+from tests.test_gym_env_wrapper import RandomImageEnv
+import unittest
+
+
+class TestGymVecEnvWrapper(unittest.TestCase):
+    def compare_with_scalar_wrappers(self, make_env, config, seeds, actions):
+        """Steps a GymVecEnvWrapper and len(seeds) scalar GymEnvWrappers with the
+        same configs and base envs with the given batches of actions and checks
+        that they return the same observations, rewards and dones. The scalar
+        wrappers are reset when they are done to mirror the auto-reset of the
+        vectorised wrapper."""
+        vec_env = GymVecEnvWrapper(
+            [make_env(seed) for seed in seeds], seeds=seeds, **copy.deepcopy(config)
+        )
+        wrappers = []
+        for seed in seeds:
+            config_ = copy.deepcopy(config)
+            config_["seed"] = seed
+            wrappers.append(GymEnvWrapper(make_env(seed), **config_))
+
+        def assert_equal(x, y, err_msg=""):
+            if isinstance(y, tuple):
+                for x_, y_ in zip(x, y):
+                    np.testing.assert_array_equal(x_, y_, err_msg=err_msg)
+            else:
+                np.testing.assert_array_equal(x, y, err_msg=err_msg)
+
+        def get(obs, i):
+            if isinstance(obs, tuple):
+                return tuple(obs_[i] for obs_ in obs)
+            return obs[i]
+
+        obs = vec_env.reset()
+        for i, wrapper in enumerate(wrappers):
+            assert_equal(get(obs, i), wrapper.reset())
+
+        total_dones = 0
+        for t, batch_actions in enumerate(actions):
+            obs, rewards, dones, info = vec_env.step(batch_actions)
+            self.assertEqual(rewards.shape, (len(seeds),))
+            self.assertEqual(dones.shape, (len(seeds),))
+            for i, wrapper in enumerate(wrappers):
+                err_msg = "Mismatch for env " + str(i) + " in time step " + str(t)
+                action = batch_actions[i]
+                if isinstance(action, np.ndarray) and action.dtype.kind == "i":
+                    action = tuple(int(a) for a in action)
+                elif np.ndim(action) == 0:
+                    action = int(action)
+                next_obs, reward, done, _ = wrapper.step(action)
+                self.assertEqual(dones[i], done, msg=err_msg)
+                self.assertEqual(rewards[i], reward, msg=err_msg)
+                if done:
+                    total_dones += 1
+                    assert_equal(
+                        get(info["terminal_observation"], i), next_obs, err_msg=err_msg
+                    )
+                    next_obs = wrapper.reset()
+                assert_equal(get(obs, i), next_obs, err_msg=err_msg)
+            self.assertEqual(
+                vec_env.total_noisy_transitions_episode.tolist(),
+                [wrapper.total_noisy_transitions_episode for wrapper in wrappers],
+            )
+
+        vec_env.close()
+        return total_dones
+
+    def test_vec_r_delay_p_noise_r_noise(self):
+        """ """
+        print("\033[32;1;4mTEST_VEC_R_DELAY_P_NOISE_R_NOISE\033[0m")
+        config = {
+            "delay": 2,
+            "transition_noise": 0.25,
+            "reward_noise": 0.5,
+            "state_space_type": "discrete",
+            "action_space_type": "discrete",
+        }
+        seeds = [0, 1, 2, 3]
+        rng = np.random.RandomState(0)
+        actions = rng.randint(4, size=(100, len(seeds)))
+
+        def make_env(seed):
+            # Different episode lengths so that the envs are reset at
+            # different time steps
+            return RandomImageEnv(size=4, channels=1, episode_length=7 + seed)
+
+        total_dones = self.compare_with_scalar_wrappers(
+            make_env, config, seeds, actions
+        )
+        self.assertGreater(total_dones, 0)
+
+        config["delay"] = 0
+        self.compare_with_scalar_wrappers(make_env, config, seeds, actions)
+
+    def test_vec_image_transforms(self):
+        """ """
+        print("\033[32;1;4mTEST_VEC_IMAGE_TRANSFORMS\033[0m")
+        config = {
+            "image_transforms": "shift",
+            "image_sh_quant": 2,
+            "image_padding": 6,
+            "delay": 1,
+            "state_space_type": "discrete",
+            "action_space_type": "discrete",
+        }
+        seeds = [0, 1, 2]
+        rng = np.random.RandomState(1)
+        actions = rng.randint(4, size=(40, len(seeds)))
+
+        def make_env(seed):
+            return RandomImageEnv(size=8, channels=3, episode_length=5 + 3 * seed)
+
+        total_dones = self.compare_with_scalar_wrappers(
+            make_env, config, seeds, actions
+        )
+        self.assertGreater(total_dones, 0)
+
+        config["image_transforms"] = "shift,scale,rotate,flip"
+        config["image_ro_quant"] = 30
+        config["image_scale_range"] = (0.5, 1.2)
+        self.compare_with_scalar_wrappers(make_env, config, seeds, actions)
+
+    def test_vec_irr_features(self):
+        """ """
+        print("\033[32;1;4mTEST_VEC_IRR_FEATURES\033[0m")
+        config = {
+            "delay": 1,
+            "state_space_type": "discrete",
+            "action_space_type": "discrete",
+            "irrelevant_features": {
+                "state_space_type": "discrete",
+                "action_space_size": 5,
+                "delay": 0,
+                "sequence_length": 1,
+                "reward_scale": 1.0,
+                "generate_random_mdp": True,
+            },
+        }
+        seeds = [0, 1]
+        rng = np.random.RandomState(2)
+        actions = np.stack(
+            [rng.randint(4, size=(30, len(seeds))), rng.randint(5, size=(30, len(seeds)))],
+            axis=2,
+        )
+
+        def make_env(seed):
+            return RandomImageEnv(size=4, channels=1, episode_length=10)
+
+        self.compare_with_scalar_wrappers(make_env, config, seeds, actions)
+
+    def test_vec_cont_irr_features(self):
+        """ """
+        print("\033[32;1;4mTEST_VEC_CONT_IRR_FEATURES\033[0m")
+        config = {
+            "delay": 1,
+            "reward_noise": 0.1,
+            "state_space_type": "continuous",
+            "action_space_type": "continuous",
+            "irr_state_space_dim": 2,
+            "irrelevant_features": {
+                "state_space_type": "continuous",
+                "action_space_type": "continuous",
+                "action_space_dim": 2,
+                "reward_function": "move_to_a_point",
+                "target_point": [3, 3],
+                "transition_dynamics_order": 1,
+                "dtype": np.float64,
+            },
+        }
+        seeds = [0, 1, 2]
+        rng = np.random.RandomState(3)
+        actions = rng.uniform(-1, 1, size=(30, len(seeds), 5))
+
+        def make_env(seed):
+            return RLToyEnv(
+                state_space_type="continuous",
+                action_space_type="continuous",
+                state_space_dim=3,
+                action_space_dim=3,
+                transition_dynamics_order=1,
+                reward_function="move_to_a_point",
+                target_point=[1, 1, 1],
+                target_radius=0.5,
+                delay=0,
+                sequence_length=1,
+                seed=seed,
+                dtype=np.float64,
+            )
+
+        self.compare_with_scalar_wrappers(make_env, config, seeds, actions)
+
+    def test_rllib_vec_env_adapter(self):
+        """Tests that RLlibVecEnvAdapter returns the terminal observations
+        from vector_step() and the start states of the automatically reset
+        environments from reset_at(), as RLlib expects, and that it matches
+        scalar wrappers."""
+        print("\033[32;1;4mTEST_RLLIB_VEC_ENV_ADAPTER\033[0m")
+        config = {
+            "delay": 1,
+            "transition_noise": 0.2,
+            "state_space_type": "discrete",
+            "action_space_type": "discrete",
+        }
+        seeds = [0, 1, 2]
+
+        def make_env(seed):
+            return RandomImageEnv(size=4, channels=1, episode_length=4 + seed)
+
+        adapter = RLlibVecEnvAdapter(
+            GymVecEnvWrapper(
+                [make_env(seed) for seed in seeds], seeds=seeds, **copy.deepcopy(config)
+            )
+        )
+        self.assertEqual(adapter.num_envs, 3)
+        self.assertEqual(len(adapter.get_unwrapped()), 3)
+        wrappers = []
+        for seed in seeds:
+            config_ = copy.deepcopy(config)
+            config_["seed"] = seed
+            wrappers.append(GymEnvWrapper(make_env(seed), **config_))
+
+        obs = adapter.vector_reset()
+        self.assertEqual(len(obs), 3)
+        for ob, wrapper in zip(obs, wrappers):
+            np.testing.assert_array_equal(ob, wrapper.reset())
+
+        rng = np.random.RandomState(0)
+        total_dones = 0
+        for t in range(30):
+            actions = rng.randint(4, size=3).tolist()
+            obs, rewards, dones, infos = adapter.vector_step(actions)
+            self.assertEqual(len(infos), 3)
+            for i, wrapper in enumerate(wrappers):
+                next_ob, reward, done, _ = wrapper.step(actions[i])
+                np.testing.assert_array_equal(obs[i], next_ob)
+                self.assertEqual(rewards[i], reward)
+                self.assertEqual(dones[i], done)
+                if done:
+                    total_dones += 1
+                    # As RLlib does for finished episodes
+                    np.testing.assert_array_equal(adapter.reset_at(i), wrapper.reset())
+        self.assertGreater(total_dones, 0)
+
+        # Resetting an environment in the middle of an episode
+        np.testing.assert_array_equal(adapter.reset_at(1), wrappers[1].reset())
+        obs, rewards, dones, infos = adapter.vector_step([0, 1, 2])
+        np.testing.assert_array_equal(obs[1], wrappers[1].step(1)[0])
+
+    @unittest.skipIf(importlib.util.find_spec("ray") is None, "Ray is not installed.")
+    def test_get_rllib_vec_env(self):
+        """ """
+        print("\033[32;1;4mTEST_GET_RLLIB_VEC_ENV\033[0m")
+        from ray.rllib.env import VectorEnv as RLlibVectorEnv
+
+        env = get_rllib_vec_env(
+            [RandomImageEnv(size=4, channels=1) for i in range(2)],
+            seeds=[0, 1],
+            state_space_type="discrete",
+            action_space_type="discrete",
+        )
+        self.assertIsInstance(env, RLlibVectorEnv)
+        self.assertEqual(env.num_envs, 2)
+        self.assertEqual(len(env.vector_reset()), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
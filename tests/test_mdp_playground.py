@@ -2,8 +2,38 @@ import sys
 from datetime import datetime
 import logging
 import copy
+import contextlib
+import io
+import math
+import os
+import shutil
+import tempfile
 import numpy as np
-from mdp_playground.envs.rl_toy_env import RLToyEnv
+from gym.spaces import Box
+import PIL.Image as Image
+import PIL.ImageDraw as ImageDraw
+from mdp_playground.envs.rl_toy_env import (
+    RLToyEnv,
+    AugmentedStateBuffer,
+    get_dynamics_matrix,
+    integrate_dynamics,
+    get_cdf,
+    sample_from_cdf,
+    sample_noisy_discrete_state,
+    get_shared_mdp_cache_dir,
+    clear_shared_mdp_cache,
+    unrank_sequences,
+)
+from mdp_playground.spaces import (
+    BoxExtended,
+    DiscreteExtended,
+    GridActionSpace,
+    MultiDiscreteExtended,
+    ImageMultiDiscrete,
+    ImageContinuous,
+    TupleExtended,
+)
+from mdp_playground.spaces.image_multi_discrete import unpack_image
 import unittest
 
 # import os
@@ -1102,10 +1132,18 @@ class TestRLToyEnv(unittest.TestCase):
         self.assertEqual(
             type(state), int, "Type of discrete state should be int."
         )  # TODO Move this and the test_continuous_dynamics type checks to separate unit tests
+        self.assertEqual(
+            env.transition_matrix.dtype,
+            np.int32,
+            "Transition function should be compiled to a compact integer table.",
+        )
 
         action = 2
         next_state, reward, done, info = env.step(action)
         print("sars', done =", state, action, reward, next_state, done)
+        self.assertEqual(
+            type(next_state), int, "Type of discrete next state should be int."
+        )
         self.assertEqual(
             next_state,
             1,
@@ -1264,6 +1302,287 @@ class TestRLToyEnv(unittest.TestCase):
         env.reset()
         env.close()
 
+    def test_discrete_sequence_codes(self):
+        """Tests that the incrementally updated code for the sequence considered for the reward matches the code computed from the augmented state and that, with make_denser, the partial sequences completed by the last states are rewarded too."""
+        print("\033[32;1;4mTEST_DISCRETE_SEQUENCE_CODES\033[0m")
+        config = {}
+        config["log_filename"] = log_filename
+        config["seed"] = 0
+
+        config["state_space_type"] = "discrete"
+        config["action_space_type"] = "discrete"
+        config["action_space_size"] = 8
+        config["reward_density"] = 0.25
+        config["make_denser"] = True
+        config["terminal_state_density"] = 0.25
+        config["delay"] = 2
+        config["sequence_length"] = 3
+
+        config["generate_random_mdp"] = True
+        env = RLToyEnv(**config)
+        self.assertEqual(len(env.sequence_codes), len(env.rewardable_sequences))
+
+        num_partial_rewards = 0
+        for i in range(50):
+            window = env.augmented_state[1: env.augmented_state_length - env.delay]
+            self.assertEqual(env.sequence_code, env.encode_sequence(window))
+            next_state, reward, done, info = env.step(env.action_space.sample())
+            if env.augmented_state[0] == -1:
+                self.assertEqual(reward, 0)
+            else:
+                window = env.augmented_state[
+                    1: env.augmented_state_length - env.delay
+                ]
+                expected_reward = sum(
+                    env.rewardable_sequences.get(tuple(window[-ss_len:]), 0.0)
+                    for ss_len in range(1, env.sequence_length + 1)
+                )
+                self.assertAlmostEqual(reward, expected_reward)
+                num_partial_rewards += reward != env.rewardable_sequences.get(
+                    tuple(window), 0.0
+                )
+            if done:
+                env.reset()
+        self.assertGreater(num_partial_rewards, 0)
+
+        env.close()
+
+    def test_discrete_generated_mdp_structure(self):
+        """Tests the structure of generated MDPs with large diameters: next states are in the next independent set, all actions lead to different states for maximally connected MDPs and terminal states have self-loops. Rewardable sequences also need to be unique."""
+        print("\033[32;1;4mTEST_DISCRETE_GENERATED_MDP_STRUCTURE\033[0m")
+        config = {}
+        config["log_filename"] = log_filename
+        config["seed"] = 0
+        config["state_space_type"] = "discrete"
+        config["action_space_size"] = 8
+        config["diameter"] = 500
+        config["terminal_state_density"] = 0.25
+        config["reward_density"] = 0.05
+        config["sequence_length"] = 3
+        config["repeats_in_sequences"] = False
+        config["generate_random_mdp"] = True
+        config["verbose"] = False
+
+        num_states = 8 * 500
+        for maximally_connected in [True, False]:
+            config["maximally_connected"] = maximally_connected
+            env = RLToyEnv(**config)
+            table = env.transition_matrix
+            self.assertEqual(table.shape, (num_states, 8))
+            states = np.arange(num_states)
+            next_set_starts = ((states // 8 + 1) * 8) % num_states
+            terminal = np.isin(states % 8, [6, 7])
+            np.testing.assert_array_equal(
+                table[terminal], np.repeat(states[terminal, np.newaxis], 8, axis=1)
+            )
+            offsets = table[~terminal] - next_set_starts[~terminal, np.newaxis]
+            self.assertTrue(np.all((offsets >= 0) & (offsets < 8)))
+            if maximally_connected:
+                np.testing.assert_array_equal(
+                    np.sort(offsets, axis=1),
+                    np.repeat(np.arange(8)[np.newaxis], len(offsets), axis=0),
+                )
+
+            sequences = [seq for seq in env.rewardable_sequences if len(seq) == 3]
+            self.assertEqual(len(sequences), 500 * int(0.05 * 6 * 6 * 6))
+            for seq in sequences[:100]:
+                independent_sets = [state // 8 for state in seq]
+                self.assertEqual(
+                    independent_sets,
+                    [(independent_sets[0] + i) % 500 for i in range(3)],
+                )
+                self.assertTrue(all(state % 8 < 6 for state in seq))
+            env.close()
+
+    def test_discrete_mdp_cache(self):
+        """Tests that an MDP loaded from the on-disk cache is the same as a generated one and that the environment then also behaves the same."""
+        print("\033[32;1;4mTEST_DISCRETE_MDP_CACHE\033[0m")
+        config = {}
+        config["log_filename"] = log_filename
+        config["seed"] = 3
+        config["state_space_type"] = "discrete"
+        config["action_space_size"] = [8, 4]
+        config["irrelevant_features"] = True
+        config["diameter"] = 3
+        config["sequence_length"] = 3
+        config["reward_density"] = 0.05
+        config["reward_dist"] = [0.1, 1.0]
+        config["make_denser"] = True
+        config["transition_noise"] = 0.1
+        config["generate_random_mdp"] = True
+        config["verbose"] = False
+
+        env = RLToyEnv(**copy.deepcopy(config))
+        with tempfile.TemporaryDirectory() as mdp_cache_dir:
+            config["mdp_cache_dir"] = mdp_cache_dir
+            env_generated = RLToyEnv(**copy.deepcopy(config))
+            self.assertIsNone(env_generated.mdp_cache)
+            self.assertEqual(len(os.listdir(mdp_cache_dir)), 1)
+            env_cached = RLToyEnv(**copy.deepcopy(config))
+            self.assertIsNotNone(env_cached.mdp_cache)
+
+            config["seed"] = 4  # A different seed needs a different MDP
+            env_other_seed = RLToyEnv(**copy.deepcopy(config))
+            self.assertIsNone(env_other_seed.mdp_cache)
+            self.assertEqual(len(os.listdir(mdp_cache_dir)), 2)
+
+            # Without a seed, the MDP can't be looked up again and isn't cached
+            config_unseeded = copy.deepcopy(config)
+            del config_unseeded["seed"]
+            for i in range(3):
+                with self.assertWarnsRegex(UserWarning, "keyed by the seed"):
+                    env_unseeded = RLToyEnv(**copy.deepcopy(config_unseeded))
+                self.assertIsNone(env_unseeded.mdp_cache_path)
+            self.assertEqual(len(os.listdir(mdp_cache_dir)), 2)
+
+            for env_ in [env_generated, env_cached]:
+                np.testing.assert_array_equal(
+                    env_.transition_matrix, env.transition_matrix
+                )
+                np.testing.assert_array_equal(
+                    env_.config["transition_function_irrelevant"],
+                    env.config["transition_function_irrelevant"],
+                )
+                self.assertEqual(env_.rewardable_sequences, env.rewardable_sequences)
+
+            for i in range(200):
+                action = env.action_space.sample()
+                self.assertEqual(env_cached.step(action)[:3], env.step(action)[:3])
+                if i % 50 == 0:
+                    self.assertEqual(env_cached.reset(), env.reset())
+
+        # With shared_mdp, the MDP is cached in shared memory by default
+        del config["mdp_cache_dir"]
+        config["shared_mdp"] = True
+        env_generated = RLToyEnv(**copy.deepcopy(config))
+        try:
+            self.assertEqual(
+                os.path.dirname(env_generated.mdp_cache_path),
+                get_shared_mdp_cache_dir(),
+            )
+            env_cached = RLToyEnv(**copy.deepcopy(config))
+            self.assertIsNotNone(env_cached.mdp_cache)
+        finally:
+            clear_shared_mdp_cache([env_generated.mdp_cache_path])
+        self.assertFalse(os.path.exists(env_generated.mdp_cache_path))
+        # The transition tables memory-mapped before stay usable
+        np.testing.assert_array_equal(
+            env_cached.transition_matrix, env_generated.transition_matrix
+        )
+
+        # shared_mdp needs a seed, since entries in shared memory would leak
+        # otherwise
+        del config["seed"]
+        with self.assertRaises(AssertionError):
+            RLToyEnv(**copy.deepcopy(config))
+
+    def test_verbose_and_event_hooks(self):
+        """Tests that nothing is printed with verbose set to False and that the event hooks are called on step() and reset()."""
+        print("\033[32;1;4mTEST_VERBOSE_AND_EVENT_HOOKS\033[0m")
+        events = []
+        config = {}
+        config["seed"] = 0
+        config["state_space_type"] = "discrete"
+        config["action_space_size"] = 8
+        config["delay"] = 0
+        config["sequence_length"] = 1
+        config["reward_scale"] = 1.0
+        config["reward_density"] = 0.25
+        config["make_denser"] = False
+        config["terminal_state_density"] = 0.25
+        config["generate_random_mdp"] = True
+        config["verbose"] = False
+        config["event_hooks"] = [lambda event, data: events.append((event, data))]
+
+        stdout = io.StringIO()
+        with contextlib.redirect_stdout(stdout):
+            env = RLToyEnv(**config)
+        self.assertEqual(stdout.getvalue(), "")
+        self.assertEqual(events, [("reset", {"state": env.curr_state})])
+
+        state = env.curr_state
+        next_state, reward, done, info = env.step(3)
+        self.assertEqual(len(events), 2)
+        event, data = events[-1]
+        self.assertEqual(event, "step")
+        self.assertEqual(
+            data,
+            {
+                "state": state,
+                "action": 3,
+                "next_state": next_state,
+                "reward": reward,
+                "done": done,
+            },
+        )
+        env.reset()
+        self.assertEqual(events[-1], ("reset", {"state": env.curr_state}))
+
+        env.close()
+
+    def test_validation_levels(self):
+        """Tests that the bounds-only and off validation levels give the same trajectories as the full level for valid actions and that bounds-only still replaces invalid actions."""
+        print("\033[32;1;4mTEST_VALIDATION_LEVELS\033[0m")
+        continuous_config = {}
+        continuous_config["log_filename"] = log_filename
+        continuous_config["seed"] = 0
+        continuous_config["state_space_type"] = "continuous"
+        continuous_config["action_space_type"] = "continuous"
+        continuous_config["state_space_dim"] = 2
+        continuous_config["action_space_dim"] = 2
+        continuous_config["transition_dynamics_order"] = 2
+        continuous_config["state_space_max"] = 2.0
+        continuous_config["action_space_max"] = 1.0
+        continuous_config["delay"] = 0
+        continuous_config["sequence_length"] = 1
+        continuous_config["transition_noise"] = lambda rng: rng.normal(0, 0.1, 2)
+        continuous_config["reward_function"] = "move_along_a_line"
+        continuous_config["verbose"] = False
+
+        grid_config = {}
+        grid_config["log_filename"] = log_filename
+        grid_config["seed"] = 0
+        grid_config["state_space_type"] = "grid"
+        grid_config["grid_shape"] = (4, 4)
+        grid_config["reward_function"] = "move_to_a_point"
+        grid_config["target_point"] = [3, 3]
+        grid_config["transition_noise"] = 0.2
+        grid_config["delay"] = 0
+        grid_config["sequence_length"] = 1
+        grid_config["verbose"] = False
+
+        for config in [continuous_config, grid_config]:
+            trajectories = []
+            for validation_level in ["full", "bounds-only", "off"]:
+                config["validation_level"] = validation_level
+                env = RLToyEnv(**config)
+                env.action_space.seed(1)
+                trajectory = [np.array(env.reset())]
+                for i in range(50):
+                    action = env.action_space.sample()
+                    if config["state_space_type"] == "grid":
+                        action = list(action)
+                    state, reward, done, _ = env.step(action)
+                    trajectory.append(np.array(state))
+                    trajectory.append(reward)
+                env.close()
+                trajectories.append(trajectory)
+            for trajectory in trajectories[1:]:
+                for x, y in zip(trajectories[0], trajectory):
+                    np.testing.assert_array_equal(x, y)
+
+        continuous_config["validation_level"] = "bounds-only"
+        del continuous_config["transition_noise"]
+        env = RLToyEnv(**continuous_config)
+        state = env.reset().copy()
+        with self.assertWarns(UserWarning):
+            next_state, _, _, _ = env.step(np.array([1.5, 0.0]))
+        np.testing.assert_array_equal(next_state, state)  # 0 action
+        env.close()
+
+        with self.assertRaises(AssertionError):
+            RLToyEnv(**dict(continuous_config, validation_level="none"))
+
     def test_discrete_p_noise(self):
         """"""
         print("\033[32;1;4mTEST_DISCRETE_P_NOISE\033[0m")
@@ -1611,6 +1930,7 @@ class TestRLToyEnv(unittest.TestCase):
 
         env = RLToyEnv(**config)
         state = env.get_augmented_state()["curr_state"]
+        self.assertEqual(env.config["transition_function_irrelevant"].dtype, np.int32)
 
         actions = [[7, 0], [5, 0], [5, 0], [1, 2]] + [
             [5, np.random.randint(config["action_space_size"][1])]
@@ -1627,6 +1947,7 @@ class TestRLToyEnv(unittest.TestCase):
                 + " when reward delay = "
                 + str(config["delay"]),
             )
+            self.assertEqual(type(next_state[1]), int)
             state = next_state
 
         env.reset()
@@ -2196,7 +2517,541 @@ class TestRLToyEnv(unittest.TestCase):
         env.close()
 
     # Unit tests
+    def test_augmented_state_buffer(self):
+        """Tests that the ring buffer for the augmented state behaves like a list where the oldest state is deleted when a new state is appended."""
+        print("\033[32;1;4mTEST_AUGMENTED_STATE_BUFFER\033[0m")
+        buffer = AugmentedStateBuffer(
+            3, state_shape=(2,), dtype=np.float32, pad_value=np.nan
+        )
+        buffer.reset(np.array([0.0, 1.0]))
+        states = [[np.nan, np.nan], [np.nan, np.nan], [0.0, 1.0]]
+        np.testing.assert_array_equal(buffer.view, states)
+        for i in range(7):
+            state = np.array([i, -i], dtype=np.float32)
+            buffer.push(state)
+            state[0] = 100  # The buffer should hold a copy
+            del states[0]
+            states.append([i, -i])
+            np.testing.assert_array_equal(buffer.view, states)
+            self.assertTrue(buffer.view.flags["C_CONTIGUOUS"])
+
+    def test_discrete_samplers(self):
+        """Tests that the samplers for noisy discrete transitions and for start states sample the same states as np.random.RandomState.choice() with the same seed."""
+        print("\033[32;1;4mTEST_DISCRETE_SAMPLERS\033[0m")
+        num_states = 10
+        for noise in [0.01, 0.3, 0.9]:
+            rng, rng_choice = np.random.RandomState(0), np.random.RandomState(0)
+            for i in range(2000):
+                state = i % num_states
+                probs = np.ones(shape=(num_states,)) * noise / (num_states - 1)
+                probs[state] = 1 - noise
+                sampled = sample_noisy_discrete_state(rng, state, num_states, noise)
+                self.assertIsInstance(sampled, int)
+                self.assertEqual(sampled, rng_choice.choice(num_states, p=probs))
+
+        prob = np.array([0.2, 0.0, 0.3, 0.1, 0.4, 0.0])
+        cdf = get_cdf(prob)
+        rng, rng_choice = np.random.RandomState(1), np.random.RandomState(1)
+        for i in range(2000):
+            self.assertEqual(
+                sample_from_cdf(rng, cdf), rng_choice.choice(len(prob), p=prob)
+            )
+
+    def test_dynamics_matrix(self):
+        """Tests that integrating with the matrix from get_dynamics_matrix() gives the same result as the Taylor expansion of the state derivatives, for single and for stacked state derivatives."""
+        print("\033[32;1;4mTEST_DYNAMICS_MATRIX\033[0m")
+        dynamics_order, time_unit = 3, 0.4
+        dynamics_matrix = get_dynamics_matrix(dynamics_order, time_unit)
+        self.assertEqual(dynamics_matrix.shape, (4, 4))
+        np.testing.assert_allclose(
+            dynamics_matrix[0], [1, 0.4, 0.4 ** 2 / 2, 0.4 ** 3 / 6]
+        )
+        rng = np.random.RandomState(0)
+        state_derivatives = rng.normal(size=(5, dynamics_order + 1, 2))
+        expected = state_derivatives.copy()
+        for i in range(dynamics_order):
+            for j in range(dynamics_order - i):
+                expected[:, i] += (
+                    expected[:, i + j + 1]
+                    * (time_unit ** (j + 1))
+                    / math.factorial(j + 1)
+                )
+        np.testing.assert_allclose(
+            integrate_dynamics(dynamics_matrix, state_derivatives), expected
+        )
+        np.testing.assert_allclose(
+            integrate_dynamics(dynamics_matrix, state_derivatives[2]), expected[2]
+        )
+
+    def test_image_multi_discrete_cache(self):
+        """Tests that ImageMultiDiscrete returns the same images and consumes its RNG in the same way with and without its cache of rendered images and that the cache stays within its memory budget."""
+        print("\033[32;1;4mTEST_IMAGE_MULTI_DISCRETE_CACHE\033[0m")
+        image_size = 40 * 40
+        for image_cache_size in [2 ** 26, 5 * image_size]:
+            imd_cached = ImageMultiDiscrete(
+                [4, 3],
+                width=40,
+                height=40,
+                transforms="shift,scale,rotate,flip",
+                sh_quant=4,
+                scale_range=(0.5, 1.0),
+                ro_quant=90,
+                circle_radius=10,
+                image_cache_size=image_cache_size,
+                seed=0,
+            )
+            imd = ImageMultiDiscrete(
+                [4, 3],
+                width=40,
+                height=40,
+                transforms="shift,scale,rotate,flip",
+                sh_quant=4,
+                scale_range=(0.5, 1.0),
+                ro_quant=90,
+                circle_radius=10,
+                image_cache_size=0,
+                seed=0,
+            )
+            rng = np.random.RandomState(0)
+            for i in range(300):
+                state = [rng.randint(4), rng.randint(3)]
+                image = imd_cached.get_concatenated_image(state)
+                self.assertEqual(image.shape, (80, 40, 1))
+                np.testing.assert_array_equal(
+                    image, imd.get_concatenated_image(state)
+                )
+                self.assertLessEqual(
+                    imd_cached.image_cache_nbytes, image_cache_size
+                )
+            self.assertEqual(len(imd.image_cache), 0)
+            self.assertGreater(len(imd_cached.image_cache), 0)
+            self.assertEqual(
+                imd_cached.np_random.randint(1000), imd.np_random.randint(1000)
+            )
+
+        # By default, images are only cached if all variants fit into the budget
+        imd = ImageMultiDiscrete([4, 3], width=40, height=40, transforms="none")
+        self.assertEqual(imd.image_cache_size, 4 * image_size)
+        for i in range(20):
+            imd.get_concatenated_image([i % 4, i % 3])
+        self.assertEqual(len(imd.image_cache), 4)
+        imd = ImageMultiDiscrete(
+            [4, 3],
+            width=40,
+            height=40,
+            transforms="shift,rotate",
+            sh_quant=1,
+            ro_quant=1,
+            circle_radius=10,
+        )
+        self.assertEqual(imd.image_cache_size, 0)
+        imd.get_concatenated_image([1, 2])
+        self.assertEqual(len(imd.image_cache), 0)
+
+    def test_image_multi_discrete_batched_rendering(self):
+        """Tests that the images rendered in a batch with NumPy by ImageMultiDiscrete.get_concatenated_images() only differ from those rendered one by one with PIL on the edges of the polygons and that the RNG is consumed in the same way."""
+        print("\033[32;1;4mTEST_IMAGE_MULTI_DISCRETE_BATCHED_RENDERING\033[0m")
+        for transforms in ["none", "shift,scale,rotate,flip"]:
+            imds = [
+                ImageMultiDiscrete(
+                    [6, 4],
+                    width=50,
+                    height=50,
+                    transforms=transforms,
+                    sh_quant=1,
+                    scale_range=(0.5, 1.2),
+                    ro_quant=1,
+                    circle_radius=16,
+                    image_cache_size=0,
+                    seed=1,
+                )
+                for _ in range(2)
+            ]
+            rng = np.random.RandomState(0)
+            states = np.stack(
+                (rng.randint(6, size=100), rng.randint(4, size=100)), axis=1
+            )
+            images = imds[0].get_concatenated_images(states)
+            self.assertEqual(images.shape, (100, 100, 50, 1))
+            self.assertEqual(images.dtype, np.uint8)
+            for i in range(len(states)):
+                expected_image = imds[1].get_concatenated_image(list(states[i]))
+                num_pixels = np.sum(expected_image > 0)
+                self.assertGreater(num_pixels, 0)
+                self.assertLess(
+                    np.sum(images[i] != expected_image), 0.2 * num_pixels
+                )
+            self.assertEqual(
+                imds[0].np_random.randint(1000), imds[1].np_random.randint(1000)
+            )
+
+    def test_image_continuous_agent_sprite(self):
+        """Tests that stamping the pre-rendered agent onto the cached background in ImageContinuous gives the same image as drawing the agent with PIL, also when the agent is partly outside the image."""
+        print("\033[32;1;4mTEST_IMAGE_CONTINUOUS_AGENT_SPRITE\033[0m")
+        feature_space = Box(low=np.zeros(4), high=np.full(4, 10.0))
+        term_spaces = [Box(low=np.array([2.0, 3.0]), high=np.array([4.0, 5.0]))]
+        imc = ImageContinuous(
+            feature_space,
+            term_spaces=term_spaces,
+            width=60,
+            height=40,
+            circle_radius=6,
+            target_point=np.array([8.0, 8.0]),
+        )
+        R = imc.circle_radius
+        for obs in [
+            [5.0, 5.0, 1.0, 2.0],
+            [0.0, 9.9, 10.0, 0.2],
+            [3.0, 4.0, 9.8, 9.9],
+        ]:
+            obs = np.array(obs)
+            image = imc.get_concatenated_image(obs)
+            self.assertEqual(image.shape, (120, 40, 3))
+            for i, relevant in enumerate([True, False]):
+                if relevant:
+                    indices = imc.relevant_indices
+                else:
+                    indices = imc.irrelevant_indices
+                expected = Image.fromarray(
+                    np.ascontiguousarray(
+                        np.transpose(imc.render_background(relevant), (1, 0, 2))
+                    ),
+                    "RGB",
+                )
+                pos_pixel = imc.convert_to_pixel(obs[indices])
+                ImageDraw.Draw(expected).ellipse(
+                    [tuple(pos_pixel - R), tuple(pos_pixel + R)],
+                    fill=imc.agent_colour,
+                )
+                np.testing.assert_array_equal(
+                    image[i * 60: (i + 1) * 60],
+                    np.transpose(np.array(expected), (1, 0, 2)),
+                )
+
+    def test_image_spaces_out_buffers(self):
+        """Tests that the image spaces write into caller-provided arrays in channel-last and channel-first layouts with the same results as for newly allocated images."""
+        print("\033[32;1;4mTEST_IMAGE_SPACES_OUT_BUFFERS\033[0m")
+        imds = [
+            ImageMultiDiscrete(
+                [5, 3],
+                width=30,
+                height=20,
+                transforms="shift,rotate",
+                sh_quant=2,
+                ro_quant=30,
+                circle_radius=8,
+                seed=0,
+            )
+            for _ in range(3)
+        ]
+        out = np.zeros((60, 20, 1), dtype=np.uint8)
+        out_channels_first = np.zeros((1, 60, 20), dtype=np.uint8)
+        for state in [[0, 1], [4, 2], [3, 0]]:
+            image = imds[0].get_concatenated_image(state)
+            self.assertEqual(image.shape, (60, 20, 1))
+            self.assertIs(imds[1].get_concatenated_image(state, out=out), out)
+            np.testing.assert_array_equal(out, image)
+            self.assertIs(
+                imds[2].get_concatenated_image(
+                    state, out=out_channels_first, channels_first=True
+                ),
+                out_channels_first,
+            )
+            np.testing.assert_array_equal(out_channels_first[0], image[..., 0])
+
+        imc = ImageContinuous(
+            Box(low=np.zeros(4), high=np.full(4, 10.0)),
+            width=30,
+            height=20,
+            target_point=np.array([8.0, 8.0]),
+        )
+        obs = np.array([1.0, 2.0, 3.0, 4.0])
+        image = imc.get_concatenated_image(obs)
+        self.assertEqual(image.shape, (60, 20, 3))
+        out = np.zeros((3, 60, 20), dtype=np.uint8)
+        self.assertIs(
+            imc.get_concatenated_image(obs, out=out, channels_first=True), out
+        )
+        np.testing.assert_array_equal(np.moveaxis(out, 0, -1), image)
+        np.testing.assert_array_equal(
+            imc.get_concatenated_image(obs, channels_first=True), out
+        )
+
+    def test_discrete_image_bit_packed(self):
+        """Tests that the bit-packed image observations of a discrete environment unpack to the same images as the default observations."""
+        print("\033[32;1;4mTEST_DISCRETE_IMAGE_BIT_PACKED\033[0m")
+        config = {}
+        config["log_filename"] = log_filename
+        config["seed"] = 0
+        config["state_space_type"] = "discrete"
+        config["action_space_size"] = 8
+        config["delay"] = 0
+        config["sequence_length"] = 1
+        config["reward_scale"] = 1.0
+        config["generate_random_mdp"] = True
+        config["image_representations"] = True
+        config["image_width"] = 44
+        config["image_height"] = 42
+        config["image_transforms"] = "shift,rotate,flip"
+        config["image_sh_quant"] = 2
+        config["image_ro_quant"] = 10
+        config["verbose"] = False
+        env = RLToyEnv(**config)
+        config["image_bit_packed"] = True
+        env_packed = RLToyEnv(**config)
+        self.assertEqual(env_packed.observation_space.shape, (44, 6, 1))
+
+        state, state_packed = env.reset(), env_packed.reset()
+        for i in range(20):
+            self.assertEqual(state_packed.shape, (44, 6, 1))
+            self.assertTrue(env_packed.observation_space.contains(state_packed))
+            np.testing.assert_array_equal(unpack_image(state_packed, 42), state)
+            action = env.action_space.sample()
+            state, _, _, _ = env.step(action)
+            state_packed, _, _, _ = env_packed.step(action)
+        env.close()
+        env_packed.close()
+
+    def test_image_multi_discrete_custom_images(self):
+        """Tests that ImageMultiDiscrete loads custom images and textures lazily and caches them resized."""
+        print("\033[32;1;4mTEST_IMAGE_MULTI_DISCRETE_CUSTOM_IMAGES\033[0m")
+        cust_path = tempfile.mkdtemp()
+        try:
+            rng = np.random.RandomState(0)
+            for i in range(5):
+                Image.fromarray(
+                    rng.randint(256, size=(32, 32, 3)).astype(np.uint8), "RGB"
+                ).save(os.path.join(cust_path, str(i) + ".png"))
+            for use_custom_images in ["textures", "images"]:
+                imd = ImageMultiDiscrete(
+                    [4],
+                    width=60,
+                    height=60,
+                    transforms="shift,scale",
+                    sh_quant=1,
+                    scale_range=(0.5, 1.0),
+                    circle_radius=14,
+                    use_custom_images=use_custom_images,
+                    cust_path=cust_path,
+                    seed=0,
+                )
+                self.assertEqual(len(imd.cust_imgs), 0)
+                for i in range(50):
+                    image = imd.get_concatenated_image([i % 2])
+                    self.assertEqual(image.shape, (60, 60, 3))
+                self.assertEqual(set(imd.cust_imgs.keys()), {0, 1})
+                for (discrete_state, size), tex_arr in imd.cust_arrs.items():
+                    self.assertFalse(tex_arr.flags.writeable)
+                    np.testing.assert_array_equal(
+                        tex_arr,
+                        np.array(
+                            Image.open(
+                                os.path.join(cust_path, str(discrete_state) + ".png")
+                            ).resize((size, size))
+                        ),
+                    )
+                self.assertIs(
+                    imd.get_custom_image_array(discrete_state, size), tex_arr
+                )
+        finally:
+            shutil.rmtree(cust_path)
+
+    def test_spaces_sample_and_contains_batch(self):
+        """Tests the batched sample_batch() and contains_batch() of the spaces against sample() and contains()."""
+        print("\033[32;1;4mTEST_SPACES_SAMPLE_AND_CONTAINS_BATCH\033[0m")
+        prob = np.array([0.1, 0.0, 0.5, 0.4])
+        for kwargs in [{}, {"prob": prob}]:
+            spaces = [DiscreteExtended(4, seed=0) for _ in range(2)]
+            batch = spaces[0].sample_batch(100, **kwargs)
+            self.assertEqual(batch.shape, (100,))
+            np.testing.assert_array_equal(
+                batch, [spaces[1].sample(**kwargs) for i in range(100)]
+            )
+        np.testing.assert_array_equal(
+            spaces[0].contains_batch(np.array([-1, 0, 3, 4])),
+            [False, True, True, False],
+        )
+
+        spaces = [MultiDiscreteExtended([3, 5], seed=0) for _ in range(2)]
+        np.testing.assert_array_equal(
+            spaces[0].sample_batch(50), [spaces[1].sample() for i in range(50)]
+        )
+        np.testing.assert_array_equal(
+            spaces[0].contains_batch(np.array([[0, 4], [3, 0], [2, -1]])),
+            [True, False, False],
+        )
+
+        for dtype in [np.float32, np.int64]:
+            spaces = [
+                BoxExtended(-2, 3, shape=(2, 3), dtype=dtype, seed=0)
+                for _ in range(2)
+            ]
+            batch = spaces[0].sample_batch(50)
+            self.assertEqual(batch.shape, (50, 2, 3))
+            self.assertEqual(batch.dtype, dtype)
+            np.testing.assert_array_equal(
+                batch, [spaces[1].sample() for i in range(50)]
+            )
+            np.testing.assert_array_equal(
+                spaces[0].contains_batch(batch),
+                [spaces[0].contains(x) for x in batch],
+            )
+        self.assertFalse(spaces[0].contains_batch(batch * 2 - 5).all())
+
+        space = GridActionSpace(-1, 1, shape=(3,), seed=0)
+        batch = space.sample_batch(200)
+        self.assertEqual(batch.shape, (200, 3))
+        self.assertTrue(space.contains_batch(batch).all())
+        self.assertEqual(set(np.abs(batch).sum(axis=1)), {0, 1})
+        actions = np.array([[0, 0, 0], [1, 0, 0], [0, -1, 0], [1, 1, 0], [2, 0, 0]])
+        np.testing.assert_array_equal(
+            space.contains_batch(actions), [space.contains(x) for x in actions]
+        )
+        self.assertFalse(space.contains_batch(actions.astype(float)).any())
+
+        space = TupleExtended(
+            [DiscreteExtended(3, seed=1), MultiDiscreteExtended([2, 2], seed=2)]
+        )
+        batch = space.sample_batch(10)
+        self.assertEqual(batch[0].shape, (10,))
+        self.assertEqual(batch[1].shape, (10, 2))
+        self.assertTrue(space.contains_batch(batch).all())
+
+        imd = ImageMultiDiscrete([4, 3], width=40, height=40, transforms="", seed=0)
+        batch = imd.sample_batch(8)
+        self.assertEqual(batch.shape, (8, 80, 40, 1))
+        imc = ImageContinuous(
+            BoxExtended(0.0, 10.0, shape=(2,), seed=0), width=30, height=20
+        )
+        batch = imc.sample_batch(8)
+        self.assertEqual(batch.shape, (8, 30, 20, 3))
+        self.assertEqual(imc.contains_batch(batch[:, :, :, :1]).shape, (8,))
+        # Each image is checked on its own
+        np.testing.assert_array_equal(
+            imd.contains_batch(
+                [np.zeros((40, 40, 1)), np.zeros((40, 40, 3)), np.zeros((40, 40, 1))]
+            ),
+            [True, False, True],
+        )
+        np.testing.assert_array_equal(
+            imc.contains_batch([np.zeros((30, 20, 3)), np.zeros((30, 20, 1))]),
+            [False, True],
+        )
+        self.assertEqual(imc.contains_batch(batch[:0]).shape, (0,))
+
+    def test_unrank_sequences_large_maximum(self):
+        """Tests that the permutation numbers of rewardable sequences without repeats are unranked as by removing the chosen states from lists of unused states, for a large number of states per independent set."""
+        print("\033[32;1;4mTEST_UNRANK_SEQUENCES_LARGE_MAXIMUM\033[0m")
+        rng = np.random.RandomState(0)
+        for maximum, length, diameter in [(2000, 4, 2), (800, 2, 1), (5, 5, 1), (50, 6, 3)]:
+            permutations = [maximum - i // diameter for i in range(length)]
+            num_possible_permutations = int(np.prod(permutations, dtype=np.int64))
+            nums = rng.randint(num_possible_permutations, size=500, dtype=np.int64)
+            states = unrank_sequences(nums, permutations, diameter)
+            self.assertEqual(states.shape, (500, length))
+            for num, sequence in zip(nums, states):
+                unused = [list(range(maximum)) for i in range(diameter)]
+                expected = []
+                for i, num_choices in enumerate(permutations):
+                    expected.append(unused[i % diameter].pop(num % num_choices))
+                    num //= num_choices
+                self.assertEqual(sequence.tolist(), expected)
+
+
+    def test_custom_reward_function_state_sequence(self):
+        """Tests that custom reward functions are called with, and get_augmented_state() returns, a list of states in which padding is NaN, not the -1 that the augmented state buffer is padded with."""
+        print("\033[32;1;4mTEST_CUSTOM_REWARD_FUNCTION_STATE_SEQUENCE\033[0m")
+        state_sequences = []
+
+        def reward_function(state_sequence, action):
+            state_sequences.append(state_sequence)
+            return 0.0
 
+        config = {}
+        config["log_filename"] = log_filename
+        config["seed"] = 0
+        config["state_space_type"] = "discrete"
+        config["action_space_type"] = "discrete"
+        config["state_space_size"] = 8
+        config["action_space_size"] = 8
+        config["delay"] = 1
+        config["sequence_length"] = 2
+        config["use_custom_mdp"] = True
+        config["transition_function"] = lambda s, a: a
+        config["reward_function"] = reward_function
+        config["init_state_dist"] = np.array([1 / 8 for i in range(8)])
+        config["terminal_states"] = []
+
+        env = RLToyEnv(**config)
+        init_state = env.curr_state
+        for action in [3, 5, 7, 1]:
+            env.step(action)
+
+        self.assertEqual(len(state_sequences), 4)
+        for state_sequence in state_sequences:
+            self.assertIsInstance(state_sequence, list)
+            self.assertEqual(len(state_sequence), env.augmented_state_length)
+        self.assertTrue(np.isnan(state_sequences[0][0]))
+        self.assertTrue(np.isnan(state_sequences[0][1]))
+        self.assertEqual(state_sequences[0][2:], [init_state, 3])
+        self.assertTrue(np.isnan(state_sequences[1][0]))
+        self.assertEqual(state_sequences[1][1:], [init_state, 3, 5])
+        self.assertEqual(state_sequences[2], [init_state, 3, 5, 7])
+        self.assertEqual(state_sequences[3], [3, 5, 7, 1])
+        # The public augmented state is padded with NaN, while the environment's
+        # own ring buffer is padded with -1
+        env.reset()
+        augmented_state = env.get_augmented_state()["augmented_state"]
+        self.assertIsInstance(augmented_state, list)
+        self.assertTrue(np.isnan(augmented_state[0]))
+        self.assertEqual(augmented_state[-1], env.curr_state)
+        self.assertEqual(env.augmented_state[0], -1)
+        env.close()
+
+        config = {}
+        config["log_filename"] = log_filename
+        config["seed"] = 0
+        config["state_space_type"] = "continuous"
+        config["action_space_type"] = "continuous"
+        config["state_space_dim"] = 2
+        config["action_space_dim"] = 2
+        config["delay"] = 1
+        config["sequence_length"] = 1
+        config["reward_function"] = "move_to_a_point"
+        config["target_point"] = [0, 0]
+        config["target_radius"] = 0.05
+        config["transition_dynamics_order"] = 1
+        config["inertia"] = 1
+        config["time_unit"] = 1
+        env = RLToyEnv(**config)
+        env.step(np.array([0.5, 0.5]))
+        state_sequence = env.get_augmented_state_list()
+        self.assertEqual(len(state_sequence), 3)
+        self.assertTrue(np.all(np.isnan(state_sequence[0])))
+        self.assertIsInstance(state_sequence[1], np.ndarray)
+        np.testing.assert_allclose(state_sequence[2], env.curr_state)
+        augmented_state = env.get_augmented_state()["augmented_state"]
+        self.assertTrue(np.all(np.isnan(augmented_state[0])))
+        np.testing.assert_array_equal(augmented_state[1:], state_sequence[1:])
+        env.close()
+
+        config = {}
+        config["log_filename"] = log_filename
+        config["seed"] = 0
+        config["state_space_type"] = "grid"
+        config["grid_shape"] = (8, 8)
+        config["delay"] = 1
+        config["sequence_length"] = 1
+        config["reward_function"] = "move_to_a_point"
+        config["target_point"] = [5, 5]
+        env = RLToyEnv(**config)
+        env.step([1, 0])
+        augmented_state = env.get_augmented_state()["augmented_state"]
+        self.assertEqual(len(augmented_state), 3)
+        self.assertTrue(np.all(np.isnan(augmented_state[0])))
+        self.assertEqual(augmented_state[2], list(env.curr_state[:2]))
+        self.assertEqual(env.augmented_state[0, 0], -1)
+        env.close()
 
 if __name__ == "__main__":
     unittest.main()
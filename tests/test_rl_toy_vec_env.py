@@ -0,0 +1,283 @@
+import copy
+from datetime import datetime
+import numpy as np
+from mdp_playground.envs.rl_toy_env import RLToyEnv
+from mdp_playground.envs.rl_toy_vec_env import RLToyVecEnv
+import unittest
+
+
+log_filename = (
+    "/tmp/test_rl_toy_vec_env_"
+    + datetime.today().strftime("%m.%d.%Y_%I:%M:%S_%f")
+    + ".log"
+)
+
+
+class TestRLToyVecEnv(unittest.TestCase):
+    def compare_with_scalar_envs(
+        self, config, seeds, actions, exact=True, list_actions=False
+    ):
+        """Steps an RLToyVecEnv and len(seeds) scalar RLToyEnvs with the same
+        configs with the given batches of actions and checks that they return
+        the same observations, rewards and dones. The scalar envs are reset
+        when they are done to mirror the auto-reset of the vectorised env."""
+        vec_env = RLToyVecEnv(seeds=seeds, **copy.deepcopy(config))
+        envs = []
+        for seed in seeds:
+            config_ = copy.deepcopy(config)
+            config_["seed"] = seed
+            envs.append(RLToyEnv(**config_))
+
+        if exact:
+            assert_equal = np.testing.assert_array_equal
+        else:
+            def assert_equal(x, y, err_msg=""):
+                np.testing.assert_allclose(x, y, rtol=1e-6, atol=1e-7, err_msg=err_msg)
+
+        obs = vec_env.reset()
+        for i, env in enumerate(envs):
+            assert_equal(obs[i], np.asarray(env.reset()))
+
+        total_dones = 0
+        for t, batch_actions in enumerate(actions):
+            obs, rewards, dones, info = vec_env.step(batch_actions)
+            self.assertEqual(rewards.shape, (len(seeds),))
+            self.assertEqual(dones.shape, (len(seeds),))
+            for i, env in enumerate(envs):
+                err_msg = "Mismatch for env " + str(i) + " in time step " + str(t)
+                action = batch_actions[i]
+                if list_actions:
+                    action = action.tolist()
+                next_obs, reward, done, _ = env.step(action)
+                self.assertEqual(dones[i], done, msg=err_msg)
+                assert_equal(rewards[i], reward, err_msg=err_msg)
+                if done:
+                    total_dones += 1
+                    assert_equal(
+                        info["terminal_observation"][i],
+                        np.asarray(next_obs),
+                        err_msg=err_msg,
+                    )
+                    next_obs = env.reset()
+                assert_equal(obs[i], np.asarray(next_obs), err_msg=err_msg)
+
+        vec_env.close()
+        return total_dones
+
+    def test_discrete_vec_env(self):
+        """ """
+        print("\033[32;1;4mTEST_DISCRETE_VEC_ENV\033[0m")
+        config = {}
+        config["log_filename"] = log_filename
+        config["state_space_type"] = "discrete"
+        config["action_space_size"] = 8
+        config["delay"] = 1
+        config["sequence_length"] = 3
+        config["reward_scale"] = 2.5
+        config["reward_shift"] = -1.0
+        config["reward_density"] = 0.25
+        config["make_denser"] = True
+        config["terminal_state_density"] = 0.25
+        config["term_state_reward"] = 3.0
+        config["transition_noise"] = 0.1
+        config["reward_noise"] = 0.5
+        config["repeats_in_sequences"] = False
+        config["generate_random_mdp"] = True
+
+        seeds = [0, 1, 2, 3]
+        rng = np.random.RandomState(0)
+        actions = rng.randint(8, size=(200, len(seeds)))
+        total_dones = self.compare_with_scalar_envs(config, seeds, actions)
+        self.assertGreater(total_dones, 0)
+
+        # Same generated MDP for all envs, with diameter > 1
+        config["diameter"] = 2
+        config["reward_dist"] = [0.1, 1.0]
+        config["reward_every_n_steps"] = True
+        seeds = [5, 5, 5]
+        actions = rng.randint(8, size=(200, len(seeds)))
+        self.compare_with_scalar_envs(config, seeds, actions)
+
+    def test_discrete_vec_env_irr_features(self):
+        """ """
+        print("\033[32;1;4mTEST_DISCRETE_VEC_ENV_IRR_FEATURES\033[0m")
+        config = {}
+        config["log_filename"] = log_filename
+        config["state_space_type"] = "discrete"
+        config["action_space_size"] = [8, 10]
+        config["irrelevant_features"] = True
+        config["delay"] = 0
+        config["sequence_length"] = 2
+        config["transition_noise"] = 0.2
+        config["maximally_connected"] = False
+        config["generate_random_mdp"] = True
+
+        seeds = [0, 7]
+        rng = np.random.RandomState(1)
+        actions = np.stack(
+            [
+                rng.randint(8, size=(100, len(seeds))),
+                rng.randint(10, size=(100, len(seeds))),
+            ],
+            axis=2,
+        )
+        self.compare_with_scalar_envs(config, seeds, actions)
+
+    def test_discrete_vec_env_image_representations(self):
+        """ """
+        print("\033[32;1;4mTEST_DISCRETE_VEC_ENV_IMAGE_REPRESENTATIONS\033[0m")
+        config = {}
+        config["log_filename"] = log_filename
+        config["state_space_type"] = "discrete"
+        config["action_space_size"] = 4
+        config["image_representations"] = True
+        config["image_transforms"] = "shift,scale,rotate,flip"
+        config["image_width"] = 40
+        config["image_height"] = 40
+        config["image_sh_quant"] = 2
+        config["image_ro_quant"] = 45
+        config["image_scale_range"] = (0.5, 1.0)
+        config["delay"] = 0
+        config["sequence_length"] = 1
+        config["generate_random_mdp"] = True
+
+        seeds = [0, 1]
+        rng = np.random.RandomState(2)
+        actions = rng.randint(4, size=(20, len(seeds)))
+        self.compare_with_scalar_envs(config, seeds, actions)
+
+    def test_continuous_vec_env_move_along_a_line(self):
+        """ """
+        print("\033[32;1;4mTEST_CONTINUOUS_VEC_ENV_MOVE_ALONG_A_LINE\033[0m")
+        config = {}
+        config["log_filename"] = log_filename
+        config["state_space_type"] = "continuous"
+        config["action_space_type"] = "continuous"
+        config["state_space_dim"] = 3
+        config["action_space_dim"] = 3
+        config["transition_dynamics_order"] = 2
+        config["inertia"] = 2.0
+        config["time_unit"] = 0.5
+        config["state_space_max"] = 5.0
+        config["action_space_max"] = 1.0
+        config["delay"] = 1
+        config["sequence_length"] = 3
+        config["reward_scale"] = 0.5
+        config["transition_noise"] = 0.05
+        config["reward_function"] = "move_along_a_line"
+
+        seeds = [0, 1, 2]
+        rng = np.random.RandomState(3)
+        # Some actions are out of the action space bounds
+        actions = rng.uniform(-1.1, 1.1, size=(50, len(seeds), 3)).astype(np.float32)
+        # The distances from the fit line are computed in a batched way and may
+        # differ in the last bits from those computed with np.dot()
+        self.compare_with_scalar_envs(config, seeds, actions, exact=False)
+
+    def test_continuous_vec_env_move_to_a_point(self):
+        """ """
+        print("\033[32;1;4mTEST_CONTINUOUS_VEC_ENV_MOVE_TO_A_POINT\033[0m")
+        config = {}
+        config["log_filename"] = log_filename
+        config["state_space_type"] = "continuous"
+        config["action_space_type"] = "continuous"
+        config["state_space_dim"] = 2
+        config["action_space_dim"] = 2
+        config["transition_dynamics_order"] = 1
+        config["state_space_max"] = 2.0
+        config["action_space_max"] = 0.5
+        config["delay"] = 0
+        config["sequence_length"] = 1
+        config["reward_function"] = "move_to_a_point"
+        config["target_point"] = [0.5, -0.5]
+        config["target_radius"] = 0.5
+        config["terminal_states"] = [[-1.5, 1.5]]
+        config["term_state_edge"] = 1.0
+        config["action_loss_weight"] = 0.1
+        config["reward_noise"] = lambda rng: rng.normal(0, 0.1)
+
+        seeds = [0, 1, 2, 3]
+        rng = np.random.RandomState(4)
+        actions = rng.uniform(-0.5, 0.5, size=(100, len(seeds), 2)).astype(
+            np.float32
+        )
+        for make_denser in [True, False]:
+            config["make_denser"] = make_denser
+            total_dones = self.compare_with_scalar_envs(config, seeds, actions)
+            self.assertGreater(total_dones, 0)
+
+    def test_grid_vec_env(self):
+        """ """
+        print("\033[32;1;4mTEST_GRID_VEC_ENV\033[0m")
+        config = {}
+        config["log_filename"] = log_filename
+        config["state_space_type"] = "grid"
+        config["grid_shape"] = (5, 5)
+        config["reward_function"] = "move_to_a_point"
+        config["target_point"] = [2, 2]
+        config["terminal_states"] = [[0, 4]]
+        config["transition_noise"] = 0.25
+        config["reward_scale"] = 2.0
+        config["sequence_length"] = 1
+        config["delay"] = 0
+
+        seeds = [0, 1, 2, 3, 4]
+        rng = np.random.RandomState(5)
+        directions = np.array([[0, 0], [1, 0], [-1, 0], [0, 1], [0, -1], [1, 1]])
+        actions = directions[rng.randint(len(directions), size=(100, len(seeds)))]
+        for make_denser in [True, False]:
+            config["make_denser"] = make_denser
+            total_dones = self.compare_with_scalar_envs(
+                config, seeds, actions, list_actions=True
+            )
+            self.assertGreater(total_dones, 0)
+
+    def test_vec_env_custom_mdp_and_event_hooks(self):
+        """Tests that environments with custom MDPs or event_hooks are stepped one after the other and match scalar RLToyEnvs."""
+        print("\033[32;1;4mTEST_VEC_ENV_CUSTOM_MDP_AND_EVENT_HOOKS\033[0m")
+        config = {}
+        config["log_filename"] = log_filename
+        config["state_space_type"] = "discrete"
+        config["action_space_type"] = "discrete"
+        config["action_space_size"] = 2
+        config["state_space_size"] = 3
+        config["use_custom_mdp"] = True
+        config["transition_function"] = np.array([[1, 0], [2, 0], [0, 1]])
+        config["reward_function"] = np.array([[0.0, 1.0], [1.0, 0.0], [2.0, 0.0]])
+        config["init_state_dist"] = np.array([0.5, 0.5, 0.0])
+        config["terminal_states"] = [2]
+        config["transition_noise"] = 0.2
+        config["reward_noise"] = lambda rng: rng.normal(0, 0.1)
+        seeds = [0, 1, 2]
+        actions = np.random.RandomState(0).randint(2, size=(50, len(seeds)))
+        vec_env = RLToyVecEnv(seeds=seeds, **copy.deepcopy(config))
+        self.assertTrue(vec_env.step_scalar_envs)
+        total_dones = self.compare_with_scalar_envs(config, seeds, actions)
+        self.assertGreater(total_dones, 0)
+
+        # event_hooks of generated MDPs are called by the underlying environments
+        events = []
+        config = {}
+        config["log_filename"] = log_filename
+        config["state_space_type"] = "discrete"
+        config["action_space_type"] = "discrete"
+        config["action_space_size"] = 4
+        config["state_space_size"] = 4
+        config["terminal_state_density"] = 0.25
+        config["event_hooks"] = [lambda event, data: events.append(event)]
+        vec_env = RLToyVecEnv(seeds=[0, 1], **config)
+        self.assertTrue(vec_env.step_scalar_envs)
+        events[:] = []
+        vec_env.reset()
+        self.assertEqual(events, ["reset", "reset"])
+        obs, rewards, dones, info = vec_env.step(np.array([0, 1]))
+        self.assertEqual(obs.shape, (2,))
+        self.assertEqual(events[2:4], ["step", "step"])
+        config["event_hooks"] = []
+        total_dones = self.compare_with_scalar_envs(
+            config, [0, 1], np.random.RandomState(1).randint(4, size=(30, 2))
+        )
+        self.assertGreater(total_dones, 0)
+
+if __name__ == "__main__":
+    unittest.main()